@@ -1,10 +1,20 @@
+import time
+import uuid
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
 from utils import bedrock_wrapper
 from utils import review_analyzer
+from utils import llm_cache
+from utils import review_store
+from utils import jobs
+from utils import issue_store
+from utils import prefilter
+from utils import progress
+from utils import telemetry
 from utils.menu import menu
 from utils.bedrock import get_bedrock_client, list_bedrock_model_regions, list_translate_models
+from utils.batching import input_token_budget
 
 menu()
 
@@ -15,14 +25,150 @@ with st.sidebar.expander("Bedrock Settings"):
     regions = list_bedrock_model_regions()
     selected_region = st.selectbox("Select Bedrock Region", options=regions, index=0)
     client = get_bedrock_client(region=selected_region)
+    multi_region = st.checkbox("Use All Regions", value=False,
+                               help=f"Spread analysis calls across {', '.join(regions)}, failing over when a region throttles")
 
     models = list_translate_models()
     model_id = st.selectbox("Select Model Id", options=models, index=0)
     max_tokens = st.number_input("Max Tokens", min_value=1, value=4096)
     temperature = st.slider("Temperature", min_value=0.0, max_value=1.0, value=0.0, step=0.1)
     top_p = st.slider("Top P", min_value=0.0, max_value=1.0, value=0.9, step=0.1)
+    # Sent with every call, and part of the pooled chat's key (see bedrock_wrapper.get_bedrock_chat)
+    model_kwargs = {"max_tokens": max_tokens, "temperature": temperature, "top_p": top_p}
+    # Region health of the chat of the selected model and parameters, once they are known
+    if multi_region:
+        for region, region_stats in bedrock_wrapper.get_multi_region_bedrock_chat(
+                model_id=model_id, regions=regions, model_kwargs=model_kwargs).stats().items():
+            st.caption(f"{region}: {'healthy' if region_stats['healthy'] else 'cooling down'}, "
+                       f"{region_stats['calls']} calls, {region_stats['throttles']} throttles, "
+                       f"{region_stats['tokens_per_minute']} tokens/min")
+    max_concurrency = st.number_input("Max Concurrency", min_value=1, max_value=32, value=review_analyzer.DEFAULT_MAX_CONCURRENCY,
+                                      help="Maximum number of Bedrock calls in flight at once")
+    token_budget = input_token_budget(model_id, max_tokens)
+    incremental = st.checkbox("Incremental Analysis", value=False,
+                              help="Version analysis only sends reviews not analyzed before to the model, and merges their issues into the stored results")
+    cluster = st.checkbox("Local Clustering", value=False,
+                          help="Version analysis clusters similar reviews locally and only sends representative reviews of each cluster to the model to name its issue, with exact counts")
+    margin_of_error = st.selectbox("Sampling", options=[None, 0.02, 0.03, 0.05], disabled=incremental,
+                                   format_func=lambda margin: "All reviews" if margin is None else f"Sample, ±{margin:.0%} margin of error",
+                                   help="Version analysis only sends a stratified sample of each version's reviews (by language, rating and day) to the model, and scales the counts back with confidence intervals")
+    store_stats = issue_store.get_default_store().stats()
+    st.caption(f"Stored results: {store_stats['groups']} groups, {store_stats['reviews']} reviews")
+
+    response_cache = llm_cache.get_default_cache()
+    if response_cache is not None:
+        cache_stats = response_cache.stats()
+        st.caption(f"LLM cache: {cache_stats['entries']} responses, {cache_stats['hits']} hits / {cache_stats['misses']} misses")
     
+def _init_bedrock_chat():
+    # Pooled BedrockChat of the selected region, or one per configured region, with the sidebar's model parameters,
+    # reused across reruns
+    if multi_region:
+        return bedrock_wrapper.get_multi_region_bedrock_chat(model_id=model_id, regions=regions, model_kwargs=model_kwargs)
+    return bedrock_wrapper.get_bedrock_chat(model_id=model_id, region_name=selected_region, model_kwargs=model_kwargs)
+
+def _analyze(analyze_fn, result_key, data, bedrock_chat, max_concurrency, token_budget, **kwargs):
+    # Runs in a background job (see _submit_job), returns the session state to set when it is done.
+    # The analyzer's progress messages become the job's progress, its LLM calls the run's metrics.
+    with progress.use_reporter(progress.CallbackReporter(jobs.report_progress)), telemetry.collect() as metrics:
+        result = {result_key: analyze_fn(data, bedrock_chat, max_concurrency=max_concurrency, token_budget=token_budget, **kwargs)}
+    result['run_metrics'] = metrics
+    return result
+
+def _analyze_and_compare(analyze_fn, compare_fn, analyze_key, compare_key, data, bedrock_chat, target_version, max_concurrency, token_budget, **kwargs):
+    result = _analyze(analyze_fn, analyze_key, data, bedrock_chat, max_concurrency, token_budget, **kwargs)
+    with progress.use_reporter(progress.CallbackReporter(jobs.report_progress)), telemetry.collect(result['run_metrics']):
+        result[compare_key] = compare_fn(target_version, result[analyze_key], bedrock_chat)
+    return result
+
+def _submit_job(label, fn, *args, **kwargs):
+    # The analysis runs in the process-wide job runner, so it survives reruns and widget interactions
+    job_id = jobs.get_default_runner().submit(st.session_state.session_id, label, fn, *args, **kwargs)
+    st.session_state.job_ids.append(job_id)
+
+def _version_analysis_args(analyze_rating):
+    # Version results are stored per app and ratings (see issue_store.IssueStore), so changing the target or
+    # adding a baseline only analyzes the versions without a stored result of the same reviews
+    rawdata = st.session_state.rawdata
+    app = str(rawdata['Package Name'].iloc[0]) if 'Package Name' in rawdata and len(rawdata) else None
+    return {'store': issue_store.get_default_store(), 'scope': {'app': app, 'ratings': sorted(analyze_rating)},
+            'incremental': incremental, 'cluster': cluster, 'margin_of_error': None if incremental else margin_of_error}
+
+@st.fragment(run_every=2)
+def _show_jobs():
+    runner = jobs.get_default_runner()
+    job_list = [job for job in (runner.get(job_id) for job_id in st.session_state.job_ids) if job is not None]
+    if not job_list:
+        return
+    finished_job = False
+    with st.expander("分析任务", expanded=True, icon="⏳"):
+        for job in job_list:
+            elapsed = (job['finished_at'] or time.time()) - (job['started_at'] or job['created_at'])
+            if job['status'] == jobs.DONE:
+                if job['id'] not in st.session_state.applied_job_ids:
+                    # Results become session state once, the app is rerun below to render the reports
+                    st.session_state.update(runner.result(job['id']))
+                    st.session_state.applied_job_ids.add(job['id'])
+                    finished_job = True
+                st.caption(f"✅ {job['label']}: 完成 ({elapsed:.0f}s)")
+            elif job['status'] == jobs.FAILED:
+                st.error(f"{job['label']}: 失败", icon="🚨")
+                with st.popover("查看错误"):
+                    st.code(job['error'])
+            elif job['status'] == jobs.CANCELLED:
+                st.caption(f"🚫 {job['label']}: 已取消")
+            else:
+                col_status, col_cancel = st.columns([4, 1])
+                col_status.caption(f"⏳ {job['label']}: {job['progress'] or job['status']} ({elapsed:.0f}s)")
+                if job['status'] == jobs.QUEUED and col_cancel.button("取消", key=f"cancel_{job['id']}"):
+                    runner.cancel(job['id'])
+    if finished_job:
+        st.rerun()
+
+def _show_run_metrics():
+    # Token, latency and cost of the LLM calls of the last finished analysis, see telemetry.RunMetrics
+    metrics = st.session_state.run_metrics
+    if metrics is None or not metrics.calls:
+        return
+    totals = metrics.totals()
+    with st.expander("调用统计 (最近一次分析)", expanded=False, icon="📊"):
+        col_calls, col_tokens, col_cost, col_latency = st.columns(4)
+        col_calls.metric("Calls", totals['calls'], help=f"{totals['cached']} cached, {totals['retries']} retries")
+        col_tokens.metric("Tokens in / out", f"{totals['input_tokens']} / {totals['output_tokens']}")
+        col_cost.metric("Cost (USD)", f"{totals['cost']:.4f}")
+        col_latency.metric("Call time", f"{totals['latency']:.0f}s")
+        st.markdown('**按阶段**')
+        st.dataframe(metrics.summary('stage'))
+        st.markdown('**按分组**')
+        st.dataframe(metrics.summary('group'))
+        col_csv, col_json = st.columns(2)
+        col_csv.download_button("Download CSV", metrics.to_csv(), file_name="run_metrics.csv", mime="text/csv")
+        col_json.download_button("Download JSON", metrics.to_json(), file_name="run_metrics.json", mime="application/json")
+
+def _show_reports(result, title=''):
+    # Analysis results are nested dicts (by language and/or version) ending with {'xmldata', 'issues', 'report'}
+    if 'report' in result:
+        st.success(f"分析报告: {title}" if title else "分析报告", icon="✅")
+        if result.get('skipped'):
+            st.caption(f"跳过无有效内容的评论: {prefilter.describe_skipped(result['skipped'])}")
+        st.markdown(result['report'])
+        return
+    for key, value in result.items():
+        if isinstance(value, dict):
+            _show_reports(value, f"{title} {key}".strip())
+
 def _init_session_state():
+    # Background analysis jobs of this session, see _submit_job
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'job_ids' not in st.session_state:
+        st.session_state.job_ids = []
+    if 'applied_job_ids' not in st.session_state:
+        st.session_state.applied_job_ids = set()
+    # Per-call metrics of the last finished analysis, see _analyze
+    if 'run_metrics' not in st.session_state:
+        st.session_state.run_metrics = None
+
     # Store the original data from uploaded CSV files
     if 'rawdata' not in st.session_state:
         st.session_state.rawdata = None
@@ -41,6 +187,8 @@ def _init_session_state():
         st.session_state.analyze_result_by_lang={}
     if 'compare_result_by_lang' not in st.session_state:
         st.session_state.compare_result_by_lang={}
+    if 'analyze_result_by_time' not in st.session_state:
+        st.session_state.analyze_result_by_time={}
 
 def _show_review_data_statics(data):
     st.info(f"数据集信息: {len(data)}行", icon="ℹ️")
@@ -100,12 +248,10 @@ def _analyze_reviews_by_version():
     st.write('待分析数据: ', len(version_analyze_target_df))
     
     if st.button("点击这个按钮，使用LLM分析评论(所有语言的数据，按照版本分析)", type="primary", use_container_width=True):
-        with st.status("分析评论...", expanded=True):
-            bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=model_id, region_name=selected_region)
-            st.success("初始化 Bedrock", icon="✅")
-            
-            st.session_state.analyze_result = review_analyzer.analyze_data(version_analyze_target_df, bedrock_chat)
-            st.session_state.compare_result = review_analyzer.compare_target_data(st.session_state.target_version, st.session_state.analyze_result, bedrock_chat)
+        _submit_job(f"版本分析: 目标版本{st.session_state.target_version}", _analyze_and_compare,
+                    review_analyzer.analyze_data, review_analyzer.compare_target_data, 'analyze_result', 'compare_result',
+                    version_analyze_target_df, _init_bedrock_chat(), st.session_state.target_version, max_concurrency, token_budget,
+                    **_version_analysis_args(analyze_rating))
     
     with st.container(border=True):
         if st.session_state.analyze_result != {}:
@@ -129,11 +275,10 @@ def _analyze_reviews_by_version():
     
     st.divider()
     if st.button("点击这个按钮，使用LLM分析目标语言评论(选定语言的数据，按照语言/版本分析)", type="primary", use_container_width=True):
-        with st.status("分析目标语言评论...", expanded=True):
-            st.success("初始化 Bedrock", icon="✅")
-            bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=model_id, region_name=selected_region)
-            st.session_state.analyze_result_by_lang = review_analyzer.analyze_data_by_lang(lang_version_analyze_target_df, bedrock_chat)
-            st.session_state.compare_result_by_lang = review_analyzer.compare_target_data_by_lang(st.session_state.target_version, st.session_state.analyze_result_by_lang, bedrock_chat)
+        _submit_job(f"语言/版本分析: 目标版本{st.session_state.target_version}", _analyze_and_compare,
+                    review_analyzer.analyze_data_by_lang, review_analyzer.compare_target_data_by_lang, 'analyze_result_by_lang', 'compare_result_by_lang',
+                    lang_version_analyze_target_df, _init_bedrock_chat(), st.session_state.target_version, max_concurrency, token_budget,
+                    **_version_analysis_args(analyze_rating))
     
     with st.container(border=True):
         if st.session_state.analyze_result_by_lang != {}:
@@ -162,7 +307,7 @@ def _analyze_reviews_by_time(data):
     )
     
     # Filter data based on selected date range
-    date_filtered_data = data[(data['Review Date'].dt.date >= date_range[0]) & (data['Review Date'].dt.date <= date_range[1])]
+    date_filtered_data = data[data['Review Date'].between(pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1]))]
     st.write('选择数据量: ', len(date_filtered_data))
     
     _show_data_by_rating(date_filtered_data)
@@ -182,10 +327,8 @@ def _analyze_reviews_by_time(data):
         
         st.write('待分析数据量: ', len(date_rating_version_filtered_data))
         if st.button("点击这个按钮，使用LLM分析评论(所有语言，按版本分析)", type="primary", use_container_width=True, key='date_analyze_button_with_version'):
-            with st.status("分析评论...", expanded=True):
-                bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=model_id, region_name=selected_region)
-                st.success("初始化 Bedrock", icon="✅")                
-                st.session_state.analyze_result_by_time = review_analyzer.analyze_data(date_rating_version_filtered_data, bedrock_chat)
+            _submit_job("按时间分析: 所有语言, 按版本", _analyze, review_analyzer.analyze_data, 'analyze_result_by_time',
+                        date_rating_version_filtered_data, _init_bedrock_chat(), max_concurrency, token_budget)
         st.divider()
         st.info('按语言筛选数据分析', icon="ℹ️")
         all_lang = st.session_state.reviewdata['Reviewer Language'].value_counts()
@@ -197,17 +340,13 @@ def _analyze_reviews_by_time(data):
         st.write('待分析数据: ', len(date_rating_version_lang_filtered_data))
         
         if st.button("点击这个按钮，使用LLM 分析选中语言的评论(按版本聚类，按语言聚类)", type="primary", use_container_width=True, key='date_analyze_button_by_lang_with_version'):
-            with st.status("分析评论...", expanded=True):
-                bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=model_id, region_name=selected_region)
-                st.success("初始化 Bedrock", icon="✅")
-                review_analyzer.analyze_data_by_lang(date_rating_version_lang_filtered_data, bedrock_chat)
-                # st.session_state.analyze_result_by_time = review_analyzer.analyze_data_without_version(date_rating_version_lang_filtered_data, bedrock_chat)
+            _submit_job("按时间分析: 选中语言, 按语言/版本", _analyze, review_analyzer.analyze_data_by_lang, 'analyze_result_by_time',
+                        date_rating_version_lang_filtered_data, _init_bedrock_chat(), max_concurrency, token_budget)
+            # st.session_state.analyze_result_by_time = review_analyzer.analyze_data_without_version(date_rating_version_lang_filtered_data, bedrock_chat)
     else:
         if st.button("点击这个按钮，使用LLM分析评论(所有语种,忽略版本信息)", type="primary", use_container_width=True, key='date_analyze_button_without_version'):
-            with st.status("分析评论...", expanded=True):
-                bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=model_id, region_name=selected_region)
-                st.success("初始化 Bedrock", icon="✅")              
-                st.session_state.analyze_result_by_time = review_analyzer.analyze_data_without_version(date_rating_filtered_data, bedrock_chat)
+            _submit_job("按时间分析: 所有语言, 忽略版本", _analyze, review_analyzer.analyze_data_without_version, 'analyze_result_by_time',
+                        date_rating_filtered_data, _init_bedrock_chat(), max_concurrency, token_budget)
     
         st.divider()
         st.info('按语言筛选数据分析', icon="ℹ️")
@@ -220,38 +359,29 @@ def _analyze_reviews_by_time(data):
         st.write('待分析数据: ', len(date_rating_lang_filtered_data))
 
         if st.button("点击这个按钮，使用LLM分析评论(按选中的语言聚类，忽略版本信息)", type="primary", use_container_width=True, key='date_analyze_button_by_lang_without_version'):
-            with st.status("分析评论...", expanded=True):
-                bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=model_id, region_name=selected_region)
-                st.success("初始化 Bedrock", icon="✅")              
-                review_analyzer.analyze_data_without_version_by_lang(date_rating_lang_filtered_data, bedrock_chat)
+            _submit_job("按时间分析: 选中语言, 忽略版本", _analyze, review_analyzer.analyze_data_without_version_by_lang, 'analyze_result_by_time',
+                        date_rating_lang_filtered_data, _init_bedrock_chat(), max_concurrency, token_budget)
+
+    with st.container(border=True):
+        _show_reports(st.session_state.analyze_result_by_time)
     
 
 st.header("Google Play 应用商店评论分析")
 _init_session_state()
+_show_jobs()
+_show_run_metrics()
 
 uploaded_file_list = st.file_uploader("上传一个或多个文件", accept_multiple_files=True)
 if len(uploaded_file_list)>0:
-    # init st.session_state.rawdata
-    dfs = []
-    for csv_file in uploaded_file_list:
-        df = pd.read_csv(csv_file, encoding='utf-16')
-        dfs.append(df)
-    st.session_state.rawdata = pd.concat(dfs, ignore_index=True)
-    st.session_state.rawdata.drop_duplicates(keep='first', inplace=True)
+    # init st.session_state.rawdata and st.session_state.reviewdata, parsed once per export and cached (see review_store.load_reviews)
+    st.session_state.rawdata = review_store.load_raw_reviews(uploaded_file_list)
+    st.session_state.reviewdata = review_store.load_reviews(uploaded_file_list)
     
     # show raw data if user want to
     st.divider()
     if st.checkbox('Show raw data'):
         st.write(st.session_state.rawdata)
         
-    # init st.session_state.reviewdata
-    st.session_state.reviewdata = st.session_state.rawdata
-    st.session_state.reviewdata['App Version Code']= st.session_state.reviewdata['App Version Code'].astype(str)
-    st.session_state.reviewdata['App Version Code'] = st.session_state.reviewdata['App Version Code'].fillna('N/A')
-    st.session_state.reviewdata['Review Last Update Date and Time'] = pd.to_datetime(st.session_state.reviewdata['Review Last Update Date and Time'], format='mixed')
-    st.session_state.reviewdata['Review Date'] = pd.to_datetime(st.session_state.reviewdata['Review Last Update Date and Time'].dt.date)
-    st.session_state.reviewdata=st.session_state.reviewdata[['App Version Code', 'Reviewer Language', 'Device', 'Review Date', 
-                                'Star Rating', 'Review Title','Review Text']]
     _show_review_data_statics(st.session_state.reviewdata)
     
     
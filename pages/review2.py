@@ -8,6 +8,7 @@ import time
 from datetime import datetime, timedelta
 from utils import bedrock_wrapper
 from utils import review_analyzer
+from utils import review_store
 
 REGION = 'us-west-2'
 
@@ -92,7 +93,7 @@ def _analyze_reviews_by_version():
         with st.status("分析评论...", expanded=True):
             sonnet_id = "anthropic.claude-3-sonnet-20240229-v1:0"
             region_name = REGION
-            bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=sonnet_id, region_name=region_name)
+            bedrock_chat = bedrock_wrapper.get_bedrock_chat(model_id=sonnet_id, region_name=region_name)
             st.success("初始化 Bedrock", icon="✅")
             
             st.session_state.analyze_result = review_analyzer.analyze_data(version_analyze_target_df, bedrock_chat)
@@ -124,7 +125,7 @@ def _analyze_reviews_by_version():
             st.success("初始化 Bedrock", icon="✅")
             sonnet_id = "anthropic.claude-3-sonnet-20240229-v1:0"
             region_name = REGION
-            bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=sonnet_id, region_name=region_name)
+            bedrock_chat = bedrock_wrapper.get_bedrock_chat(model_id=sonnet_id, region_name=region_name)
             st.session_state.analyze_result_by_lang = review_analyzer.analyze_data_by_lang(lang_version_analyze_target_df, bedrock_chat)
             st.session_state.compare_result_by_lang = review_analyzer.compare_target_data_by_lang(st.session_state.target_version, st.session_state.analyze_result_by_lang, bedrock_chat)
     
@@ -156,7 +157,7 @@ def _analyze_reviews_by_time(data):
     )
     
     # Filter data based on selected date range
-    date_filtered_data = data[(data['Review Date'].dt.date >= date_range[0]) & (data['Review Date'].dt.date <= date_range[1])]
+    date_filtered_data = data[data['Review Date'].between(pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1]))]
     st.write('选择数据量: ', len(date_filtered_data))
     
     _show_data_by_rating(date_filtered_data)
@@ -179,7 +180,7 @@ def _analyze_reviews_by_time(data):
             with st.status("分析评论...", expanded=True):
                 sonnet_id = "anthropic.claude-3-sonnet-20240229-v1:0"
                 region_name = REGION
-                bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=sonnet_id, region_name=region_name)
+                bedrock_chat = bedrock_wrapper.get_bedrock_chat(model_id=sonnet_id, region_name=region_name)
                 st.success("初始化 Bedrock", icon="✅")
                 
                 st.session_state.analyze_result_by_time = review_analyzer.analyze_data(date_rating_version_filtered_data, bedrock_chat)
@@ -188,7 +189,7 @@ def _analyze_reviews_by_time(data):
             with st.status("分析评论...", expanded=True):
                 sonnet_id = "anthropic.claude-3-sonnet-20240229-v1:0"
                 region_name = REGION
-                bedrock_chat = bedrock_wrapper.init_bedrock_chat(model_id=sonnet_id, region_name=region_name)
+                bedrock_chat = bedrock_wrapper.get_bedrock_chat(model_id=sonnet_id, region_name=region_name)
                 st.success("初始化 Bedrock", icon="✅")
                 
                 # st.session_state.analyze_result_by_time = review_analyzer.analyze_data(date_rating_filtered_data, bedrock_chat)
@@ -203,27 +204,15 @@ _init_session_state()
 
 uploaded_file_list = st.file_uploader("上传一个或多个文件", accept_multiple_files=True)
 if len(uploaded_file_list)>0:
-    # init st.session_state.rawdata
-    dfs = []
-    for csv_file in uploaded_file_list:
-        df = pd.read_csv(csv_file, encoding='utf-16')
-        dfs.append(df)
-    st.session_state.rawdata = pd.concat(dfs, ignore_index=True)
-    st.session_state.rawdata.drop_duplicates(keep='first', inplace=True)
+    # init st.session_state.rawdata and st.session_state.reviewdata, parsed once per export and cached (see review_store.load_reviews)
+    st.session_state.rawdata = review_store.load_raw_reviews(uploaded_file_list)
+    st.session_state.reviewdata = review_store.load_reviews(uploaded_file_list)
     
     # show raw data if user want to
     st.divider()
     if st.checkbox('Show raw data'):
         st.write(st.session_state.rawdata)
         
-    # init st.session_state.reviewdata
-    st.session_state.reviewdata = st.session_state.rawdata
-    st.session_state.reviewdata['App Version Code']= st.session_state.reviewdata['App Version Code'].astype(str)
-    st.session_state.reviewdata['App Version Code'] = st.session_state.reviewdata['App Version Code'].fillna('N/A')
-    st.session_state.reviewdata['Review Last Update Date and Time'] = pd.to_datetime(st.session_state.reviewdata['Review Last Update Date and Time'], format='mixed')
-    st.session_state.reviewdata['Review Date'] = pd.to_datetime(st.session_state.reviewdata['Review Last Update Date and Time'].dt.date)
-    st.session_state.reviewdata=st.session_state.reviewdata[['App Version Code', 'Reviewer Language', 'Device', 'Review Date', 
-                                'Star Rating', 'Review Title','Review Text']]
     _show_review_data_statics(st.session_state.reviewdata)
     
     
@@ -0,0 +1,14 @@
+import os
+import unittest
+from unittest.mock import patch
+
+
+class NoCacheTestCase(unittest.TestCase):
+    """TestCase running with the LLM response cache disabled, so that every prompt reaches the chat model."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        env = patch.dict(os.environ, {'REVIEW_ANALYZER_LLM_CACHE': '0'})
+        env.start()
+        cls.addClassCleanup(env.stop)
@@ -0,0 +1,86 @@
+import unittest
+import numpy as np
+import pandas as pd
+from utils.batching import (
+    estimate_tokens, estimate_tokens_series, input_token_budget, pack_rows,
+    encode_rows, measure_encoding, DEFAULT_INPUT_TOKEN_BUDGET, PROMPT_OVERHEAD_TOKENS
+)
+
+class TestEstimateTokens(unittest.TestCase):
+
+    def test_estimate_tokens_latin(self):
+        self.assertEqual(estimate_tokens('Crashes on start'), 5)
+
+    def test_estimate_tokens_cjk_denser_than_latin(self):
+        # Same number of characters, CJK costs ~3x more tokens
+        self.assertGreater(estimate_tokens('启动就闪退启动就闪退'), 2 * estimate_tokens('crashes!!!'))
+
+    def test_estimate_tokens_series(self):
+        tokens = estimate_tokens_series(pd.Series(['abcdefg', None, 'バグ']))
+        self.assertEqual(tokens.tolist(), [2, 0, 2])
+
+
+class TestInputTokenBudget(unittest.TestCase):
+
+    def test_input_token_budget_default_cap(self):
+        self.assertEqual(input_token_budget('anthropic.claude-3-haiku-20240307-v1:0'), DEFAULT_INPUT_TOKEN_BUDGET)
+
+    def test_input_token_budget_reserves_output_tokens(self):
+        budget = input_token_budget('unknown-model', max_tokens=4096, cap=10**9)
+        self.assertEqual(budget, 200000 - 4096 - PROMPT_OVERHEAD_TOKENS)
+
+
+class TestPackRows(unittest.TestCase):
+
+    def test_pack_rows_fills_budget(self):
+        self.assertEqual(pack_rows([40, 40, 40, 200, 10], 100), [(0, 2), (2, 3), (3, 4), (4, 5)])
+
+    def test_pack_rows_empty(self):
+        self.assertEqual(pack_rows([], 100), [])
+
+
+class TestEncodeRows(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'App Version Code': ['1.0', '2.0'],
+            'Review Title': ['A very long review title that pads every row', None],
+            'Review Text': ['Line one\nline two', 'Tabs\tand, commas'],
+        })
+
+    def test_encode_rows_tsv_one_line_per_row(self):
+        header, rows = encode_rows(self.df, 'tsv')
+        self.assertEqual(header, 'App Version Code\tReview Title\tReview Text')
+        self.assertEqual(rows[0], '1.0\tA very long review title that pads every row\tLine one line two')
+        self.assertEqual(rows[1], '2.0\t\tTabs and, commas')
+
+    def test_encode_rows_missing_values_are_empty(self):
+        df = pd.DataFrame({
+            'Star Rating': [1.0, np.nan],
+            'Device': pd.Categorical(['pixel', None]),
+            'Review Text': pd.Series(['ok', np.nan], dtype=object),
+        })
+        for encoder in ('tsv', 'csv'):
+            rows = encode_rows(df, encoder)[1]
+            self.assertNotIn('nan', ''.join(rows))
+            self.assertNotIn('None', ''.join(rows))
+        self.assertEqual(encode_rows(df, 'tsv')[1], ['1.0\tpixel\tok', '\t\t'])
+
+    def test_encode_rows_csv_minimal_quoting(self):
+        header, rows = encode_rows(self.df, 'csv')
+        self.assertEqual(header, 'App Version Code,Review Title,Review Text')
+        self.assertEqual(rows[1], '2.0,,"Tabs and, commas"')
+
+    def test_encode_rows_unknown_encoder(self):
+        with self.assertRaises(ValueError):
+            encode_rows(self.df, 'xml')
+
+    def test_measure_encoding_compact_saves_tokens(self):
+        df = pd.concat([self.df] * 20, ignore_index=True)
+        stats = measure_encoding(df, 'tsv', token_budget=200)
+        self.assertEqual(stats['rows'].sum(), 40)
+        self.assertTrue((stats['chars'] < stats['baseline_chars']).all())
+        self.assertTrue((stats['tokens_saved_pct'] > 0).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+from utils import bedrock
+from utils.bedrock import (
+    MAX_POOL_CONNECTIONS, RateLimitScheduler, TokenBucket, get_bedrock_client, get_rate_limits, invoke_bedrock_model,
+    invoke_bedrock_model_stream, is_connection_error, is_throttle_error
+)
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': 'Rate exceeded'}}, 'Converse')
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeThrottlingClient:
+    """Fake bedrock-runtime client throttling every call above max_in_flight concurrent calls."""
+
+    def __init__(self, max_in_flight, latency=0.005):
+        self.max_in_flight = max_in_flight
+        self.latency = latency
+        self.in_flight = 0
+        self.throttles = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def converse(self, **kwargs):
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                self.throttles += 1
+                raise client_error('ThrottlingException')
+            self.in_flight += 1
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+            self.calls += 1
+        return {'output': {'message': {'content': [{'text': kwargs['modelId']}]}}}
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_refills_over_time(self):
+        clock = FakeClock()
+        bucket = TokenBucket(60, clock=clock)
+        bucket.take(60)
+        self.assertAlmostEqual(bucket.wait_time(1), 1.0)
+        clock.sleep(0.5)
+        self.assertAlmostEqual(bucket.wait_time(1), 0.5)
+        clock.sleep(0.5)
+        self.assertEqual(bucket.wait_time(1), 0)
+
+    def test_refill_capped_and_give_back(self):
+        clock = FakeClock()
+        bucket = TokenBucket(120, capacity=10, clock=clock)
+        clock.sleep(60)
+        bucket.take(10)
+        bucket.give(4)
+        self.assertAlmostEqual(bucket.tokens, 4)
+        bucket.give(100)
+        self.assertEqual(bucket.tokens, 10)
+
+
+class TestRateLimitScheduler(unittest.TestCase):
+
+    def test_requests_per_minute_budget(self):
+        clock = FakeClock()
+        scheduler = RateLimitScheduler(60, 10 ** 9, initial_concurrency=100, max_concurrency=100,
+                                       clock=clock, sleep=clock.sleep)
+        for _ in range(60):
+            scheduler.call(lambda: None)
+        self.assertEqual(clock.now, 0)
+        scheduler.call(lambda: None)
+        self.assertAlmostEqual(clock.now, 1.0)
+
+    def test_tokens_per_minute_budget_with_refund(self):
+        clock = FakeClock()
+        scheduler = RateLimitScheduler(10 ** 6, 6000, clock=clock, sleep=clock.sleep)
+        scheduler.call(lambda: 'a', estimated_tokens=6000, count_tokens=lambda _: 1000)
+        # 5000 unused tokens were refunded, 5000 are available right away
+        scheduler.call(lambda: 'b', estimated_tokens=5000)
+        self.assertEqual(clock.now, 0)
+        scheduler.call(lambda: 'c', estimated_tokens=3000)
+        self.assertAlmostEqual(clock.now, 30.0)
+
+    def test_aimd(self):
+        scheduler = RateLimitScheduler(10 ** 6, 10 ** 9, initial_concurrency=8, max_concurrency=10)
+        scheduler.acquire()
+        scheduler.release(throttled=True)
+        self.assertEqual(scheduler.limit, 4)
+        for _ in range(4):
+            scheduler.acquire()
+            scheduler.release()
+        self.assertAlmostEqual(scheduler.limit, 5, delta=0.2)
+
+    def test_adapts_to_throttling_client(self):
+        client = FakeThrottlingClient(max_in_flight=2)
+        scheduler = RateLimitScheduler(10 ** 6, 10 ** 9, initial_concurrency=8, max_concurrency=8,
+                                       max_retries=50, base_backoff=0.001, max_backoff=0.01)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda i: scheduler.call(client.converse, modelId=f'm{i}', estimated_tokens=100), range(40)))
+
+        self.assertEqual([r['output']['message']['content'][0]['text'] for r in results], [f'm{i}' for i in range(40)])
+        self.assertEqual(client.calls, 40)
+        self.assertGreater(scheduler.stats['throttles'], 0)
+        self.assertEqual(scheduler.stats['throttles'], client.throttles)
+        self.assertLess(scheduler.limit, 8)
+        self.assertEqual(scheduler.in_flight, 0)
+
+    def test_non_throttle_errors_are_not_retried(self):
+        scheduler = RateLimitScheduler(10 ** 6, 10 ** 9)
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise client_error('ValidationException')
+
+        with self.assertRaises(ClientError):
+            scheduler.call(fail)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(scheduler.in_flight, 0)
+        # A failure is not a success: the limit does not grow
+        self.assertEqual(scheduler.limit, 4)
+
+    def test_connection_errors_are_retried(self):
+        # Runtime clients do not retry, connection errors and timeouts are retried by the scheduler
+        scheduler = RateLimitScheduler(10 ** 6, 10 ** 9, sleep=lambda _: None)
+        timeout = ReadTimeoutError(endpoint_url='https://bedrock')
+        # langchain re-raises botocore errors as a ValueError
+        wrapped = ValueError(f'Error raised by bedrock service: {timeout}')
+        wrapped.__context__ = timeout
+        call = MagicMock(side_effect=[EndpointConnectionError(endpoint_url='https://bedrock'), wrapped, 'ok'])
+        self.assertEqual(scheduler.call(call), 'ok')
+        self.assertEqual(call.call_count, 3)
+        self.assertEqual((scheduler.stats['retries'], scheduler.stats['throttles']), (2, 0))
+
+    def test_gives_up_after_max_retries(self):
+        scheduler = RateLimitScheduler(10 ** 6, 10 ** 9, max_retries=2, sleep=lambda _: None)
+
+        def throttle():
+            raise client_error('ThrottlingException')
+
+        with self.assertRaises(ClientError):
+            scheduler.call(throttle)
+        self.assertEqual(scheduler.stats['throttles'], 3)
+        self.assertEqual(scheduler.limit, 1)
+
+
+class TestThrottleDetection(unittest.TestCase):
+
+    def test_is_throttle_error(self):
+        self.assertTrue(is_throttle_error(client_error('ThrottlingException')))
+        self.assertFalse(is_throttle_error(client_error('ValidationException')))
+        # langchain wraps botocore errors in a ValueError carrying the message only
+        wrapped = ValueError('Error raised by bedrock service: An error occurred (ThrottlingException) when calling ...')
+        self.assertTrue(is_throttle_error(wrapped))
+        self.assertFalse(is_throttle_error(ValueError('boom')))
+
+    def test_is_connection_error(self):
+        self.assertTrue(is_connection_error(EndpointConnectionError(endpoint_url='https://bedrock')))
+        self.assertFalse(is_connection_error(client_error('ThrottlingException')))
+        self.assertFalse(is_connection_error(ValueError('boom')))
+
+    def test_get_rate_limits(self):
+        limits = get_rate_limits('anthropic.claude-3-haiku-20240307-v1:0', 'us-west-2')
+        self.assertEqual(set(limits), {'requests_per_minute', 'tokens_per_minute'})
+        self.assertEqual(get_rate_limits('unknown.model'), get_rate_limits())
+
+
+@patch.dict('utils.bedrock._schedulers', clear=True)
+@patch('utils.bedrock.RateLimitScheduler.backoff', return_value=0)
+class TestInvokeBedrockModel(unittest.TestCase):
+
+    def make_client(self):
+        client = MagicMock()
+        client.meta.region_name = 'us-west-2'
+        return client
+
+    def test_invoke_goes_through_the_scheduler(self, mock_backoff):
+        client = self.make_client()
+        client.converse.side_effect = [
+            client_error('ThrottlingException'), EndpointConnectionError(endpoint_url='https://bedrock'),
+            {'output': {'message': {'content': [{'text': 'answer'}]}}, 'usage': {'inputTokens': 3, 'outputTokens': 2}},
+        ]
+        result = invoke_bedrock_model(client, 'model', system_prompt='system', prompt='hello', show_details=False)
+        self.assertEqual(result, 'answer')
+        self.assertEqual(client.converse.call_count, 3)
+        self.assertEqual(client.converse.call_args.kwargs['system'], [{'text': 'system'}])
+        scheduler = bedrock.get_scheduler('us-west-2', 'model')
+        self.assertEqual((scheduler.stats['calls'], scheduler.stats['throttles']), (1, 1))
+
+    def test_invoke_stream_goes_through_the_scheduler(self, mock_backoff):
+        client = self.make_client()
+        client.converse_stream.side_effect = [
+            client_error('ThrottlingException'),
+            {'stream': [{'contentBlockDelta': {'delta': {'text': 'ans'}}}, {'contentBlockDelta': {'delta': {'text': 'wer'}}}]},
+        ]
+        self.assertEqual(''.join(invoke_bedrock_model_stream(client, 'model', prompt='hello')), 'answer')
+        self.assertNotIn('system', client.converse_stream.call_args.kwargs)
+        self.assertEqual(bedrock.get_scheduler('us-west-2', 'model').stats['throttles'], 1)
+
+
+@patch.dict('utils.bedrock._credentials', clear=True)
+@patch.dict('utils.bedrock._clients', clear=True)
+@patch('utils.bedrock.boto3.Session')
+class TestClientPool(unittest.TestCase):
+
+    def credentials(self, minutes):
+        return {'Credentials': {'AccessKeyId': 'id', 'SecretAccessKey': 'secret', 'SessionToken': 'token',
+                                'Expiration': datetime.now(timezone.utc) + timedelta(minutes=minutes)}}
+
+    def test_client_reused(self, mock_session):
+        mock_session.return_value.client.side_effect = lambda **kwargs: object()
+        client = get_bedrock_client(region='us-west-2')
+        self.assertIs(get_bedrock_client(region='us-west-2'), client)
+        self.assertIsNot(get_bedrock_client(region='us-east-1'), client)
+        config = mock_session.return_value.client.call_args.kwargs['config']
+        self.assertEqual(config.max_pool_connections, MAX_POOL_CONNECTIONS)
+        # Throttles of runtime calls are retried by the scheduler, not by botocore
+        self.assertEqual(config.retries['max_attempts'], 1)
+        get_bedrock_client(region='us-west-2', runtime=False)
+        config = mock_session.return_value.client.call_args.kwargs['config']
+        self.assertGreater(config.retries['max_attempts'], 1)
+
+    def test_assumed_role_credentials_cached_until_expiry(self, mock_session):
+        sts = MagicMock()
+        sts.assume_role.return_value = self.credentials(60)
+        mock_session.return_value.client.side_effect = lambda service_name, **kwargs: sts if service_name == 'sts' else object()
+
+        client = get_bedrock_client(assumed_role='arn:aws:iam::123:role/r', region='us-west-2')
+        self.assertIs(get_bedrock_client(assumed_role='arn:aws:iam::123:role/r', region='us-west-2'), client)
+        get_bedrock_client(assumed_role='arn:aws:iam::123:role/r', region='us-east-1')
+        sts.assume_role.assert_called_once()
+
+    def test_client_recreated_when_credentials_expire(self, mock_session):
+        sts = MagicMock()
+        sts.assume_role.side_effect = [self.credentials(2), self.credentials(60)]
+        mock_session.return_value.client.side_effect = lambda service_name, **kwargs: sts if service_name == 'sts' else object()
+
+        client = get_bedrock_client(assumed_role='arn:aws:iam::123:role/r', region='us-west-2')
+        self.assertIsNot(get_bedrock_client(assumed_role='arn:aws:iam::123:role/r', region='us-west-2'), client)
+        self.assertEqual(sts.assume_role.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,16 @@
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock
-from utils.bedrock_wrapper import init_bedrock_chat
+from botocore.exceptions import ClientError
+from langchain.prompts import PromptTemplate
+from utils.bedrock_wrapper import (
+    MultiRegionBedrockChat, get_bedrock_chat, get_multi_region_bedrock_chat, init_bedrock_chat,
+    init_multi_region_bedrock_chat
+)
+from utils.benchmark import FAKE_MODEL_ID, FakeBedrockChat
+from utils.review_analyzer import _stream_chain
+from tests.helpers import NoCacheTestCase
 
 class TestBedrockWrapper(unittest.TestCase):
     
@@ -46,5 +56,108 @@ class TestBedrockWrapper(unittest.TestCase):
         
         self.assertEqual(result, mock_instance)
 
+
+def throttle():
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'Converse')
+
+
+@patch('utils.bedrock.RateLimitScheduler.backoff', return_value=0)
+class TestMultiRegionBedrockChat(NoCacheTestCase):
+
+    def make_chat(self):
+        return MultiRegionBedrockChat({
+            'us-west-2': FakeBedrockChat(region_name='us-west-2'),
+            'us-east-1': FakeBedrockChat(region_name='us-east-1'),
+        })
+
+    def test_fails_over_from_throttled_region(self, mock_backoff):
+        chat = self.make_chat()
+
+        def call(region_chat):
+            if region_chat is chat.chats['us-west-2']:
+                raise throttle()
+            return 'ok'
+
+        self.assertEqual([chat.call(call) for _ in range(5)], ['ok'] * 5)
+        stats = chat.stats()
+        self.assertFalse(stats['us-west-2']['healthy'])
+        self.assertEqual(stats['us-west-2']['throttles'], 1)  # then skipped while in cooldown
+        self.assertEqual(stats['us-east-1']['calls'], 5)
+
+    def test_spreads_concurrent_calls(self, mock_backoff):
+        chat = self.make_chat()
+        used = []
+        lock = threading.Lock()
+
+        def call(region_chat):
+            with lock:
+                used.append(region_chat.region_name)
+            time.sleep(0.01)
+            return 'ok'
+
+        threads = [threading.Thread(target=chat.call, args=(call,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(set(used), {'us-west-2', 'us-east-1'})
+        self.assertEqual(sum(s['calls'] for s in chat.stats().values()), 8)
+
+    def test_raises_when_every_region_throttles(self, mock_backoff):
+        chat = self.make_chat()
+
+        def call(region_chat):
+            raise throttle()
+
+        with self.assertRaises(ClientError):
+            chat.call(call)
+        self.assertFalse(any(s['healthy'] for s in chat.stats().values()))
+
+    def test_other_errors_do_not_fail_over(self, mock_backoff):
+        chat = self.make_chat()
+        call = MagicMock(side_effect=ValueError('bad request'))
+        with self.assertRaises(ValueError):
+            chat.call(call)
+        call.assert_called_once()
+
+    def test_stream_chain_uses_a_region(self, mock_backoff):
+        chat = self.make_chat()
+        prompt = PromptTemplate(template='{document}', input_variables=['document'])
+        self.assertTrue(_stream_chain(prompt, chat, {'document': 'reviews'}))
+        self.assertEqual(sum(s['calls'] for s in chat.stats().values()), 1)
+        self.assertEqual(sum(region_chat.stats()['calls'] for region_chat in chat.chats.values()), 1)
+
+    def test_init_multi_region_bedrock_chat(self, mock_backoff):
+        with patch('utils.bedrock_wrapper.init_bedrock_chat', side_effect=lambda **kw: FakeBedrockChat(region_name=kw['region_name'])):
+            chat = init_multi_region_bedrock_chat(regions=['us-west-2', 'us-east-1'])
+        self.assertEqual(list(chat.chats), ['us-west-2', 'us-east-1'])
+        self.assertEqual(chat.model_id, FAKE_MODEL_ID)
+
+
+class TestChatPool(unittest.TestCase):
+
+    @patch.dict('utils.bedrock_wrapper._chats', clear=True)
+    @patch.dict('utils.bedrock_wrapper._multi_region_chats', clear=True)
+    @patch('utils.bedrock_wrapper.BedrockChat', side_effect=lambda **kwargs: MagicMock(**kwargs))
+    @patch('utils.bedrock_wrapper.get_bedrock_client')
+    def test_chats_reused_per_parameters(self, mock_client, mock_bedrock_chat):
+        clients = {'us-west-2': MagicMock(), 'us-east-1': MagicMock()}
+        mock_client.side_effect = lambda assumed_role, region: clients[region]
+        chat = get_bedrock_chat('model', 'us-west-2')
+        self.assertIs(get_bedrock_chat('model', 'us-west-2'), chat)
+        self.assertIs(chat.client, clients['us-west-2'])
+        self.assertIsNot(get_bedrock_chat('model', 'us-west-2', model_kwargs={'max_tokens': 1024}), chat)
+        self.assertIsNot(get_bedrock_chat('model', 'us-east-1'), chat)
+        self.assertEqual(mock_bedrock_chat.call_count, 3)
+
+        multi_region_chat = get_multi_region_bedrock_chat('model', regions=['us-west-2', 'us-east-1'])
+        self.assertIs(multi_region_chat.chats['us-west-2'], chat)
+        self.assertIs(get_multi_region_bedrock_chat('model', regions=['us-west-2', 'us-east-1']), multi_region_chat)
+
+        # Expired credentials give a new client, and a new chat
+        clients['us-west-2'] = MagicMock()
+        self.assertIsNot(get_bedrock_chat('model', 'us-west-2'), chat)
+
+
 if __name__ == '__main__':
     unittest.main()
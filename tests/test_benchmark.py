@@ -0,0 +1,61 @@
+import unittest
+from botocore.exceptions import ClientError
+from utils import issues
+from utils.benchmark import FakeBedrockChat, MODES, generate_reviews, install_scheduler, run_benchmark
+from utils.review_analyzer import _split_df_to_docs
+from tests.helpers import NoCacheTestCase
+
+
+class TestGenerateReviews(unittest.TestCase):
+
+    def test_shape_and_determinism(self):
+        df = generate_reviews(rows=500, languages=('en', 'ja'), versions=2, seed=1)
+        self.assertEqual(len(df), 500)
+        self.assertEqual(set(df['Reviewer Language']), {'en', 'ja'})
+        self.assertEqual(df['App Version Code'].nunique(), 2)
+        self.assertTrue(df.equals(generate_reviews(rows=500, languages=('en', 'ja'), versions=2, seed=1)))
+
+    def test_duplicate_rate(self):
+        unique = generate_reviews(rows=1000, duplicate_rate=0.0, text_length=(40, 0.5))['Review Text'].nunique()
+        duplicated = generate_reviews(rows=1000, duplicate_rate=0.5, text_length=(40, 0.5))['Review Text'].nunique()
+        self.assertEqual(unique, 1000)
+        self.assertLess(duplicated, 600)
+
+
+class TestFakeBedrockChat(unittest.TestCase):
+
+    def test_analysis_answer_counts_every_review(self):
+        df = generate_reviews(rows=50, versions=1)
+        doc = _split_df_to_docs(df)[0]
+        chat = FakeBedrockChat()
+        answer = chat.invoke(f"identify and categorize <review>{doc.page_content}</review>").content
+        records = issues.parse_issues(answer)
+        self.assertEqual(issues.total_count(records), 50)
+        self.assertEqual({r['version'] for r in records}, set(df['App Version Code']))
+        self.assertEqual(chat.stats()['calls'], 1)
+
+    def test_throttles_above_max_in_flight(self):
+        chat = FakeBedrockChat(max_in_flight=0)
+        with self.assertRaises(ClientError):
+            chat.invoke('hello')
+        self.assertEqual(chat.stats()['throttles'], 1)
+
+
+class TestRunBenchmark(NoCacheTestCase):
+
+    def test_every_mode_is_measured(self):
+        df = generate_reviews(rows=300, versions=2)
+        chat = FakeBedrockChat(throttle_rate=0.2, seed=3)
+        install_scheduler(chat, base_backoff=0.001, max_backoff=0.01)
+        results = run_benchmark(df, chat, max_concurrency=4, token_budget=2000)
+
+        self.assertEqual([r['mode'] for r in results], list(MODES))
+        for result in results:
+            self.assertGreater(result['calls'], 1)
+            self.assertGreater(result['input_tokens'], result['output_tokens'])
+            self.assertGreater(result['peak_memory'], 0)
+        self.assertGreater(sum(r['throttles'] for r in results), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
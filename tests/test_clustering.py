@@ -0,0 +1,122 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from utils import issues, progress, review_analyzer
+from utils.benchmark import FakeBedrockChat, generate_reviews, install_scheduler
+from utils.clustering import cluster_reviews, default_clusters, minibatch_kmeans, review_embeddings, tfidf_matrix
+from tests.helpers import NoCacheTestCase
+
+THEMES = ['the game crashes when i open it', 'too many ads after every level', 'cannot login to my account',
+          'battery drains very fast']
+
+
+def _themed_reviews(rows=400, seed=0):
+    rng = np.random.default_rng(seed)
+    words = 'really please fix this now today again'.split()
+    return pd.DataFrame({'Review Text': [f"{THEMES[i % len(THEMES)]} {' '.join(rng.choice(words, 3))}"
+                                         for i in range(rows)]})
+
+
+class TestEmbeddings(unittest.TestCase):
+
+    def test_tfidf_rows_are_normalized(self):
+        rows, cols, values = tfidf_matrix(['crash on start', '', 'crash'])
+        self.assertEqual(set(rows.tolist()), {0, 2})
+        norms = np.bincount(rows, weights=values.astype(float) ** 2)
+        self.assertAlmostEqual(norms[0], 1.0, places=5)
+        self.assertAlmostEqual(norms[2], 1.0, places=5)
+
+    def test_similar_texts_are_close(self):
+        texts = ['the game crashes on start', 'the game crashes on start again', 'too many ads in this game',
+                 'way too many ads', '']
+        embeddings = review_embeddings(texts, dimensions=4)
+        self.assertEqual(embeddings.shape, (5, 4))
+        self.assertAlmostEqual(float(np.linalg.norm(embeddings[0])), 1.0, places=5)
+        self.assertEqual(float(np.linalg.norm(embeddings[4])), 0.0)
+        similarity = embeddings @ embeddings.T
+        self.assertGreater(similarity[0, 1], similarity[0, 3])
+        self.assertGreater(similarity[2, 3], similarity[1, 3])
+        # Deterministic
+        self.assertTrue(np.array_equal(embeddings, review_embeddings(texts, dimensions=4)))
+
+
+class TestMiniBatchKMeans(unittest.TestCase):
+
+    def test_separated_blobs(self):
+        rng = np.random.default_rng(0)
+        centers = np.array([[0, 0], [10, 0], [0, 10]])
+        x = np.concatenate([center + rng.normal(0, 0.5, (200, 2)) for center in centers])
+        labels, found = minibatch_kmeans(x, 3, batch_size=64)
+        self.assertEqual(len(found), 3)
+        # Each blob is one cluster
+        for blob in range(3):
+            self.assertEqual(len(set(labels[blob * 200:(blob + 1) * 200])), 1)
+        self.assertEqual(len(set(labels)), 3)
+
+    def test_fewer_distinct_points_than_clusters(self):
+        labels, centers = minibatch_kmeans(np.array([[0.0, 1.0], [0.0, 1.0], [1.0, 0.0]]), 5)
+        self.assertEqual(labels.tolist(), [0, 0, 1])
+        self.assertEqual(len(centers), 2)
+
+    def test_default_clusters(self):
+        self.assertEqual(default_clusters(1), 1)
+        self.assertEqual(default_clusters(200), 10)
+        self.assertEqual(default_clusters(10 ** 6), 30)
+
+
+class TestClusterReviews(unittest.TestCase):
+
+    def test_themes_are_clusters(self):
+        clusters = cluster_reviews(_themed_reviews(), n_clusters=4)
+        self.assertEqual([size for size, _ in clusters], [100] * 4)
+        themes = set()
+        for _, samples in clusters:
+            self.assertEqual(len(samples), 10)
+            prefixes = {text[:20] for text in samples['Review Text']}
+            self.assertEqual(len(prefixes), 1)
+            themes |= prefixes
+        self.assertEqual(len(themes), 4)
+
+    def test_sizes_count_collapsed_reviews(self):
+        df = _themed_reviews(40).assign(Count=3)
+        clusters = cluster_reviews(df, n_clusters=4, samples=2)
+        self.assertEqual(sum(size for size, _ in clusters), 120)
+        self.assertTrue(all(len(samples) == 2 for _, samples in clusters))
+        self.assertEqual(cluster_reviews(df.iloc[:0]), [])
+
+
+class TestClusteredAnalysis(NoCacheTestCase):
+
+    def setUp(self):
+        self.data = generate_reviews(rows=600, languages=('en', 'fr'), versions=2)
+        self.chat = FakeBedrockChat()
+        install_scheduler(self.chat)
+
+    def test_counts_are_exact_and_clusters_are_named(self):
+        with progress.use_reporter(progress.NullReporter()), \
+                patch('utils.review_analyzer._name_review_cluster',
+                      wraps=review_analyzer._name_review_cluster) as name:
+            result = review_analyzer.analyze_data(self.data, self.chat, cluster=True)
+        counts = self.data['App Version Code'].value_counts()
+        self.assertEqual({version: issues.total_count(r['issues']) for version, r in result.items()}, counts.to_dict())
+        # One naming call per cluster, with representative reviews only
+        self.assertEqual(name.call_count, sum(default_clusters(count) for count in counts))
+        content = name.call_args.args[0]
+        self.assertRegex(content.split('\n')[0], r"^<cluster version='10\d' reviews='\d+'>$")
+        self.assertLessEqual(len(content.split('\n')), 2 + 10)
+        for r in result.values():
+            self.assertTrue(r['report'].startswith('**Summary**'))
+
+    def test_by_lang(self):
+        with progress.use_reporter(progress.NullReporter()):
+            result = review_analyzer.analyze_data_by_lang(self.data, self.chat, cluster=True)
+        counts = self.data.groupby(['Reviewer Language', 'App Version Code'], observed=True).size()
+        self.assertEqual({(lang, version): issues.total_count(r['issues'])
+                          for lang, versions in result.items() for version, r in versions.items()}, counts.to_dict())
+        records = [record for versions in result.values() for r in versions.values() for record in r['issues']]
+        self.assertTrue(all(record['lang'] in ('en', 'fr') for record in records))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from utils import dedup, issues, review_analyzer
+from utils.benchmark import FakeBedrockChat, generate_reviews
+from utils.dedup import COUNT_COLUMN, collapse_duplicates, minhash_signatures, near_duplicate_clusters, normalize_text
+from tests.helpers import NoCacheTestCase
+
+
+class TestNormalizeText(unittest.TestCase):
+
+    def test_normalize_text(self):
+        texts = pd.Series(['Crashes!!! 😡', '  CRASHES ', 'Baaaad   game', None, '游戏闪退。'])
+        self.assertEqual(normalize_text(texts).tolist(), ['crashes', 'crashes', 'baad game', '', '游戏闪退'])
+
+
+class TestMinHash(unittest.TestCase):
+
+    def test_signatures_estimate_similarity(self):
+        texts = ['the game crashes when i open the shop', 'the game crashes when i open the shop',
+                 'the game crashes when i open the map', 'login never works on my phone', 'ab']
+        signatures = minhash_signatures(texts)
+        self.assertEqual(signatures.shape, (5, dedup.NUM_PERM))
+        similarity = lambda i, j: (signatures[i] == signatures[j]).mean()
+        self.assertEqual(similarity(0, 1), 1.0)
+        self.assertGreater(similarity(0, 2), 0.6)
+        self.assertLess(similarity(0, 3), 0.2)
+        # Deterministic
+        self.assertTrue(np.array_equal(signatures, minhash_signatures(texts)))
+
+    def test_clusters(self):
+        texts = ['copy paste spam: download my app now', 'copy paste spam: download my app now!!',
+                 'something else entirely different', 'copy paste spam: download my app now please']
+        clusters = near_duplicate_clusters(minhash_signatures(normalize_text(pd.Series(texts)).tolist()), 0.7)
+        self.assertEqual(clusters.tolist(), [0, 0, 2, 0])
+
+
+class TestCollapseDuplicates(unittest.TestCase):
+
+    def test_exact_and_near_duplicates(self):
+        df = pd.DataFrame({
+            'App Version Code': ['1.0'] * 6,
+            'Review Title': ['', '', 'Bad', '', '', ''],
+            'Review Text': ['The game crashes every time I open the level 12 map',
+                            'Crash', 'crash!!',
+                            'the game crashes every time i open the level 13 map',
+                            '', ''],
+        })
+        collapsed = collapse_duplicates(df)
+        self.assertEqual(list(collapsed.columns), list(df.columns) + [COUNT_COLUMN])
+        self.assertEqual(list(collapsed.index), [0, 1, 2, 4, 5])
+        self.assertEqual(collapsed[COUNT_COLUMN].tolist(), [2, 1, 1, 1, 1])
+        self.assertEqual(collapsed[COUNT_COLUMN].sum(), len(df))
+        # Only identical normalized texts with threshold 1.0
+        self.assertEqual(len(collapse_duplicates(df, threshold=1.0)), 6)
+
+    def test_title_and_text_compared_together(self):
+        df = pd.DataFrame({'Review Title': ['Crash', 'Lag', 'crash'], 'Review Text': ['on start', 'on start', 'On start!']})
+        self.assertEqual(collapse_duplicates(df)[COUNT_COLUMN].tolist(), [2, 1])
+
+    def test_unchanged_without_duplicates(self):
+        df = pd.DataFrame({'Review Text': ['Crashes on start', 'Too many ads']})
+        self.assertIs(collapse_duplicates(df), df)
+        self.assertTrue(collapse_duplicates(pd.DataFrame()).empty)
+
+    def test_counts_add_up_when_collapsed_again(self):
+        df = pd.DataFrame({'Review Text': ['crash', 'Crash', 'ads', 'crash'], COUNT_COLUMN: [2, 1, 1, 3]})
+        self.assertEqual(collapse_duplicates(df)[COUNT_COLUMN].tolist(), [6, 1])
+
+    def test_split_counts_represented_reviews(self):
+        df = collapse_duplicates(pd.DataFrame({'Review Text': ['crash'] * 5 + ['ads']}))
+        docs = review_analyzer._split_df_to_docs(df)
+        self.assertEqual((docs[0].metadata['rows'], docs[0].metadata['reviews']), (2, 6))
+        self.assertEqual(docs[0].page_content.split('\n')[0], 'Review Text\tCount')
+
+
+@patch('utils.progress.st')
+class TestAnalysisWithDuplicates(NoCacheTestCase):
+
+    def test_issue_counts_keep_duplicates(self, mock_st):
+        df = generate_reviews(rows=400, languages=('en',), versions=1, text_length=(4, 0.3), duplicate_rate=0.5)
+        result = review_analyzer.analyze_data(df, FakeBedrockChat(), token_budget=1000)
+        version = df['App Version Code'].iloc[0]
+        self.assertEqual(issues.total_count(result[version]['issues']), len(df))
+        # Fewer batches than without collapsing
+        self.assertLess(len(review_analyzer._split_df_to_docs(collapse_duplicates(df), token_budget=1000)),
+                        len(review_analyzer._split_df_to_docs(df, token_budget=1000)))
+
+
+if __name__ == '__main__':
+    unittest.main()
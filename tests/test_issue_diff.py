@@ -0,0 +1,130 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from utils import review_analyzer
+from utils.benchmark import FakeBedrockChat, install_scheduler
+from utils.issue_diff import align_categories, diff_versions, format_diff, two_proportion_test
+from utils.progress import NullReporter, use_reporter
+from utils.sampling import scale_issues
+from tests.helpers import NoCacheTestCase
+
+
+def _record(version, category, count):
+    return {'version': version, 'lang': 'en', 'category': category, 'count': count, 'description': f'{category} reported'}
+
+
+class TestAlignCategories(unittest.TestCase):
+
+    def test_similar_categories_share_a_label(self):
+        mapping = align_categories(['Game crashes', 'Login failure', 'game crash!', 'Too many ads'])
+        self.assertEqual(mapping['game crash!'], 'Game crashes')
+        self.assertEqual(len(set(mapping.values())), 3)
+
+
+class TestTwoProportionTest(unittest.TestCase):
+
+    def test_known_values(self):
+        z, p = two_proportion_test([60, 50], [100, 100], [40, 50], [100, 100])
+        self.assertAlmostEqual(z[0], 2.828, places=3)
+        self.assertAlmostEqual(p[0], 0.00468, places=4)
+        self.assertEqual((z[1], p[1]), (0.0, 1.0))
+
+    def test_empty_totals(self):
+        z, p = two_proportion_test([0], [0], [5], [10])
+        self.assertEqual((z[0], p[0]), (0.0, 1.0))
+
+
+class TestDiffVersions(unittest.TestCase):
+
+    def setUp(self):
+        self.records = {
+            '1.0': [_record('1.0', 'Game crashes', 50), _record('1.0', 'Too many ads', 50), _record('1.0', 'Old bug', 10)],
+            '1.1': [_record('1.1', 'Game crash', 40), _record('1.1', 'Too many ads', 60)],
+            '2.0': [_record('2.0', 'Game crashes', 120), _record('2.0', 'Too many ads', 40), _record('2.0', 'Login fails', 20),
+                    _record('2.0', 'Battery drain', 1)],
+        }
+
+    def test_statuses(self):
+        diff = diff_versions(self.records, '2.0').set_index('category')
+        self.assertEqual(diff['status'].to_dict(), {
+            'Login fails': 'new', 'Battery drain': 'new', 'Game crashes': 'worse', 'Too many ads': 'better',
+            'Old bug': 'disappeared',
+        })
+        # Aligned across versions and pooled over the baselines
+        self.assertEqual(diff.loc['Game crashes', 'baseline_count'], 90)
+        self.assertAlmostEqual(diff.loc['Game crashes', 'baseline_share'], 90 / 210)
+        self.assertAlmostEqual(diff.loc['Game crashes', 'baseline_min_share'], 40 / 100)
+        self.assertAlmostEqual(diff.loc['Game crashes', 'baseline_max_share'], 50 / 110)
+        self.assertAlmostEqual(diff['target_share'].sum(), 1.0)
+        self.assertEqual(diff.loc['Login fails', 'description'], 'Login fails reported')
+
+    def test_small_changes_are_not_significant(self):
+        records = {'1.0': [_record('1.0', 'Crash', 50), _record('1.0', 'Ads', 50)],
+                   '2.0': [_record('2.0', 'Crash', 53), _record('2.0', 'Ads', 47)]}
+        self.assertEqual(set(diff_versions(records, '2.0')['status']), {'unchanged'})
+
+    def test_sampled_version_is_tested_on_its_sample(self):
+        design = {'population': 10000, 'sample': 100, 'margin_of_error': 0.1, 'confidence': 0.95}
+        sampled, _ = scale_issues([_record('2.0', 'Crash', 35), _record('2.0', 'Ads', 65)], design)
+        full = [_record('1.0', 'Crash', 300), _record('1.0', 'Ads', 700)]
+        diff = diff_versions({'1.0': full, '2.0': sampled}, '2.0').set_index('category')
+        # Counts and shares are the estimates, the test is on the 100 reviews of the sample
+        self.assertEqual(diff.loc['Crash', 'target_count'], 3500)
+        self.assertAlmostEqual(diff.loc['Crash', 'target_share'], 0.35)
+        self.assertEqual(set(diff['status']), {'unchanged'})
+        self.assertGreater(diff.loc['Crash', 'p_value'], 0.2)
+        # The estimates taken as counts would be significant
+        estimates = [{k: v for k, v in record.items() if k != 'sample_count'} for record in sampled]
+        self.assertEqual(diff_versions({'1.0': full, '2.0': estimates}, '2.0').set_index('category').loc['Crash', 'status'],
+                         'worse')
+
+    def test_format_diff_has_a_constant_size(self):
+        diff = diff_versions(self.records, '2.0')
+        table = format_diff(diff)
+        self.assertIn('| Game crashes | worse | 120 (66.3%) | 90 (42.9%, 40.0%-45.5%) | +23.4 pt | 0.000 |', table)
+        limited = format_diff(diff, limit=2)
+        self.assertEqual(len(limited.split('\n')), 2 + 2 + 2)
+        self.assertTrue(limited.endswith('3 more issues, unchanged or less notable.'))
+
+    def test_empty(self):
+        self.assertTrue(diff_versions({}, '2.0').empty)
+
+
+class TestCompareTargetData(NoCacheTestCase):
+
+    def _analyze_result(self, versions):
+        rng = np.random.default_rng(0)
+        result = {}
+        for version in versions:
+            records = [_record(version, category, int(rng.integers(1, 100)))
+                       for category in ['Game crashes', 'Too many ads', 'Login fails', 'Battery drain']]
+            result[version] = {'xmldata': '', 'issues': records, 'report': ''}
+        return result
+
+    def test_prompt_does_not_grow_with_baselines(self):
+        chat = FakeBedrockChat()
+        install_scheduler(chat)
+        prompts = []
+        for baselines in (1, 10):
+            analyze_result = self._analyze_result([f'1.{i}' for i in range(baselines)] + ['2.0'])
+            with use_reporter(NullReporter()), \
+                    patch('utils.review_analyzer._compare_analysis_result',
+                          wraps=review_analyzer._compare_analysis_result) as compare:
+                report = review_analyzer.compare_target_data('2.0', analyze_result, chat)
+            prompts.append(compare.call_args.args[0])
+            self.assertIn('4 issues compared with the baseline versions.', report)
+            self.assertIn('| Issue | Status |', report)
+        self.assertEqual(len(prompts[0].split('\n')), len(prompts[1].split('\n')))
+
+    def test_by_lang(self):
+        chat = FakeBedrockChat()
+        install_scheduler(chat)
+        analyze_result = {'en': self._analyze_result(['1.0', '2.0']), 'fr': self._analyze_result(['1.0', '2.0'])}
+        with use_reporter(NullReporter()):
+            result = review_analyzer.compare_target_data_by_lang('2.0', analyze_result, chat)
+        self.assertEqual(list(result), ['en', 'fr'])
+        self.assertIn('| Issue | Status |', result['fr'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from utils import issues, progress, review_analyzer, telemetry
+from utils.benchmark import FakeBedrockChat, generate_reviews, install_scheduler
+from utils.issue_store import IssueStore, make_scope, review_keys
+from tests.helpers import NoCacheTestCase
+
+
+class TestReviewKeys(unittest.TestCase):
+
+    def test_same_review_same_key_across_dtypes(self):
+        df = pd.DataFrame({
+            'Review Date': pd.to_datetime(['2024-01-01', '2024-01-01', '2024-01-02']),
+            'Device': pd.Categorical(['pixel', 'pixel', 'pixel']),
+            'Review Title': ['', '', ''],
+            'Review Text': ['Crashes', 'Slow', 'Crashes'],
+            'Star Rating': [1, 2, 1],
+        })
+        keys = review_keys(df)
+        self.assertEqual(len(set(keys)), 3)
+        # Another export of the same review, with other dtypes and other columns
+        other = df.iloc[[0]].assign(Device='pixel', **{'Star Rating': 5}).set_index(pd.Index([7]))
+        self.assertEqual(review_keys(other).loc[7], keys.iloc[0])
+
+    def test_make_scope(self):
+        self.assertEqual(make_scope('version', {'app': 'a', 'ratings': [1, 2]}),
+                         make_scope('version', {'ratings': [1, 2], 'app': 'a'}))
+        self.assertNotEqual(make_scope('version', None), make_scope('lang,version', None))
+
+
+class TestIssueStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'issues.sqlite')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_save_load_and_seen(self):
+        store = IssueStore(self.path)
+        result = {'xmldata': '<issues/>', 'issues': [], 'report': 'r', 'skipped': {'empty': 1}}
+        store.save('s', ('en', '1.0'), result, np.array([1, 2, 3]))
+        self.assertEqual(store.load('s', ('en', '1.0')), result)
+        self.assertIsNone(store.load('s', ('fr', '1.0')))
+        self.assertIsNone(store.load('other', ('en', '1.0')))
+        self.assertEqual(store.seen('s', np.array([3, 4, 1, 1])).tolist(), [True, False, True, True])
+        self.assertEqual(store.seen('other', np.array([1])).tolist(), [False])
+
+        # Persisted, and the result is replaced while the reviews add up
+        store = IssueStore(self.path)
+        store.save('s', ('en', '1.0'), {**result, 'report': 'r2'}, np.array([3, 4]))
+        self.assertEqual(store.load('s', ('en', '1.0'))['report'], 'r2')
+        self.assertEqual(store.stats(), {'scopes': 1, 'groups': 1, 'reviews': 4})
+        store.clear('s')
+        self.assertEqual(store.stats()['groups'], 0)
+        self.assertFalse(store.seen('s', np.array([1])).any())
+
+
+class TestIncrementalAnalysis(NoCacheTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = IssueStore(os.path.join(self.tmpdir.name, 'issues.sqlite'))
+        self.data = generate_reviews(rows=400, languages=('en', 'fr'), versions=2, duplicate_rate=0.0)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _chat(self):
+        chat = FakeBedrockChat()
+        install_scheduler(chat)
+        return chat
+
+    def _analyze(self, analyze_fn, data, scope={'app': 'com.example'}, incremental=True):
+        chat = self._chat()
+        with progress.use_reporter(progress.NullReporter()):
+            result = analyze_fn(data, chat, token_budget=2000, store=self.store, scope=scope, incremental=incremental)
+        return result, chat.stats()['calls']
+
+    def _counts(self, records):
+        # Per language: near-duplicates collapsed into another representative may get another category
+        counts = {}
+        for record in records:
+            counts[record['lang']] = counts.get(record['lang'], 0) + record['count']
+        return counts
+
+    def test_only_new_reviews_are_analyzed(self):
+        first, new = self.data.iloc[:300], self.data.iloc[300:]
+        self._analyze(review_analyzer.analyze_data, first)
+        # The next export contains the previous reviews again
+        result, calls = self._analyze(review_analyzer.analyze_data, pd.concat([first, new]))
+        with progress.use_reporter(progress.NullReporter()):
+            fresh = review_analyzer.analyze_data(self.data, self._chat(), token_budget=2000)
+
+        self.assertGreater(calls, 0)
+        self.assertEqual(list(result), list(fresh))
+        for version in fresh:
+            # Every review counted once, as when analyzing everything at once
+            self.assertEqual(self._counts(result[version]['issues']), self._counts(fresh[version]['issues']))
+
+        # Nothing new: every version comes from the store
+        again, calls = self._analyze(review_analyzer.analyze_data, self.data)
+        self.assertEqual(calls, 0)
+        self.assertEqual(again, result)
+
+    def test_by_lang_folds_per_language_and_version(self):
+        self._analyze(review_analyzer.analyze_data_by_lang, self.data[self.data['Reviewer Language'] == 'en'])
+        result, _ = self._analyze(review_analyzer.analyze_data_by_lang, self.data)
+        counts = self.data.groupby(['Reviewer Language', 'App Version Code'], observed=True).size()
+        self.assertEqual({(lang, version): issues.total_count(r['issues'])
+                          for lang, versions in result.items() for version, r in versions.items()},
+                         counts.to_dict())
+
+        # Another scope (other filters) does not share the stored results
+        _, calls = self._analyze(review_analyzer.analyze_data_by_lang, self.data, {'app': 'other'})
+        self.assertGreater(calls, 0)
+
+    def test_versions_with_the_same_reviews_are_reused(self):
+        data = generate_reviews(rows=300, languages=('en',), versions=3, duplicate_rate=0.0)
+        baseline, target, other = ('100', '101'), ('100', '102'), ('102',)
+        first, _ = self._analyze(review_analyzer.analyze_data, data[data['App Version Code'].isin(baseline)],
+                                 incremental=False)
+        # Another target with the same baseline: only the target version is analyzed
+        with telemetry.collect() as metrics:
+            result, calls = self._analyze(review_analyzer.analyze_data, data[data['App Version Code'].isin(target)],
+                                          incremental=False)
+        self.assertGreater(calls, 0)
+        self.assertEqual(set(metrics.to_frame()['group']), {'dataset version 102'})
+        self.assertEqual(result['100'], first['100'])
+
+        # Other reviews of a version are not the same analysis: analyzed in full, not folded
+        fewer = data[data['App Version Code'].isin(other)].iloc[:20]
+        result, calls = self._analyze(review_analyzer.analyze_data, fewer, incremental=False)
+        self.assertGreater(calls, 0)
+        self.assertEqual(issues.total_count(result['102']['issues']), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
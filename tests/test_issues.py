@@ -0,0 +1,113 @@
+import unittest
+from utils.issues import (
+    IssueStreamParser, parse_issues, normalize_category, merge_issues, group_fuzzy_duplicates, format_issues, total_count
+)
+
+SAMPLE = """
+<version='1.0' lang='en'>
+<issue>
+<category> Game crashes</category>
+<count> 12</count>
+<description>The game crashes on start</description>
+</issue>
+<issue>
+<category>Login failure</category>
+<count>3 reviews</count>
+<description>Cannot log in</description>
+</issue>
+</version>
+<version='1.0' lang='en'>
+<issue>
+<category>game crashes!</category>
+<count>5</count>
+<description>Crash after update</description>
+</issue>
+</version>
+"""
+
+
+class TestParseIssues(unittest.TestCase):
+
+    def test_parse_issues_records(self):
+        records = parse_issues(SAMPLE)
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0], {
+            'version': '1.0', 'lang': 'en', 'category': 'Game crashes', 'count': 12,
+            'description': 'The game crashes on start'
+        })
+        self.assertEqual(records[1]['count'], 3)
+
+    def test_parse_issues_without_version(self):
+        records = parse_issues("<issues lang='ja'><issue><category>Lag</category><count>2</count>"
+                               "<description>Slow</description></issue></issues>")
+        self.assertEqual((records[0]['version'], records[0]['lang']), (None, 'ja'))
+
+    def test_parse_issues_double_quoted_version(self):
+        records = parse_issues('<version="2.0"><issue><category>Ads</category><count>1</count></issue></version>')
+        self.assertEqual((records[0]['version'], records[0]['lang'], records[0]['description']), ('2.0', None, ''))
+
+    def test_parse_issues_tolerates_garbage(self):
+        self.assertEqual(parse_issues('Here is the analysis: <issue><category>Crash'), [])
+        self.assertEqual(parse_issues(''), [])
+
+
+class TestMergeIssues(unittest.TestCase):
+
+    def test_normalize_category(self):
+        self.assertEqual(normalize_category(' Game  Crashes!'), 'game crashes')
+
+    def test_merge_issues_sums_normalized_duplicates(self):
+        merged = merge_issues(parse_issues(SAMPLE))
+        self.assertEqual([(r['category'], r['count']) for r in merged], [('Game crashes', 17), ('Login failure', 3)])
+        self.assertEqual(total_count(merged), 20)
+
+    def test_merge_issues_keeps_versions_apart(self):
+        records = parse_issues(SAMPLE.replace("<version='1.0' lang='en'>\n<issue>\n<category>game", "<version='2.0' lang='en'>\n<issue>\n<category>game"))
+        self.assertEqual(len(merge_issues(records)), 3)
+
+    def test_group_fuzzy_duplicates(self):
+        records = [
+            {'version': '1.0', 'lang': 'en', 'category': 'Crash on startup', 'count': 4, 'description': ''},
+            {'version': '1.0', 'lang': 'en', 'category': 'Crashes on startup', 'count': 2, 'description': ''},
+            {'version': '1.0', 'lang': 'en', 'category': 'Too many ads', 'count': 7, 'description': ''},
+            {'version': '2.0', 'lang': 'en', 'category': 'Crash on startup', 'count': 1, 'description': ''},
+        ]
+        clusters, distinct = group_fuzzy_duplicates(records)
+        self.assertEqual([[r['count'] for r in c] for c in clusters], [[4, 2]])
+        self.assertEqual([r['count'] for r in distinct], [7, 1])
+
+    def test_format_issues_round_trip(self):
+        merged = merge_issues(parse_issues(SAMPLE))
+        self.assertEqual(parse_issues(format_issues(merged)), merged)
+class TestIssueStreamParser(unittest.TestCase):
+
+    TEXT = ("<version='1.0' lang='en'>\n<issue>\n<category>Crash on start</category>\n<count>12</count>\n"
+            "<description>App closes right after launch</description>\n</issue>\n<issue>\n<category>Ads</category>\n"
+            "<count>3</count>\n<description>Too many ads</description>\n</issue>\n</version>")
+
+    def test_records_emitted_when_issue_closes(self):
+        parser = IssueStreamParser()
+        head, tail = self.TEXT.split('</issue>', 1)
+        self.assertEqual(parser.feed(head), [])
+        records = parser.feed('</issue>' + tail)
+        self.assertEqual([r['category'] for r in records], ['Crash on start', 'Ads'])
+
+    def test_any_chunk_boundary(self):
+        expected = parse_issues(self.TEXT)
+        for size in (1, 2, 3, 7, 50):
+            parser = IssueStreamParser()
+            for i in range(0, len(self.TEXT), size):
+                parser.feed(self.TEXT[i:i + size])
+            self.assertEqual(parser.records, expected, f'chunk size {size}')
+        self.assertEqual(expected[0], {'version': '1.0', 'lang': 'en', 'category': 'Crash on start',
+                                       'count': 12, 'description': 'App closes right after launch'})
+
+    def test_tolerates_truncated_and_malformed_output(self):
+        parser = IssueStreamParser()
+        parser.feed("Sure, here it is:\n<issues><issue><category>Lag</category><count>about 4</count></issue>")
+        parser.feed("<issue><category>Cut off</category><count>2")
+        self.assertEqual(parser.records, [{'version': None, 'lang': None, 'category': 'Lag', 'count': 4, 'description': ''}])
+
+
+if __name__ == '__main__':
+    unittest.main()
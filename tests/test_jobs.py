@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from utils import jobs
+from utils.jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobRunner, report_progress
+
+
+def wait_for(runner, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = runner.get(job_id)
+        if job['status'] in jobs.FINISHED:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+class TestJobRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'jobs.sqlite')
+        self.runner = JobRunner(self.path, max_jobs=2)
+
+    def tearDown(self):
+        self.runner._executor.shutdown(wait=True)
+        self.tmpdir.cleanup()
+
+    def test_submit_and_result(self):
+        job_id = self.runner.submit('session', 'Sum', lambda a, b: {'total': a + b}, 1, b=2)
+        job = wait_for(self.runner, job_id)
+        self.assertEqual(job['status'], DONE)
+        self.assertEqual(job['label'], 'Sum')
+        self.assertIsNotNone(job['started_at'])
+        self.assertEqual(self.runner.result(job_id), {'total': 3})
+
+    def test_failure_records_traceback(self):
+        def fail():
+            raise ValueError('boom')
+
+        job = wait_for(self.runner, self.runner.submit('session', 'Fail', fail))
+        self.assertEqual(job['status'], FAILED)
+        self.assertIn('ValueError: boom', job['error'])
+        self.assertIsNone(self.runner.result(job['id']))
+
+    def test_report_progress(self):
+        started, proceed = threading.Event(), threading.Event()
+
+        def work():
+            report_progress('half way')
+            started.set()
+            proceed.wait(5)
+            return 'done'
+
+        job_id = self.runner.submit('session', 'Work', work)
+        started.wait(5)
+        job = self.runner.get(job_id)
+        self.assertEqual((job['status'], job['progress']), (RUNNING, 'half way'))
+        proceed.set()
+        self.assertEqual(wait_for(self.runner, job_id)['status'], DONE)
+        # Outside of a job it is a no-op
+        report_progress('ignored')
+
+    def test_jobs_run_concurrently_and_queue(self):
+        barrier = threading.Barrier(2, timeout=5)
+        proceed = threading.Event()
+        first = [self.runner.submit('a', f'Job {i}', lambda: (barrier.wait(), proceed.wait(5))) for i in range(2)]
+        queued = self.runner.submit('b', 'Job 2', lambda: 'late')
+        time.sleep(0.05)
+        self.assertEqual(self.runner.get(queued)['status'], QUEUED)
+
+        self.assertTrue(self.runner.cancel(queued))
+        self.assertEqual(self.runner.get(queued)['status'], CANCELLED)
+        # Running jobs cannot be cancelled
+        self.assertFalse(self.runner.cancel(first[0]))
+        proceed.set()
+        for job_id in first:
+            self.assertEqual(wait_for(self.runner, job_id)['status'], DONE)
+
+        self.assertEqual([job['id'] for job in self.runner.list_jobs('a')], first)
+        self.runner.delete(queued)
+        self.assertIsNone(self.runner.get(queued))
+
+    def test_unfinished_jobs_marked_interrupted_on_restart(self):
+        proceed = threading.Event()
+        job_id = self.runner.submit('session', 'Long', proceed.wait, 5)
+        time.sleep(0.05)
+        restarted = JobRunner(self.path)
+        job = restarted.get(job_id)
+        self.assertEqual(job['status'], FAILED)
+        self.assertIn('Interrupted', job['error'])
+        proceed.set()
+        restarted._executor.shutdown(wait=True)
+
+    def test_jobs_of_other_processes_are_left_alone_on_restart(self):
+        finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+        finished.wait()
+        conn = sqlite3.connect(self.path)
+        conn.executemany('INSERT INTO jobs (id, owner, label, status, created_at, pid) VALUES (?, ?, ?, ?, ?, ?)', [
+            ('live', 'session', 'Other process', RUNNING, time.time(), os.getppid()),
+            ('dead', 'session', 'Stopped process', QUEUED, time.time(), finished.pid),
+        ])
+        conn.commit()
+        conn.close()
+        restarted = JobRunner(self.path)
+        self.assertEqual(restarted.get('live')['status'], RUNNING)
+        self.assertEqual(restarted.get('dead')['status'], FAILED)
+        restarted._executor.shutdown(wait=True)
+
+    def test_table_without_pid_is_migrated(self):
+        path = os.path.join(self.tmpdir.name, 'old.sqlite')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE jobs (id TEXT PRIMARY KEY, owner TEXT, label TEXT, status TEXT NOT NULL, '
+                     'progress TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL, result BLOB, '
+                     'error TEXT)')
+        conn.execute('INSERT INTO jobs (id, owner, label, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                     ('old', 'session', 'Old', RUNNING, time.time()))
+        conn.commit()
+        conn.close()
+        runner = JobRunner(path)
+        self.assertEqual(runner.get('old')['status'], FAILED)
+        self.assertEqual(wait_for(runner, runner.submit('session', 'New', lambda: 1))['status'], DONE)
+        runner._executor.shutdown(wait=True)
+
+    def test_finished_jobs_are_purged_after_retention(self):
+        done = wait_for(self.runner, self.runner.submit('session', 'Done', lambda: 'x' * 1000))
+        proceed = threading.Event()
+        running = self.runner.submit('session', 'Running', proceed.wait, 5)
+        self.assertEqual(self.runner.purge(), 0)
+        with patch('utils.jobs.time.time', return_value=done['finished_at'] + jobs.DEFAULT_RETENTION + 1):
+            self.assertEqual(self.runner.purge(), 1)
+        self.assertIsNone(self.runner.get(done['id']))
+        self.assertIsNone(self.runner.result(done['id']))
+        # Unfinished jobs are kept whatever their age
+        self.assertEqual(self.runner.purge(max_age=-1), 0)
+        self.assertIsNotNone(self.runner.get(running))
+        proceed.set()
+        wait_for(self.runner, running)
+        # A runner purges on startup and on submit
+        restarted = JobRunner(self.path, retention=-1)
+        self.assertIsNone(restarted.get(running))
+        restarted._executor.shutdown(wait=True)
+
+    def test_default_runner_location(self):
+        with patch.dict(os.environ, {'REVIEW_ANALYZER_CACHE_DIR': self.tmpdir.name}), \
+                patch.object(jobs, '_default_runner', None):
+            runner = jobs.get_default_runner()
+            self.assertEqual(runner.path, os.path.join(self.tmpdir.name, 'jobs.sqlite'))
+            self.assertIs(jobs.get_default_runner(), runner)
+            runner._executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
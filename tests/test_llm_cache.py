@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from langchain.prompts import PromptTemplate
+from utils import llm_cache
+from utils.benchmark import FakeBedrockChat
+from utils.llm_cache import LLMCache, make_key
+from utils.review_analyzer import _stream_chain
+
+
+class TestMakeKey(unittest.TestCase):
+
+    def test_make_key_depends_on_every_parameter(self):
+        base = ('template', 'rendered', 'model', 0.0, 0.9, 4096)
+        keys = {make_key(*base)}
+        for i, value in enumerate(['t2', 'r2', 'm2', 0.5, 0.5, 1024]):
+            params = list(base)
+            params[i] = value
+            keys.add(make_key(*params))
+        self.assertEqual(len(keys), 7)
+        self.assertEqual(make_key(*base), make_key(*base))
+
+
+class TestLLMCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_set_counters(self):
+        cache = LLMCache(self.path)
+        self.assertIsNone(cache.get('k'))
+        cache.set('k', '<issue/>')
+        self.assertEqual(cache.get('k'), '<issue/>')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_persisted_across_instances(self):
+        LLMCache(self.path).set('k', 'v')
+        self.assertEqual(LLMCache(self.path).get('k'), 'v')
+
+    def test_evict_by_size_least_recently_used_first(self):
+        cache = LLMCache(self.path, max_bytes=10)
+        cache.set('a', 'x' * 5)
+        time.sleep(0.01)
+        cache.set('b', 'y' * 5)
+        time.sleep(0.01)
+        cache.get('a')
+        cache.set('c', 'z' * 5)
+        cache.evict()
+        self.assertEqual(cache.get('a'), 'x' * 5)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'z' * 5)
+
+    def test_evict_by_age(self):
+        cache = LLMCache(self.path, max_age_days=1)
+        cache.set('k', 'v')
+        with patch('utils.llm_cache.time.time', return_value=time.time() + 2 * 86400):
+            self.assertIsNone(cache.get('k'))
+            cache.evict()
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+class TestStreamChainCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {'REVIEW_ANALYZER_CACHE_DIR': self.tmpdir.name, 'REVIEW_ANALYZER_LLM_CACHE': '1'})
+        self.env.start()
+        llm_cache._default_cache = None
+        self.prompt = PromptTemplate(template='Analyze <review>{document}</review>', input_variables=['document'])
+
+    def tearDown(self):
+        llm_cache._default_cache = None
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def test_second_call_is_served_from_cache(self):
+        chat = FakeBedrockChat()
+        result = _stream_chain(self.prompt, chat, {'document': 'batch'})
+        self.assertEqual(_stream_chain(self.prompt, chat, {'document': 'batch'}), result)
+        _stream_chain(self.prompt, chat, {'document': 'other batch'})
+        self.assertEqual(chat.stats()['calls'], 2)
+        stats = llm_cache.get_default_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_model_parameters_are_part_of_the_key(self):
+        chat = FakeBedrockChat()
+        hot_chat = FakeBedrockChat(model_kwargs={'max_tokens': 4096, 'temperature': 1.0})
+        _stream_chain(self.prompt, chat, {'document': 'batch'})
+        _stream_chain(self.prompt, hot_chat, {'document': 'batch'})
+        self.assertEqual(hot_chat.stats()['calls'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
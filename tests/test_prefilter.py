@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import pandas as pd
+from utils import issues, review_analyzer
+from utils.benchmark import FakeBedrockChat, generate_reviews
+from utils.prefilter import SKIP_REASONS, classify_reviews, describe_skipped, filter_reviews
+from utils.review_analyzer import _analyze_groups
+from tests.helpers import NoCacheTestCase
+
+
+class TestPrefilter(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'App Version Code': pd.Categorical(['1.0', '1.0', '1.0', '2.0', '2.0', '2.0', '2.0', '2.0']),
+            'Reviewer Language': ['en', 'en', 'ja', 'ja', 'en', 'zh-Hans', 'en', 'ko'],
+            'Review Title': ['', None, '', '', '', '', '', ''],
+            'Review Text': [None, '😡😡!!', 'Crashes all the time', '落ちる', 'ok', '差', 'Login fails', 'Lag'],
+        })
+
+    def test_classify_reviews(self):
+        self.assertEqual(classify_reviews(self.df).tolist(),
+                         ['empty', 'emoji_only', 'language_mismatch', pd.NA, 'too_short', pd.NA, pd.NA, 'language_mismatch'])
+        # Unknown languages never mismatch
+        self.assertTrue(pd.isna(classify_reviews(self.df.assign(**{'Reviewer Language': 'xx'}))[2]))
+
+    def test_filter_reviews_counts_per_group(self):
+        kept, skipped = filter_reviews(self.df, by='App Version Code')
+        self.assertEqual(kept.index.tolist(), [3, 5, 6])
+        self.assertEqual(skipped['1.0'], {'empty': 1, 'emoji_only': 1, 'too_short': 0, 'language_mismatch': 1})
+        self.assertEqual(skipped['2.0'], {'empty': 0, 'emoji_only': 0, 'too_short': 1, 'language_mismatch': 1})
+
+        _, skipped = filter_reviews(self.df, by=['Reviewer Language', 'App Version Code'])
+        self.assertEqual(skipped[('ja', '1.0')]['language_mismatch'], 1)
+        self.assertNotIn(('ja', '2.0'), skipped)
+        _, skipped = filter_reviews(self.df)
+        self.assertEqual(sum(skipped[None].values()), 5)
+
+    def test_nothing_skipped(self):
+        df = self.df.iloc[[3, 5, 6]]
+        kept, skipped = filter_reviews(df, by='App Version Code')
+        self.assertIs(kept, df)
+        self.assertEqual(skipped, {})
+        self.assertTrue(filter_reviews(pd.DataFrame())[0].empty)
+
+    def test_describe_skipped(self):
+        self.assertEqual(describe_skipped({'empty': 12, 'emoji_only': 3, 'too_short': 0, 'language_mismatch': 0}),
+                         '15 (empty: 12, emoji or punctuation only: 3)')
+        self.assertEqual(describe_skipped(None), '0')
+
+
+@patch('utils.progress.st')
+class TestAnalysisSkipsReviews(NoCacheTestCase):
+
+    def test_skipped_counts_are_passed_to_the_report(self, mock_st):
+        report_fn = MagicMock(return_value='report')
+        skipped = {'1.0': dict(zip(SKIP_REASONS, [2, 0, 1, 0]))}
+        groups = [('1.0', [MagicMock(page_content='a')]), ('2.0', [MagicMock(page_content='b')])]
+        result = _analyze_groups(groups, MagicMock(return_value=''), MagicMock(), None, str, report_fn=report_fn,
+                                 skipped=skipped)
+        self.assertEqual(result['1.0']['skipped'], skipped['1.0'])
+        self.assertEqual(sum(result['2.0']['skipped'].values()), 0)
+        report_fn.assert_any_call(result['1.0']['xmldata'], None, skipped['1.0'])
+
+    def test_analyze_data_sends_meaningful_reviews_only(self, mock_st):
+        df = generate_reviews(rows=60, languages=('en',), versions=1, duplicate_rate=0)
+        df.loc[:9, 'Review Text'] = ''
+        df.loc[10:14, 'Review Text'] = '👍'
+        chat = FakeBedrockChat()
+        result = review_analyzer.analyze_data(df, chat)
+        version = df['App Version Code'].iloc[0]
+        self.assertEqual(result[version]['skipped'], {'empty': 10, 'emoji_only': 5, 'too_short': 0, 'language_mismatch': 0})
+        self.assertEqual(issues.total_count(result[version]['issues']), 45)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from utils import progress
+from utils.progress import CallbackReporter, LoggingReporter, ProgressReporter, StreamlitReporter
+
+
+class TestReporters(unittest.TestCase):
+
+    def test_default_reporter_is_streamlit(self):
+        self.assertIsInstance(progress.get_reporter(), StreamlitReporter)
+
+    @patch('utils.progress.st')
+    def test_streamlit_reporter(self, mock_st):
+        reporter = StreamlitReporter()
+        reporter.start('Start analyzing data...')
+        reporter.report('Report completed', '## Summary')
+        mock_st.markdown.assert_any_call('**Start analyzing data...**')
+        mock_st.success.assert_called_once_with('Report completed', icon="✅")
+        mock_st.markdown.assert_called_with('## Summary')
+
+    def test_logging_reporter_logs_json(self):
+        logger = logging.getLogger('test_progress')
+        with self.assertLogs(logger, level='INFO') as logs:
+            reporter = LoggingReporter(logger, input='export.csv')
+            reporter.step('Batch 1/2 analyzed')
+            reporter.report('Report completed', 'abc')
+        events = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(events[0], {'input': 'export.csv', 'event': 'step', 'message': 'Batch 1/2 analyzed'})
+        self.assertEqual(events[1]['length'], 3)
+
+    def test_callback_reporter(self):
+        callback = MagicMock()
+        reporter = CallbackReporter(callback)
+        reporter.done('Analysis completed')
+        reporter.report('Report completed', 'long markdown')
+        self.assertEqual([c.args for c in callback.call_args_list], [('Analysis completed',), ('Report completed',)])
+
+    def test_use_reporter_is_per_thread(self):
+        reporter = ProgressReporter()
+        seen = []
+        with progress.use_reporter(reporter):
+            self.assertIs(progress.get_reporter(), reporter)
+            thread = threading.Thread(target=lambda: seen.append(progress.get_reporter()))
+            thread.start()
+            thread.join()
+        self.assertIsInstance(seen[0], StreamlitReporter)
+        self.assertIsInstance(progress.get_reporter(), StreamlitReporter)
+
+
+    def test_batch_events(self):
+        fields = {'group': 'dataset version 1.0', 'batch': 2, 'batches': 5, 'rows': 120, 'tokens': 900,
+                  'output_tokens': 300, 'latency': 3.24}
+        self.assertEqual(progress.format_event('batch_finished', fields),
+                         '- Batch 2/5 of dataset version 1.0 analyzed: 120 reviews in 3.2s')
+        self.assertIsNone(progress.format_event('batch_started', fields))
+
+        callback = MagicMock()
+        CallbackReporter(callback).event('batch_finished', **fields)
+        callback.assert_called_once_with('- Batch 2/5 of dataset version 1.0 analyzed: 120 reviews in 3.2s')
+
+        logger = logging.getLogger('test_progress')
+        with self.assertLogs(logger, level='INFO') as logs:
+            LoggingReporter(logger, input='export.csv').event('batch_finished', **fields)
+        self.assertEqual(json.loads(logs.records[0].getMessage()), {'input': 'export.csv', 'event': 'batch_finished', **fields})
+
+    def test_analyzer_imports_without_streamlit(self):
+        # Blocking the module makes "import streamlit" raise ImportError
+        code = ("import sys; sys.modules['streamlit'] = None\n"
+                "from utils import progress, review_analyzer\n"
+                "assert isinstance(progress.get_reporter(), progress.NullReporter)")
+        subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+
+
+if __name__ == '__main__':
+    unittest.main()
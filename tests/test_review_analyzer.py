@@ -1,13 +1,26 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
+from langchain.schema import Document
+from utils.batching import estimate_tokens
+from utils import issue_store, issues, review_analyzer, review_exports
+from utils.benchmark import FakeBedrockChat, generate_reviews, install_scheduler
+from utils.progress import NullReporter, ProgressReporter, use_reporter
 from utils.review_analyzer import (
     _split_df_to_docs, _analyze_review_by_lang, _analyze_review,
     _merge_review_by_lang, _merge_review, _write_analysis_report,
     _compare_analysis_result_by_lang, _compare_analysis_result,
     _init_data_by_lang, _init_data, analyze_data, analyze_data_by_lang,
-    compare_target_data_by_lang, compare_target_data
+    compare_target_data_by_lang, compare_target_data,
+    _run_batches, _analyze_groups, _merge_partials, DEFAULT_INPUT_TOKEN_BUDGET
 )
+from tests.helpers import NoCacheTestCase
 
 class TestReviewAnalyzerSplitDFToDocs(unittest.TestCase):
     
@@ -48,6 +61,44 @@ class TestReviewAnalyzerSplitDFToDocs(unittest.TestCase):
         empty_df = pd.DataFrame()
         docs = _split_df_to_docs(empty_df)
         self.assertEqual(len(docs), 0)
+
+    def test_split_df_to_docs_token_budget(self):
+        # 测试按token预算拆分, 每行评论完整保留在一个批次中
+        df = pd.DataFrame({
+            'App Version Code': ['1.0'] * 50,
+            'Review Text': [f'review number {i} crashes on start' for i in range(50)]
+        })
+        docs = _split_df_to_docs(df, token_budget=60)
+        self.assertGreater(len(docs), 1)
+        lines = [line for doc in docs for line in doc.page_content.split('\n')[1:]]
+        self.assertEqual(len(lines), 50)
+        self.assertEqual(sum(doc.metadata['rows'] for doc in docs), 50)
+        for i in range(50):
+            self.assertEqual(sum(f'review number {i} crashes' in line for line in lines), 1)
+
+    def test_prompts_describe_tab_separated_rows(self):
+        # 测试分析提示词描述的格式与编码一致 (制表符分隔, 首行为表头)
+        content = _split_df_to_docs(self.sample_df)[0].page_content
+        self.assertEqual(content.split('\n')[0].split('\t')[:2], ['App Version Code', 'Reviewer Language'])
+        analyze_fns = [review_analyzer._analyze_review, review_analyzer._analyze_review_by_lang,
+                       review_analyzer._analyze_review_without_version,
+                       review_analyzer._analyze_review_by_lang_without_version]
+        with patch('utils.review_analyzer._stream_chain', return_value='') as stream:
+            for analyze_fn in analyze_fns:
+                analyze_fn(content, self.mock_bedrock_chat)
+            review_analyzer._name_review_cluster(f"<cluster version='1.0' reviews='2'>\n{content}", self.mock_bedrock_chat)
+        for call in stream.call_args_list:
+            template = call.args[0].template
+            self.assertIn('tab-separated', template)
+            self.assertNotIn('csv', template.lower())
+
+    def test_split_df_to_docs_header_per_batch(self):
+        # 测试每个批次都包含表头
+        df = pd.DataFrame({'Review Title': ['t'] * 40, 'Review Text': ['some review text'] * 40})
+        docs = _split_df_to_docs(df, token_budget=30)
+        self.assertGreater(len(docs), 1)
+        for doc in docs:
+            self.assertEqual(doc.page_content.split('\n')[0], 'Review Title\tReview Text')
     
 # class TestAnalyzeReviewByLang(unittest.TestCase):
 
@@ -179,7 +230,7 @@ class TestReviewAnalyzerSplitDFToDocs(unittest.TestCase):
 #     #     self.assertIsInstance(result, str)
 #     #     self.assertEqual(result, "Comparisonresult")
 
-#     # @patch('utils.review_analyzer.st')
+#     # @patch('utils.progress.st')
 #     # def test_init_data_by_lang(self, mock_st):
 #     #     result = _init_data_by_lang(self.sample_df)
 #     #     self.assertIsInstance(result, dict)
@@ -187,7 +238,7 @@ class TestReviewAnalyzerSplitDFToDocs(unittest.TestCase):
 #     #     self.assertIn('en', result)
 #     #     self.assertIn('fr', result)
 
-#     # @patch('utils.review_analyzer.st')
+#     # @patch('utils.progress.st')
 #     # def test_init_data(self, mock_st):
 #     #     result = _init_data(self.sample_df)
 #     #     self.assertIsInstance(result, dict)
@@ -195,7 +246,7 @@ class TestReviewAnalyzerSplitDFToDocs(unittest.TestCase):
 #     #     self.assertIn('1.0', result)
 #     #     self.assertIn('2.0', result)
 
-#     # @patch('utils.review_analyzer.st')
+#     # @patch('utils.progress.st')
 #     # @patch('utils.review_analyzer._init_data')
 #     # @patch('utils.review_analyzer._analyze_review')
 #     # @patch('utils.review_analyzer._merge_review')
@@ -213,7 +264,7 @@ class TestReviewAnalyzerSplitDFToDocs(unittest.TestCase):
 #     #     self.assertIn('xmldata', result['1.0'])
 #     #     self.assertIn('report', result['1.0'])
 
-#     # @patch('utils.review_analyzer.st')
+#     # @patch('utils.progress.st')
 #     # @patch('utils.review_analyzer._init_data_by_lang')
 #     # @patch('utils.review_analyzer._analyze_review_by_lang')
 #     # @patch('utils.review_analyzer._merge_review_by_lang')
@@ -232,7 +283,7 @@ class TestReviewAnalyzerSplitDFToDocs(unittest.TestCase):
 #     #     self.assertIn('xmldata', result['en']['1.0'])
 #     #     self.assertIn('report', result['en']['1.0'])
 
-#     # @patch('utils.review_analyzer.st')
+#     # @patch('utils.progress.st')
 #     # @patch('utils.review_analyzer._compare_analysis_result_by_lang')
 #     # def test_compare_target_data_by_lang(self, mock_compare, mock_st):
 #     #     mock_compare.return_value = "Comparison result"
@@ -247,7 +298,7 @@ class TestReviewAnalyzerSplitDFToDocs(unittest.TestCase):
 #     #     self.assertIn('en', result)
 #     #     self.assertEqual(result['en'], "Comparison result")
 
-#     # @patch('utils.review_analyzer.st')
+#     # @patch('utils.progress.st')
 #     # @patch('utils.review_analyzer._compare_analysis_result')
 #     # def test_compare_target_data(self, mock_compare, mock_st):
 #     #     mock_compare.return_value = "Comparison result"
@@ -272,14 +323,14 @@ class TestInitData(unittest.TestCase):
             'Review Text': ['Nice app', 'Could be better', 'Love it', 'Needs improvement']
         })
 
-    @patch('utils.review_analyzer.st')
+    @patch('utils.progress.st')
     @patch('utils.review_analyzer._split_df_to_docs')
     def test_init_data_basic(self, mock_split_df_to_docs, mock_st):
         # Setup
         mock_split_df_to_docs.return_value = [MagicMock()]
         
         # Execute
-        result = _init_data(self.sample_df)
+        result = dict(_init_data(self.sample_df))
         
         # Assert
         self.assertIsInstance(result, dict)
@@ -288,21 +339,21 @@ class TestInitData(unittest.TestCase):
         self.assertIn('2.0', result)
         self.assertEqual(mock_split_df_to_docs.call_count, 2)
 
-    @patch('utils.review_analyzer.st')
+    @patch('utils.progress.st')
     @patch('utils.review_analyzer._split_df_to_docs')
     def test_init_data_empty_df(self, mock_split_df_to_docs, mock_st):
         # Setup
         empty_df = pd.DataFrame()
         
         # Execute
-        result = _init_data(empty_df)
+        result = dict(_init_data(empty_df))
         
         # Assert
         self.assertIsInstance(result, dict)
         self.assertEqual(len(result), 0)
         mock_split_df_to_docs.assert_not_called()
 
-    @patch('utils.review_analyzer.st')
+    @patch('utils.progress.st')
     @patch('utils.review_analyzer._split_df_to_docs')
     def test_init_data_single_version(self, mock_split_df_to_docs, mock_st):
         # Setup
@@ -314,7 +365,7 @@ class TestInitData(unittest.TestCase):
         mock_split_df_to_docs.return_value = [MagicMock()]
         
         # Execute
-        result = _init_data(single_version_df)
+        result = dict(_init_data(single_version_df))
         
         # Assert
         self.assertIsInstance(result, dict)
@@ -322,19 +373,36 @@ class TestInitData(unittest.TestCase):
         self.assertIn('1.0', result)
         mock_split_df_to_docs.assert_called_once()
 
-    @patch('utils.review_analyzer.st')
+    @patch('utils.progress.st')
     @patch('utils.review_analyzer._split_df_to_docs')
     def test_init_data_streamlit_calls(self, mock_split_df_to_docs, mock_st):
         # Setup
         mock_split_df_to_docs.return_value = [MagicMock()]
         
         # Execute
-        _init_data(self.sample_df)
+        list(_init_data(self.sample_df))
         
         # Assert
         mock_st.markdown.assert_called_once_with('**Start splitting data...**')
         self.assertEqual(mock_st.success.call_count, 2)  # One call for each version
 
+    @patch('utils.progress.st')
+    def test_init_data_by_lang_only_non_empty_groups(self, mock_st):
+        # ('de', '1.0') and ('fr', '2.0') don't exist and must not be produced
+        result = dict(_init_data_by_lang(self.sample_df))
+        self.assertEqual(list(result), [('en', '1.0'), ('fr', '1.0'), ('en', '2.0'), ('de', '2.0')])
+        for docs in result.values():
+            self.assertEqual(len(docs), 1)
+
+    @patch('utils.progress.st')
+    @patch('utils.review_analyzer._split_df_to_docs')
+    def test_init_data_is_lazy(self, mock_split_df_to_docs, mock_st):
+        mock_split_df_to_docs.return_value = [MagicMock()]
+        groups = _init_data(self.sample_df)
+        mock_split_df_to_docs.assert_not_called()
+        self.assertEqual(next(groups)[0], '1.0')
+        mock_split_df_to_docs.assert_called_once()
+
 class TestAnalyzeData(unittest.TestCase):
 
     def setUp(self):
@@ -354,10 +422,10 @@ class TestAnalyzeData(unittest.TestCase):
     @patch('utils.review_analyzer._analyze_review')
     @patch('utils.review_analyzer._merge_review')
     @patch('utils.review_analyzer._write_analysis_report')
-    @patch('utils.review_analyzer.st')
+    @patch('utils.progress.st')
     def test_analyze_data_basic(self, mock_st, mock_write_report, mock_merge, mock_analyze, mock_init_data):
         # Setup
-        mock_init_data.return_value = {'1.0': [MagicMock()], '2.0': [MagicMock()]}
+        mock_init_data.return_value = iter({'1.0': [MagicMock()], '2.0': [MagicMock()]}.items())
         mock_analyze.return_value = "<mocked_analysis>"
         mock_merge.return_value = "<merged_analysis>"
         mock_write_report.return_value = "Mocked report"
@@ -374,35 +442,37 @@ class TestAnalyzeData(unittest.TestCase):
             self.assertIn('report', result[version])
         mock_init_data.assert_called_once()
         self.assertEqual(mock_analyze.call_count, 2)  # Once for each version
-        self.assertEqual(mock_merge.call_count, 2)
+        # 单批次的版本无需合并, 分析结果直接用于报告
+        mock_merge.assert_not_called()
+        self.assertEqual(result['1.0']['xmldata'], "<mocked_analysis>")
         self.assertEqual(mock_write_report.call_count, 2)
 
     @patch('utils.review_analyzer._init_data')
-    @patch('utils.review_analyzer.st')
+    @patch('utils.progress.st')
     def test_analyze_data_empty_df(self, mock_st, mock_init_data):
         # Setup
         empty_df = pd.DataFrame()
-        mock_init_data.return_value = {}
+        mock_init_data.return_value = iter([])
         
         # Execute
         result = analyze_data(empty_df, self.mock_bedrock_chat)
         
         # Assert
         self.assertEqual(result, {})
-        mock_init_data.assert_called_once_with(empty_df)
+        mock_init_data.assert_called_once_with(empty_df, DEFAULT_INPUT_TOKEN_BUDGET)
 
     @patch('utils.review_analyzer._init_data')
     @patch('utils.review_analyzer._analyze_review')
     @patch('utils.review_analyzer._merge_review')
     @patch('utils.review_analyzer._write_analysis_report')
-    @patch('utils.review_analyzer.st')
+    @patch('utils.progress.st')
     def test_analyze_data_single_version(self, mock_st, mock_write_report, mock_merge, mock_analyze, mock_init_data):
         # Setup
         single_version_df = pd.DataFrame({
             'App Version Code': ['1.0', '1.0', '1.0'],
             'Review Text': ['Text1', 'Text2', 'Text3']
         })
-        mock_init_data.return_value = {'1.0': [MagicMock()]}
+        mock_init_data.return_value = iter({'1.0': [MagicMock()]}.items())
         mock_analyze.return_value = "<mocked_analysis>"
         mock_merge.return_value = "<merged_analysis>"
         mock_write_report.return_value = "Mocked report"
@@ -418,17 +488,18 @@ class TestAnalyzeData(unittest.TestCase):
         self.assertIn('report', result['1.0'])
         mock_init_data.assert_called_once()
         mock_analyze.assert_called_once()
-        mock_merge.assert_called_once()
-        mock_write_report.assert_called_once()
+        # 单批次的版本无需合并, 分析结果直接用于报告
+        mock_merge.assert_not_called()
+        self.assertEqual(mock_write_report.call_args.args[0], "<mocked_analysis>")
 
     @patch('utils.review_analyzer._init_data')
     @patch('utils.review_analyzer._analyze_review')
     @patch('utils.review_analyzer._merge_review')
     @patch('utils.review_analyzer._write_analysis_report')
-    @patch('utils.review_analyzer.st')
+    @patch('utils.progress.st')
     def test_analyze_data_streamlit_calls(self, mock_st, mock_write_report, mock_merge, mock_analyze, mock_init_data):
         # Setup
-        mock_init_data.return_value = {'1.0': [MagicMock()]}
+        mock_init_data.return_value = iter({'1.0': [MagicMock()]}.items())
         mock_analyze.return_value = "<mocked_analysis>"
         mock_merge.return_value = "<merged_analysis>"
         mock_write_report.return_value = "Mocked report"
@@ -443,5 +514,302 @@ class TestAnalyzeData(unittest.TestCase):
         self.assertGreater(mock_st.divider.call_count, 0)
 
 
+class TestRunBatches(unittest.TestCase):
+
+    def test_run_batches_returns_all_results(self):
+        tasks = [(i, lambda x: x * 2, (i,)) for i in range(10)]
+        result = dict(_run_batches(tasks, max_concurrency=3))
+        self.assertEqual(result, {i: i * 2 for i in range(10)})
+
+    def test_run_batches_bounds_in_flight_calls(self):
+        lock = threading.Lock()
+        state = {'in_flight': 0, 'peak': 0}
+
+        def work(x):
+            with lock:
+                state['in_flight'] += 1
+                state['peak'] = max(state['peak'], state['in_flight'])
+            time.sleep(0.01)
+            with lock:
+                state['in_flight'] -= 1
+            return x
+
+        list(_run_batches([(i, work, (i,)) for i in range(12)], max_concurrency=4))
+        self.assertLessEqual(state['peak'], 4)
+        self.assertGreater(state['peak'], 1)
+
+    def test_run_batches_propagates_errors(self):
+        def fail(_):
+            raise ValueError('boom')
+        with self.assertRaises(ValueError):
+            list(_run_batches([(0, fail, (0,))]))
+
+    @patch('utils.progress.st')
+    def test_analyze_groups_keeps_batch_order(self, mock_st):
+        groups = {
+            '1.0': [MagicMock(page_content='a'), MagicMock(page_content='b')],
+            '2.0': [MagicMock(page_content='c')],
+        }
+        analyze_fn = lambda content, chat, on_record: f'<{content}>'
+        merge_fn = lambda content, chat: f'merged{content}'
+
+        result = _analyze_groups(groups.items(), analyze_fn, merge_fn, None, str, max_concurrency=3)
+
+        self.assertEqual({key: value['xmldata'] for key, value in result.items()}, {'1.0': 'merged<a><b>', '2.0': '<c>'})
+
+    def test_analyze_groups_reports_batch_events(self):
+        reporter = MagicMock(spec=ProgressReporter)
+        docs = [Document(page_content='a', metadata={'rows': 3, 'tokens': 40}),
+                Document(page_content='b', metadata={'rows': 1, 'tokens': 12})]
+        with use_reporter(reporter):
+            _analyze_groups([('1.0', docs)], lambda content, chat, on_record: 'x' * 40, MagicMock(return_value=''), None,
+                            lambda key: f'version {key}', max_concurrency=2)
+
+        events = [c for c in reporter.event.call_args_list]
+        started = [c.kwargs for c in events if c.args == ('batch_started',)]
+        finished = sorted((c.kwargs for c in events if c.args == ('batch_finished',)), key=lambda f: f['batch'])
+        self.assertEqual(started[0], {'group': 'version 1.0', 'batch': 1, 'batches': 2, 'rows': 3, 'reviews': 3, 'tokens': 40})
+        self.assertEqual([(f['batch'], f['rows'], f['output_tokens']) for f in finished], [(1, 3, estimate_tokens('x' * 40)), (2, 1, estimate_tokens('x' * 40))])
+        self.assertTrue(all(f['latency'] >= 0 for f in finished))
+
+    @patch('utils.progress.st')
+    def test_analyze_groups_uses_streamed_records(self, mock_st):
+        def analyze_fn(content, chat, on_record):
+            on_record({'version': '1.0', 'lang': None, 'category': 'Crash', 'count': int(content), 'description': ''})
+            return 'unparsed'
+        groups = [('1.0', [MagicMock(page_content='2'), MagicMock(page_content='3')])]
+        merge_fn = MagicMock()
+        report_fn = MagicMock(return_value='report')
+
+        result = _analyze_groups(groups, analyze_fn, merge_fn, None, str, report_fn=report_fn)
+
+        merge_fn.assert_not_called()
+        self.assertEqual([r['count'] for r in result['1.0']['issues']], [5])
+        self.assertIn('<count>5</count>', result['1.0']['xmldata'])
+        self.assertEqual(result['1.0']['report'], 'report')
+        report_fn.assert_called_once_with(result['1.0']['xmldata'], None)
+
+    @patch('utils.progress.st')
+    def test_analyze_groups_merges_group_before_others_are_analyzed(self, mock_st):
+        events = []
+        lock = threading.Lock()
+
+        def analyze_fn(content, chat, on_record):
+            time.sleep(0.01)
+            with lock:
+                events.append(('analyze', content))
+            return content
+
+        def merge_fn(content, chat):
+            with lock:
+                events.append(('merge', content))
+            return content
+
+        groups = [('1.0', [MagicMock(page_content='a'), MagicMock(page_content='b')]),
+                  ('2.0', [MagicMock(page_content=c) for c in 'cdefgh'])]
+        _analyze_groups(groups, analyze_fn, merge_fn, None, str, max_concurrency=1)
+
+        self.assertLess(events.index(('merge', 'ab')), events.index(('analyze', 'h')))
+
+
+class TestMergePartials(unittest.TestCase):
+
+    @patch('utils.progress.st')
+    def test_merge_partials_single_call_when_within_budget(self, mock_st):
+        merge_fn = MagicMock(side_effect=lambda content, chat: f'[{content}]')
+        result = _merge_partials({'1.0': ['a', 'b', 'c']}, merge_fn, None, str)
+        self.assertEqual(result, {'1.0': '[abc]'})
+        merge_fn.assert_called_once()
+
+    @patch('utils.progress.st')
+    def test_merge_partials_builds_tree_within_budget(self, mock_st):
+        calls = []
+        lock = threading.Lock()
+
+        def merge_fn(content, chat):
+            with lock:
+                calls.append(content)
+            return 'm' * 40  # each merged output ~12 tokens
+
+        partials = {'1.0': ['x' * 40] * 8, '2.0': ['y' * 40]}
+        result = _merge_partials(partials, merge_fn, None, str, max_concurrency=4, token_budget=30)
+
+        self.assertEqual(list(result), ['1.0', '2.0'])
+        self.assertEqual(result['2.0'], 'y' * 40)  # single partial is not merged
+        # 8 partials of ~12 tokens, 2 per call: 4 + 2 + 1 merge calls
+        self.assertEqual(len(calls), 7)
+        for content in calls:
+            self.assertLessEqual(len(content), 80)
+
+    @patch('utils.progress.st')
+    def test_merge_partials_merge_single(self, mock_st):
+        merge_fn = MagicMock(return_value='merged')
+        result = _merge_partials({'en': ['a']}, merge_fn, None, str, merge_single=True)
+        self.assertEqual(result, {'en': 'merged'})
+
+    @patch('utils.progress.st')
+    def test_merge_partials_exact_duplicates_merged_locally(self, mock_st):
+        merge_fn = MagicMock()
+        partials = {'1.0': [
+            "<version='1.0'><issue><category>Crash</category><count>2</count><description>a</description></issue></version>",
+            "<version='1.0'><issue><category>crash</category><count>3</count><description>b</description></issue></version>",
+        ]}
+        result = _merge_partials(partials, merge_fn, None, str)
+        merge_fn.assert_not_called()
+        self.assertIn('<count>5</count>', result['1.0'])
+
+    @patch('utils.progress.st')
+    def test_merge_partials_only_similar_categories_go_to_model(self, mock_st):
+        partials = {'1.0': [
+            "<version='1.0'><issue><category>Crash on startup</category><count>2</count></issue>"
+            "<issue><category>Too many ads</category><count>7</count></issue></version>",
+            "<version='1.0'><issue><category>Crashes on startup</category><count>3</count></issue></version>",
+        ]}
+        merge_fn = MagicMock(return_value="<version='1.0'><issue><category>Crash</category><count>5</count></issue></version>")
+        result = _merge_partials(partials, merge_fn, None, str)
+
+        merge_fn.assert_called_once()
+        self.assertNotIn('Too many ads', merge_fn.call_args[0][0])
+        self.assertIn('<category>Too many ads</category>\n<count>7</count>', result['1.0'])
+        self.assertIn('<category>Crash</category>\n<count>5</count>', result['1.0'])
+
+    @patch('utils.progress.st')
+    def test_merge_partials_rejects_wrong_model_totals(self, mock_st):
+        partials = {'1.0': [
+            "<version='1.0'><issue><category>Crash on startup</category><count>2</count></issue></version>",
+            "<version='1.0'><issue><category>Crashes on startup</category><count>3</count></issue></version>",
+        ]}
+        merge_fn = MagicMock(return_value="<version='1.0'><issue><category>Crash</category><count>9</count></issue></version>")
+        result = _merge_partials(partials, merge_fn, None, str)
+        self.assertNotIn('<count>9</count>', result['1.0'])
+        self.assertIn('<count>3</count>', result['1.0'])
+
+
+class TestStreamChain(NoCacheTestCase):
+
+    def test_dropped_stream_does_not_pass_records_twice(self):
+        # About a third of the calls fail after their first chunk and is retried by the scheduler
+        data = generate_reviews(rows=300, languages=('en', 'fr'), versions=2)
+        chat = FakeBedrockChat(drop_rate=0.3, seed=4)
+        install_scheduler(chat, base_backoff=0.001, max_backoff=0.01)
+        records = []
+        content = _split_df_to_docs(data)[0].page_content
+        result = review_analyzer._analyze_review(content, chat, records.append)
+        self.assertGreater(chat.stats()['drops'], 0)
+        self.assertEqual(records, issues.parse_issues(result))
+        self.assertEqual(issues.total_count(records), len(data))
+
+        with use_reporter(NullReporter()):
+            analysis = review_analyzer.analyze_data(data, chat, token_budget=2000)
+        self.assertGreater(chat.stats()['drops'], 1)
+        self.assertEqual({version: issues.total_count(r['issues']) for version, r in analysis.items()},
+                         data['App Version Code'].value_counts().to_dict())
+
+    def test_content_blocks_are_joined(self):
+        self.assertEqual(review_analyzer._chunk_text('<issue>'), '<issue>')
+        self.assertEqual(review_analyzer._chunk_text([{'type': 'text', 'text': '<iss'}, {'type': 'tool_use'}, 'ue>']),
+                         '<issue>')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(review_analyzer._chunk_text(None), '')
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        export = pd.DataFrame({
+            'App Version Code': ['101', '102', '102'],
+            'Reviewer Language': ['en', 'en', 'fr'],
+            'Device': ['pixel', 'pixel', 'galaxy'],
+            'Review Last Update Date and Time': ['2024-01-05T10:00:00Z'] * 3,
+            'Star Rating': [1, 2, 5],
+            'Review Title': ['a', 'b', 'c'],
+            'Review Text': ['Crashes', 'Slow', 'Super'],
+        })
+        self.paths = []
+        for name in ['jan', 'feb']:
+            path = os.path.join(self.tmpdir.name, f'{name}.csv')
+            with open(path, 'wb') as f:
+                f.write(export.to_csv(index=False).encode('utf-16'))
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_run_writes_json_and_markdown_per_input(self):
+        analyze = MagicMock(side_effect=lambda data, chat, **kwargs: {
+            version: {'xmldata': '', 'issues': [], 'report': f'report {version}'}
+            for version in data['App Version Code'].unique()
+        })
+        compare = MagicMock(return_value='comparison report')
+        output_dir = os.path.join(self.tmpdir.name, 'out')
+        with patch.dict(os.environ, {'REVIEW_ANALYZER_CACHE_DIR': self.tmpdir.name}), \
+                patch.object(review_exports, '_default_store', None), \
+                patch.dict(review_analyzer.GROUP_BY, {'version': (analyze, compare)}), \
+                patch('utils.review_analyzer.bedrock_wrapper.get_bedrock_chat') as mock_chat, \
+                self.assertLogs('review_analyzer', level='INFO'):
+            code = review_analyzer.main(['run', '--input', *self.paths, '--target', '102', '--output-dir', output_dir])
+
+        self.assertEqual(code, 0)
+        self.assertEqual(analyze.call_count, 2)
+        # Only the 1 and 2 star reviews are analyzed by default
+        self.assertEqual(len(analyze.call_args.args[0]), 2)
+        self.assertEqual(compare.call_args.args[0], '102')
+        self.assertIs(compare.call_args.args[2], mock_chat.return_value)
+        self.assertEqual(sorted(os.listdir(output_dir)),
+                         ['feb.calls.csv', 'feb.json', 'feb.md', 'jan.calls.csv', 'jan.json', 'jan.md'])
+        with open(os.path.join(output_dir, 'jan.json'), encoding='utf-8') as f:
+            result = json.load(f)
+        self.assertEqual(result['rows'], 2)
+        # The analysis is mocked, so no LLM calls were recorded
+        self.assertEqual(result['metrics']['calls'], 0)
+        self.assertEqual(result['comparison'], 'comparison report')
+        self.assertEqual(result['analysis']['101']['report'], 'report 101')
+        with open(os.path.join(output_dir, 'jan.md'), encoding='utf-8') as f:
+            markdown = f.read()
+        self.assertIn('## Report 102\n\nreport 102', markdown)
+        self.assertIn('## Comparison\n\ncomparison report', markdown)
+
+    def test_incremental_run_uses_the_issue_store(self):
+        analyze = MagicMock(return_value={})
+        with patch.dict(os.environ, {'REVIEW_ANALYZER_CACHE_DIR': self.tmpdir.name}), \
+                patch.object(review_exports, '_default_store', None), \
+                patch.object(issue_store, '_default_store', None), \
+                patch.dict(review_analyzer.GROUP_BY, {'version': (analyze, None)}), \
+                patch('utils.review_analyzer.bedrock_wrapper.get_bedrock_chat'), \
+                self.assertLogs('review_analyzer', level='INFO'):
+            code = review_analyzer.main(['run', '--input', self.paths[0], '--incremental', '--app', 'com.example',
+                                         '--output-dir', self.tmpdir.name])
+        self.assertEqual(code, 0)
+        self.assertIsInstance(analyze.call_args.kwargs['store'], issue_store.IssueStore)
+        self.assertEqual(analyze.call_args.kwargs['scope'], {'app': 'com.example', 'ratings': [1, 2]})
+        with self.assertRaises(SystemExit), patch('sys.stderr'):
+            review_analyzer.main(['run', '--input', self.paths[0], '--incremental', '--group-by', 'lang'])
+
+    def test_failed_input_sets_exit_code(self):
+        analyze = MagicMock(side_effect=ValueError('boom'))
+        with patch.dict(os.environ, {'REVIEW_ANALYZER_CACHE_DIR': self.tmpdir.name}), \
+                patch.object(review_exports, '_default_store', None), \
+                patch.dict(review_analyzer.GROUP_BY, {'lang': (analyze, None)}), \
+                patch('utils.review_analyzer.bedrock_wrapper.get_bedrock_chat'), \
+                self.assertLogs(level='ERROR'):
+            code = review_analyzer.main(['run', '--input', *self.paths, '--combine', '--group-by', 'lang',
+                                         '--output-dir', self.tmpdir.name])
+        self.assertEqual(code, 1)
+        analyze.assert_called_once()
+
+    def test_inputs_with_the_same_file_name_are_rejected(self):
+        other = os.path.join(self.tmpdir.name, 'other')
+        os.makedirs(other)
+        path = os.path.join(other, 'jan.csv')
+        shutil.copy(self.paths[0], path)
+        with self.assertRaises(SystemExit), patch('sys.stderr') as stderr:
+            review_analyzer.main(['run', '--input', self.paths[0], path])
+        self.assertIn('jan', ''.join(call.args[0] for call in stderr.write.call_args_list))
+        # Combined inputs are one analysis, their names do not matter
+        args = review_analyzer._parse_args(['run', '--input', self.paths[0], path, '--combine'])
+        self.assertEqual(args.input, [self.paths[0], path])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
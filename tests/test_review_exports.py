@@ -0,0 +1,106 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from utils import review_exports
+from utils.review_exports import REVIEW_COLUMNS, ReviewStore, content_digest, parse_export, to_review_data
+
+
+def make_export(rows):
+    df = pd.DataFrame(rows, columns=['App Version Code', 'Reviewer Language', 'Device',
+                                     'Review Last Update Date and Time', 'Star Rating', 'Review Text'])
+    return df.to_csv(index=False).encode('utf-16')
+
+
+EXPORT_A = make_export([
+    ['101', 'en', 'pixel', '2024-01-05T10:00:00Z', 1, 'Crashes'],
+    [None, 'fr', 'galaxy', '2024-01-06T11:30:00Z', 5, 'Super'],
+])
+EXPORT_B = make_export([
+    ['102', 'de', 'pixel', '2024-02-01T09:00:00Z', 2, 'Langsam'],
+    ['101', 'en', 'pixel', '2024-01-05T10:00:00Z', 1, 'Crashes'],
+])
+
+
+class TestParseExport(unittest.TestCase):
+
+    def test_parse_export_normalizes_columns(self):
+        df = parse_export(EXPORT_A)
+        self.assertEqual(list(df['App Version Code']), ['101', 'N/A'])
+        self.assertIsInstance(df['Reviewer Language'].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(df['Device'].dtype, pd.CategoricalDtype)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['Review Last Update Date and Time']))
+
+
+class TestReviewStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = ReviewStore(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_ingest_keyed_by_content(self):
+        digest = self.store.ingest(EXPORT_A)
+        self.assertEqual(digest, content_digest(EXPORT_A))
+        self.assertTrue(os.path.exists(self.store.path(digest)))
+        self.assertEqual([name for name in os.listdir(self.tmpdir.name)], [f'{digest}.parquet'])
+
+    def test_ingest_parses_once(self):
+        self.store.ingest(EXPORT_A)
+        with patch('utils.review_exports.parse_export') as mock_parse:
+            self.store.ingest(EXPORT_A)
+            mock_parse.assert_not_called()
+
+    def test_read_concatenates_and_drops_duplicates(self):
+        digests = [self.store.ingest(EXPORT_A), self.store.ingest(EXPORT_B)]
+        df = self.store.read(digests)
+        self.assertEqual(len(df), 3)
+        self.assertEqual(list(df['App Version Code']), ['101', 'N/A', '102'])
+        self.assertIsInstance(df['App Version Code'].dtype, pd.CategoricalDtype)
+        self.assertEqual(list(df.index), [0, 1, 2])
+
+    def test_read_round_trips_dtypes(self):
+        digest = self.store.ingest(EXPORT_A)
+        pd.testing.assert_frame_equal(self.store.read([digest]), parse_export(EXPORT_A))
+
+    def test_clear(self):
+        self.store.ingest(EXPORT_A)
+        self.store.clear()
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_default_store_location(self):
+        with patch.dict(os.environ, {'REVIEW_ANALYZER_CACHE_DIR': self.tmpdir.name}), \
+                patch.object(review_exports, '_default_store', None):
+            store = review_exports.get_default_store()
+            self.assertEqual(store.root, os.path.join(self.tmpdir.name, 'reviews'))
+
+    def test_to_review_data_does_not_modify_raw(self):
+        raw = self.store.read([self.store.ingest(EXPORT_A)])
+        columns = list(raw.columns)
+        reviews = to_review_data(raw.assign(**{'Review Title': ['a', 'b']}))
+        self.assertEqual(list(raw.columns), columns)
+        self.assertEqual(list(reviews.columns), REVIEW_COLUMNS)
+        self.assertEqual(list(reviews['Review Date']), [pd.Timestamp('2024-01-05'), pd.Timestamp('2024-01-06')])
+
+
+    def test_headless_without_streamlit(self):
+        # The command line loads exports through this module, on installs without Streamlit
+        path = os.path.join(self.tmpdir.name, 'reviews.csv')
+        export = pd.read_csv(io.BytesIO(EXPORT_A), encoding='utf-16').assign(**{'Review Title': 'title'})
+        export.to_csv(path, index=False, encoding='utf-16')
+        code = ("import sys; sys.modules['streamlit'] = None; from utils import review_analyzer; "
+                f"print(len(review_analyzer.load_exports([{path!r}])))")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                env={**os.environ, 'REVIEW_ANALYZER_CACHE_DIR': self.tmpdir.name})
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '2')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from utils import review_exports
+from utils.review_exports import REVIEW_COLUMNS, ReviewStore
+from utils.review_store import load_raw_reviews, load_reviews
+
+
+def make_export(rows):
+    df = pd.DataFrame(rows, columns=['App Version Code', 'Reviewer Language', 'Device',
+                                     'Review Last Update Date and Time', 'Star Rating', 'Review Text'])
+    return df.to_csv(index=False).encode('utf-16')
+
+
+EXPORT_A = make_export([
+    ['101', 'en', 'pixel', '2024-01-05T10:00:00Z', 1, 'Crashes'],
+    [None, 'fr', 'galaxy', '2024-01-06T11:30:00Z', 5, 'Super'],
+])
+EXPORT_B = make_export([
+    ['102', 'de', 'pixel', '2024-02-01T09:00:00Z', 2, 'Langsam'],
+    ['101', 'en', 'pixel', '2024-01-05T10:00:00Z', 1, 'Crashes'],
+])
+
+
+class TestLoadReviews(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = ReviewStore(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_load_reviews_from_uploaded_files(self):
+        files = [io.BytesIO(EXPORT_A), io.BytesIO(EXPORT_B)]
+        data = make_export([['103', 'ja', 'pixel', '2024-03-01T23:59:59+09:00', 4, 'OK']])
+        export = pd.read_csv(io.BytesIO(data), encoding='utf-16').assign(**{'Review Title': 'title'})
+        files.append(io.BytesIO(export.to_csv(index=False).encode('utf-16')))
+        with patch.object(review_exports, 'get_default_store', return_value=self.store):
+            reviews = load_reviews(files)
+            raw = load_raw_reviews(files)
+        self.assertEqual(len(reviews), 4)
+        self.assertEqual(list(reviews.columns), REVIEW_COLUMNS)
+        self.assertEqual(len(raw), 4)
+        self.assertIn('Review Last Update Date and Time', raw.columns)
+        self.assertEqual(len(os.listdir(self.tmpdir.name)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+from utils import issue_store, issues, progress, review_analyzer
+from utils.benchmark import FakeBedrockChat, generate_reviews, install_scheduler
+from utils.sampling import format_estimates, sample_size, scale_issues, stratified_sample
+from tests.helpers import NoCacheTestCase
+
+
+def _record(category, count):
+    return {'version': '1.0', 'lang': None, 'category': category, 'count': count, 'description': ''}
+
+
+class TestSampleSize(unittest.TestCase):
+
+    def test_sample_size(self):
+        self.assertEqual(sample_size(100000, 0.05), 383)
+        self.assertEqual(sample_size(200, 0.05), 132)
+        self.assertEqual(sample_size(10, 0.05), 10)
+        self.assertEqual(sample_size(0, 0.05), 0)
+        # Bounded: the cost does not grow with the number of reviews
+        self.assertLessEqual(sample_size(10 ** 7, 0.05), 385)
+        self.assertGreater(sample_size(10 ** 6, 0.03), sample_size(10 ** 6, 0.05))
+
+
+class TestStratifiedSample(unittest.TestCase):
+
+    def setUp(self):
+        self.data = generate_reviews(rows=5000, languages=('en', 'fr'), versions=2)
+
+    def test_groups_are_sampled_proportionally(self):
+        sample, designs = stratified_sample(self.data, 'App Version Code', 0.05)
+        self.assertEqual(set(designs), {'100', '101'})
+        for version, design in designs.items():
+            population = self.data[self.data['App Version Code'] == version]
+            self.assertEqual(design['population'], len(population))
+            self.assertEqual(design['sample'], sample_size(len(population), 0.05))
+            rows = sample[sample['App Version Code'] == version]
+            self.assertEqual(len(rows), design['sample'])
+            # Strata keep their share of the group, up to rounding
+            for column in ('Reviewer Language', 'Star Rating'):
+                expected = population[column].value_counts() * len(rows) / len(population)
+                observed = rows[column].value_counts().reindex(expected.index, fill_value=0)
+                self.assertTrue(((observed - expected).abs() <= 0.05 * len(rows)).all())
+        self.assertTrue(sample.index.is_monotonic_increasing)
+        # Deterministic
+        self.assertTrue(sample.index.equals(stratified_sample(self.data, 'App Version Code', 0.05)[0].index))
+
+    def test_small_groups_are_kept(self):
+        small = self.data.iloc[:50]
+        sample, designs = stratified_sample(small, ['Reviewer Language', 'App Version Code'], 0.05)
+        self.assertIs(sample, small)
+        self.assertTrue(all(design['sample'] == design['population'] for design in designs.values()))
+        self.assertEqual(stratified_sample(small.iloc[:0], 'App Version Code')[1], {})
+
+
+class TestScaleIssues(unittest.TestCase):
+
+    def test_scale_issues(self):
+        design = {'population': 4000, 'sample': 400, 'margin_of_error': 0.05, 'confidence': 0.95}
+        records, intervals = scale_issues([_record('Crash', 100), _record('Ads', 300)], design)
+        self.assertEqual([record['count'] for record in records], [1000, 3000])
+        self.assertEqual([record['sample_count'] for record in records], [100, 300])
+        self.assertEqual(intervals, [[838, 1162], [2838, 3162]])
+        table = format_estimates(records, {**design, 'intervals': intervals})
+        self.assertIn('stratified sample of 400 of 4000 reviews', table)
+        self.assertIn('| Crash | 1000 | 838-1162 |', table)
+
+    def test_whole_population_is_exact(self):
+        design = {'population': 400, 'sample': 400, 'margin_of_error': 0.05, 'confidence': 0.95}
+        records, intervals = scale_issues([_record('Crash', 100)], design)
+        self.assertEqual((records[0]['count'], intervals), (100, [[100, 100]]))
+
+
+class TestSampledAnalysis(NoCacheTestCase):
+
+    def setUp(self):
+        self.data = generate_reviews(rows=3000, languages=('en', 'fr'), versions=2, duplicate_rate=0.0)
+        self.chat = FakeBedrockChat()
+        install_scheduler(self.chat)
+
+    def test_counts_are_scaled_back(self):
+        with progress.use_reporter(progress.NullReporter()):
+            result = review_analyzer.analyze_data(self.data, self.chat, token_budget=4000, margin_of_error=0.05)
+        for version, population in self.data['App Version Code'].value_counts().items():
+            r = result[version]
+            self.assertEqual(r['sampling']['population'], population)
+            self.assertLess(r['sampling']['sample'], 385)
+            # Estimates add up to the population, up to rounding
+            self.assertLessEqual(abs(issues.total_count(r['issues']) - population), len(r['issues']))
+            for record, (low, high) in zip(r['issues'], r['sampling']['intervals']):
+                self.assertLessEqual(low, record['count'])
+                self.assertLessEqual(record['count'], high)
+            self.assertIn('**Sampling**', r['report'])
+            self.assertIn("reviews (by version, language, rating and day)", r['report'])
+
+    def test_by_lang_and_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = issue_store.IssueStore(os.path.join(tmpdir, 'issues.sqlite'))
+            with progress.use_reporter(progress.NullReporter()):
+                with self.assertRaises(ValueError):
+                    review_analyzer.analyze_data_by_lang(self.data, self.chat, store=store, margin_of_error=0.05)
+                result = review_analyzer.analyze_data_by_lang(self.data, self.chat, token_budget=4000, store=store,
+                                                              incremental=False, margin_of_error=0.05)
+                calls = self.chat.stats()['calls']
+                again = review_analyzer.analyze_data_by_lang(self.data, self.chat, token_budget=4000, store=store,
+                                                             incremental=False, margin_of_error=0.05)
+        self.assertEqual(self.chat.stats()['calls'], calls)
+        self.assertEqual(again, result)
+        counts = self.data.groupby(['Reviewer Language', 'App Version Code'], observed=True).size()
+        for (lang, version), population in counts.items():
+            self.assertEqual(result[lang][version]['sampling']['population'], population)
+
+
+if __name__ == '__main__':
+    unittest.main()
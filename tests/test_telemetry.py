@@ -0,0 +1,111 @@
+import json
+import os
+import pickle
+import tempfile
+import threading
+import unittest
+from io import StringIO
+from unittest.mock import patch
+import pandas as pd
+from utils import llm_cache, review_analyzer, telemetry
+from utils.benchmark import FAKE_MODEL_ID, FakeBedrockChat, generate_reviews, install_scheduler
+from utils.telemetry import CALL_COLUMNS, RunMetrics
+from tests.helpers import NoCacheTestCase
+
+HAIKU = 'anthropic.claude-3-haiku-20240307-v1:0'
+
+
+class TestRunMetrics(unittest.TestCase):
+
+    def test_cost_from_config_prices(self):
+        metrics = RunMetrics()
+        metrics.record(model_id=HAIKU, input_tokens=1000, output_tokens=2000, latency=1.0, retries=0, cached=False)
+        metrics.record(model_id=HAIKU, input_tokens=1000, output_tokens=2000, latency=0.0, retries=0, cached=True)
+        metrics.record(model_id='unknown-model', input_tokens=10, output_tokens=10, latency=0.5, retries=0, cached=False)
+        costs = metrics.to_frame()['cost'].tolist()
+        self.assertAlmostEqual(costs[0], 0.00025 + 2 * 0.00125)
+        self.assertEqual(costs[1], 0.0)
+        self.assertTrue(pd.isna(costs[2]))
+
+    def test_summary_totals_and_exports(self):
+        metrics = RunMetrics()
+        for stage, group, latency, retries in [('analyze', 'en', 2.0, 1), ('analyze', 'ja', 1.0, 0),
+                                               ('report', 'en', 4.0, 0)]:
+            metrics.record(model_id=HAIKU, region='us-east-1', stage=stage, group=group, input_tokens=100,
+                           output_tokens=50, tokens_estimated=True, ttft=0.1, latency=latency, retries=retries,
+                           cached=False)
+
+        by_stage = metrics.summary('stage')
+        self.assertEqual(list(by_stage.index), ['report', 'analyze'])
+        self.assertEqual(by_stage.loc['analyze', 'calls'], 2)
+        self.assertEqual(by_stage.loc['analyze', 'retries'], 1)
+        self.assertEqual(by_stage.loc['analyze', 'max_latency'], 2.0)
+        self.assertEqual(metrics.summary(['stage', 'group']).loc[('analyze', 'ja'), 'input_tokens'], 100)
+
+        totals = metrics.totals()
+        self.assertEqual({k: totals[k] for k in ['calls', 'retries', 'input_tokens', 'output_tokens', 'latency']},
+                         {'calls': 3, 'retries': 1, 'input_tokens': 300, 'output_tokens': 150, 'latency': 7.0})
+
+        self.assertEqual(list(pd.read_csv(StringIO(metrics.to_csv())).columns), CALL_COLUMNS)
+        records = json.loads(metrics.to_json())
+        self.assertEqual([r['group'] for r in records], ['en', 'ja', 'en'])
+        self.assertEqual(pickle.loads(pickle.dumps(metrics)).calls, metrics.calls)
+
+    def test_labels_and_collect(self):
+        # Outside collect calls are not recorded
+        telemetry.record_call(model_id=HAIKU, latency=1.0)
+        with telemetry.collect() as metrics, telemetry.labels(stage='compare'):
+            with telemetry.labels(group='en'):
+                telemetry.record_call(model_id=HAIKU, latency=1.0)
+            labelled = telemetry.with_labels(telemetry.record_call, group='ja')
+            # Threads see the labels and metrics of the context they run in
+            thread = threading.Thread(target=telemetry.contextvars.copy_context().run,
+                                      args=(labelled,), kwargs={'model_id': HAIKU, 'latency': 2.0})
+            thread.start()
+            thread.join()
+        self.assertIsNone(telemetry.get_metrics())
+        self.assertEqual(telemetry.get_labels(), {})
+        self.assertEqual([(c['stage'], c['group']) for c in metrics.calls], [('compare', 'en'), ('compare', 'ja')])
+
+
+@patch('utils.progress.st')
+class TestAnalyzerTelemetry(NoCacheTestCase):
+
+    def setUp(self):
+        self.data = generate_reviews(rows=300, languages=('en',), versions=2, seed=2)
+
+    def test_every_call_is_recorded_with_its_stage_and_group(self, mock_st):
+        chat = FakeBedrockChat(throttle_rate=0.3, seed=5)
+        install_scheduler(chat, base_backoff=0.001, max_backoff=0.01)
+        with telemetry.collect() as metrics:
+            review_analyzer.analyze_data(self.data, chat, max_concurrency=4, token_budget=2000)
+
+        calls = metrics.to_frame()
+        self.assertEqual(len(calls), chat.stats()['calls'])
+        self.assertEqual(calls['retries'].sum(), chat.stats()['throttles'])
+        self.assertEqual(set(calls['stage']), {'analyze', 'merge', 'report'})
+        self.assertEqual(calls['group'].nunique(), 2)
+        self.assertTrue((calls['model_id'] == FAKE_MODEL_ID).all())
+        # The fake model does not report usage while streaming
+        self.assertTrue(calls['tokens_estimated'].all())
+        self.assertTrue((calls['input_tokens'] > 0).all())
+        self.assertTrue((calls['ttft'] <= calls['latency']).all())
+        self.assertFalse(calls['cached'].any())
+
+    def test_cache_hits_are_recorded_without_cost(self, mock_st):
+        chat = FakeBedrockChat()
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch.dict(os.environ, {'REVIEW_ANALYZER_CACHE_DIR': cache_dir, 'REVIEW_ANALYZER_LLM_CACHE': '1'}), \
+                patch.object(llm_cache, '_default_cache', None):
+            review_analyzer.analyze_data(self.data, chat, token_budget=2000)
+            with telemetry.collect() as metrics:
+                review_analyzer.analyze_data(self.data, chat, token_budget=2000)
+
+        calls = metrics.to_frame()
+        self.assertGreater(len(calls), 0)
+        self.assertTrue(calls['cached'].all())
+        self.assertEqual(calls['cost'].sum(), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
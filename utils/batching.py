@@ -0,0 +1,221 @@
+import math
+import pandas as pd
+
+# Calibrated characters-per-token for the Claude tokenizer, by script.
+# Latin text averages ~3.5 characters per token, CJK is roughly one token per character,
+# other non-ASCII scripts (Cyrillic, Thai, Arabic, Devanagari, ...) sit in between.
+ASCII_CHARS_PER_TOKEN = 3.5
+CJK_CHARS_PER_TOKEN = 1.0
+OTHER_CHARS_PER_TOKEN = 2.0
+
+# Han, Hiragana/Katakana, Hangul and CJK punctuation / full-width forms
+CJK_PATTERN = '[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]'
+NON_ASCII_PATTERN = r'[^\x00-\x7f]'
+
+# Context window (tokens) of the supported Bedrock models, see utils/config.yaml
+MODEL_CONTEXT_WINDOW = {
+    'anthropic.claude-3-5-sonnet-20241022-v2:0': 200000,
+    'anthropic.claude-3-5-sonnet-20240620-v1:0': 200000,
+    'anthropic.claude-3-sonnet-20240229-v1:0': 200000,
+    'anthropic.claude-3-haiku-20240307-v1:0': 200000,
+    'anthropic.claude-3-opus-20240229-v1:0': 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 200000
+
+# Tokens reserved for the prompt template around the review batch
+PROMPT_OVERHEAD_TOKENS = 1500
+
+# Upper bound of review tokens per batch, roughly the size of the former 300k character chunks.
+# Larger batches fit in the context window but make the model's per-category counts less reliable.
+DEFAULT_INPUT_TOKEN_BUDGET = 80000
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens of a string.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: Estimated token count.
+
+    Example:
+        estimate_tokens('Crashes on start')  # 5
+        estimate_tokens('启动就闪退')  # 5
+    """
+    return int(estimate_tokens_series(pd.Series([text])).iloc[0])
+
+
+def estimate_tokens_series(texts):
+    """
+    Estimates the number of tokens of every string in a Series, vectorized.
+
+    Args:
+        texts (pandas.Series): Strings to estimate.
+
+    Returns:
+        pandas.Series: Estimated token count of each string (int), same index as texts.
+    """
+    texts = texts.fillna('').astype(str)
+    total = texts.str.len()
+    cjk = texts.str.count(CJK_PATTERN)
+    other = texts.str.count(NON_ASCII_PATTERN) - cjk
+    ascii_chars = total - cjk - other
+    tokens = (ascii_chars / ASCII_CHARS_PER_TOKEN
+              + cjk / CJK_CHARS_PER_TOKEN
+              + other / OTHER_CHARS_PER_TOKEN)
+    return tokens.apply(math.ceil).astype(int)
+
+
+def input_token_budget(model_id=None, max_tokens=4096, cap=DEFAULT_INPUT_TOKEN_BUDGET):
+    """
+    Returns the number of review tokens that can be sent in one batch to a model.
+
+    Args:
+        model_id (str, optional): Bedrock model id.
+        max_tokens (int, optional): Output tokens reserved for the model's answer.
+        cap (int, optional): Upper bound of the budget.
+
+    Returns:
+        int: Input token budget per batch.
+
+    Example:
+        input_token_budget('anthropic.claude-3-haiku-20240307-v1:0', max_tokens=4096)  # 80000
+    """
+    context = MODEL_CONTEXT_WINDOW.get(model_id, DEFAULT_CONTEXT_WINDOW)
+    return max(1, min(cap, context - int(max_tokens) - PROMPT_OVERHEAD_TOKENS))
+
+
+def pack_rows(token_counts, budget):
+    """
+    Greedily packs rows into batches that fill a token budget, never splitting a row.
+
+    A row larger than the budget is put alone in its own batch.
+
+    Args:
+        token_counts (list): Estimated token count of each row, in order.
+        budget (int): Maximum tokens per batch.
+
+    Returns:
+        list: A list of (start, end) row index ranges, one per batch.
+
+    Example:
+        pack_rows([40, 40, 40, 200, 10], budget=100)
+        # [(0, 2), (2, 3), (3, 4), (4, 5)]
+    """
+    batches = []
+    start, used = 0, 0
+    for i, tokens in enumerate(token_counts):
+        if i > start and used + tokens > budget:
+            batches.append((start, i))
+            start, used = i, 0
+        used += tokens
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+def _clean_cells(df):
+    """Returns the DataFrame as strings, one line per row: no NaN, no embedded tabs or newlines."""
+    cells = {}
+    for column in df.columns:
+        # Missing values become '' before the cells are strings (astype(str) would make them 'nan' and 'None')
+        cells[column] = (df[column].astype('string').fillna('')
+                         .str.replace(r'[\t\r\n]+', ' ', regex=True)
+                         .str.strip())
+    return cells
+
+
+def _encode_table(df):
+    # Legacy fixed-width table, every column padded to its longest value
+    lines = df.to_string(index=False).split('\n')
+    return lines[0], lines[1:]
+
+
+def _encode_tsv(df):
+    cells = _clean_cells(df)
+    columns = list(cells.values())
+    rows = columns[0].str.cat(columns[1:], sep='\t') if len(columns) > 1 else columns[0]
+    return '\t'.join(map(str, df.columns)), rows.tolist()
+
+
+def _encode_csv(df):
+    cells = pd.DataFrame(_clean_cells(df))
+    lines = cells.to_csv(index=False, lineterminator='\n').rstrip('\n').split('\n')
+    return lines[0], lines[1:]
+
+
+# Row encoders: name -> function(df) returning (header line, list of row lines).
+# Every row must be encoded on a single line so batches never split a review.
+ROW_ENCODERS = {
+    'table': _encode_table,
+    'tsv': _encode_tsv,
+    'csv': _encode_csv,
+}
+DEFAULT_ROW_ENCODER = 'tsv'
+
+
+def encode_rows(df, encoder=DEFAULT_ROW_ENCODER):
+    """
+    Serializes a DataFrame to a header line and one line per row.
+
+    Args:
+        df (pandas.DataFrame): Review data.
+        encoder (str, optional): Name of a registered encoder in ROW_ENCODERS.
+            'tsv' (default) and 'csv' are compact, 'table' is the padded DataFrame.to_string layout.
+
+    Returns:
+        tuple: (header, rows) where header is a str and rows is a list of str.
+
+    Example:
+        encode_rows(pd.DataFrame({'A': [1, 2], 'B': ['a', 'b c']}))
+        # ('A\tB', ['1\ta', '2\tb c'])
+    """
+    if encoder not in ROW_ENCODERS:
+        raise ValueError(f"Unknown row encoder: {encoder}, expected one of {list(ROW_ENCODERS)}")
+    return ROW_ENCODERS[encoder](df)
+
+
+def measure_encoding(df, encoder=DEFAULT_ROW_ENCODER, baseline='table', token_budget=DEFAULT_INPUT_TOKEN_BUDGET):
+    """
+    Measures characters and tokens saved per batch by an encoder compared to a baseline encoder.
+
+    Batches are packed with the encoder under test; the baseline is measured over the same rows,
+    with its header repeated per batch as well. Token counts are estimates, see estimate_tokens_series.
+
+    Args:
+        df (pandas.DataFrame): Review data.
+        encoder (str, optional): Encoder under test.
+        baseline (str, optional): Encoder to compare against, the legacy 'table' layout by default.
+        token_budget (int, optional): Maximum input tokens per batch.
+
+    Returns:
+        pandas.DataFrame: One row per batch with columns rows, chars, tokens, baseline_chars,
+            baseline_tokens, chars_saved_pct and tokens_saved_pct.
+    """
+    columns = ['rows', 'chars', 'tokens', 'baseline_chars', 'baseline_tokens', 'chars_saved_pct', 'tokens_saved_pct']
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    header, rows = encode_rows(df, encoder)
+    base_header, base_rows = encode_rows(df, baseline)
+    tokens = estimate_tokens_series(pd.Series(rows)).tolist()
+    base_tokens = estimate_tokens_series(pd.Series(base_rows)).tolist()
+    header_tokens, base_header_tokens = estimate_tokens(header), estimate_tokens(base_header)
+
+    stats = []
+    for start, end in pack_rows(tokens, token_budget - header_tokens):
+        chars = len(header) + sum(len(row) + 1 for row in rows[start:end])
+        base_chars = len(base_header) + sum(len(row) + 1 for row in base_rows[start:end])
+        batch_tokens = header_tokens + sum(tokens[start:end])
+        batch_base_tokens = base_header_tokens + sum(base_tokens[start:end])
+        stats.append({
+            'rows': end - start,
+            'chars': chars,
+            'tokens': batch_tokens,
+            'baseline_chars': base_chars,
+            'baseline_tokens': batch_base_tokens,
+            'chars_saved_pct': round(100 * (1 - chars / base_chars), 2),
+            'tokens_saved_pct': round(100 * (1 - batch_tokens / batch_base_tokens), 2),
+        })
+    return pd.DataFrame(stats, columns=columns)
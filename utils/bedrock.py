@@ -1,8 +1,15 @@
+import math
 import os
+import random
+import threading
+import time
 import yaml
-from typing import Optional, Dict, Any, Generator
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, Generator, Callable, Tuple
 import boto3
 from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+from utils.batching import estimate_tokens
 
 config_yaml_path = os.path.join(os.path.dirname(__file__), 'config.yaml')
 with open(config_yaml_path, 'r') as f:
@@ -26,45 +33,347 @@ def list_bedrock_model_regions():
     """
     return config_data['model_region']
 
+def get_rate_limits(model_id: Optional[str] = None, region: Optional[str] = None) -> Dict[str, int]:
+    """
+    Retrieve the requests-per-minute and tokens-per-minute quotas of a model from config.yaml
 
-def get_bedrock_client(
-    assumed_role: Optional[str] = None,
-    region: Optional[str] = None,
-    runtime: bool = True
-) -> boto3.Session.client:
-    """Create a boto3 client for Amazon Bedrock."""
-    target_region = region or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
-    
+    Per-model entries override the defaults, per-region entries override the per-model ones.
+
+    Returns:
+        dict: {'requests_per_minute': int, 'tokens_per_minute': int}
+    """
+    rate_limits = config_data.get('rate_limits', {})
+    limits = dict(rate_limits.get('default', {}))
+    model_limits = rate_limits.get('models', {}).get(model_id, {})
+    limits.update({k: v for k, v in model_limits.items() if k != 'regions'})
+    limits.update(model_limits.get('regions', {}).get(region, {}))
+    return limits
+
+
+def get_model_pricing(model_id: Optional[str] = None) -> Dict[str, float]:
+    """
+    Retrieve the on-demand prices of a model from config.yaml
+
+    Returns:
+        dict: {'input': USD per 1000 input tokens, 'output': USD per 1000 output tokens}, empty if unknown
+    """
+    return dict(config_data.get('pricing', {}).get(model_id, {}))
+
+
+# Connections per client: enough for the scheduler's maximum concurrency (botocore's default is 10)
+MAX_POOL_CONNECTIONS = 32
+# Attempts of botocore per call of a runtime client: the calls go through a RateLimitScheduler, which retries
+# throttles, transient errors and connection errors itself and must see every throttle to adapt its concurrency.
+# Control plane clients keep botocore's retries.
+RUNTIME_MAX_ATTEMPTS = 1
+CONTROL_MAX_ATTEMPTS = 10
+# Assumed-role credentials are refreshed this long before they expire
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+
+_clients: Dict[Tuple, Tuple[Any, Optional[datetime]]] = {}
+_credentials: Dict[Tuple, Dict[str, Any]] = {}
+_clients_lock = threading.Lock()
+
+
+def _session(target_region: Optional[str]) -> boto3.Session:
     session_kwargs: Dict[str, Any] = {"region_name": target_region}
     if profile_name := os.environ.get("AWS_PROFILE"):
         session_kwargs["profile_name"] = profile_name
+    return boto3.Session(**session_kwargs)
+
+
+def _expired(expiration: Optional[datetime]) -> bool:
+    return expiration is not None and expiration - CREDENTIALS_REFRESH_MARGIN <= datetime.now(timezone.utc)
 
-    session = boto3.Session(**session_kwargs)
 
-    if assumed_role:
-        sts = session.client("sts")
+def _assume_role_credentials(assumed_role: str, target_region: Optional[str]) -> Dict[str, Any]:
+    """Returns STS credentials of a role, cached until shortly before they expire."""
+    key = (assumed_role, os.environ.get("AWS_PROFILE"))
+    credentials = _credentials.get(key)
+    if credentials is None or _expired(credentials["Expiration"]):
+        sts = _session(target_region).client("sts")
         credentials = sts.assume_role(
             RoleArn=str(assumed_role),
             RoleSessionName="langchain-llm-1"
         )["Credentials"]
-        client_kwargs = {
-            "aws_access_key_id": credentials["AccessKeyId"],
-            "aws_secret_access_key": credentials["SecretAccessKey"],
-            "aws_session_token": credentials["SessionToken"],
-        }
-    else:
-        client_kwargs = {}
-
-    config = Config(
-        region_name=target_region,
-        retries={"max_attempts": 10, "mode": "standard"},
-    )
+        _credentials[key] = credentials
+    return credentials
+
+
+def get_bedrock_client(
+    assumed_role: Optional[str] = None,
+    region: Optional[str] = None,
+    runtime: bool = True,
+    max_pool_connections: int = MAX_POOL_CONNECTIONS
+) -> boto3.Session.client:
+    """
+    Return a pooled boto3 client for Amazon Bedrock.
 
+    Clients are created once per (region, assumed role, service, profile) and reused by every rerun and
+    session of the process; clients of an assumed role are recreated when its credentials expire.
+    Runtime clients do not retry (see RUNTIME_MAX_ATTEMPTS): throttles are retried by the RateLimitScheduler.
+    """
+    target_region = region or os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
     service_name = 'bedrock-runtime' if runtime else 'bedrock'
-    return session.client(service_name=service_name, config=config, **client_kwargs)
+    key = (target_region, assumed_role, service_name, os.environ.get("AWS_PROFILE"), max_pool_connections)
+
+    with _clients_lock:
+        if key in _clients and not _expired(_clients[key][1]):
+            return _clients[key][0]
+
+        if assumed_role:
+            credentials = _assume_role_credentials(assumed_role, target_region)
+            client_kwargs = {
+                "aws_access_key_id": credentials["AccessKeyId"],
+                "aws_secret_access_key": credentials["SecretAccessKey"],
+                "aws_session_token": credentials["SessionToken"],
+            }
+            expiration = credentials["Expiration"]
+        else:
+            client_kwargs = {}
+            expiration = None
+
+        config = Config(
+            region_name=target_region,
+            retries={"max_attempts": RUNTIME_MAX_ATTEMPTS if runtime else CONTROL_MAX_ATTEMPTS, "mode": "standard"},
+            max_pool_connections=max_pool_connections,
+        )
+
+        client = _session(target_region).client(service_name=service_name, config=config, **client_kwargs)
+        _clients[key] = (client, expiration)
+        return client
+
+#region rate limiting
+# Error codes of throttled Bedrock calls; they shrink the concurrency of the scheduler
+THROTTLE_ERROR_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException'}
+# Transient errors that are retried without changing the concurrency
+TRANSIENT_ERROR_CODES = {'ServiceUnavailableException', 'InternalServerException', 'ModelNotReadyException'}
+# Connection errors and timeouts of the HTTP client (EndpointConnectionError, ReadTimeoutError,
+# ConnectionClosedError, ...), retried like transient errors since runtime clients do not retry them
+CONNECTION_ERRORS = (BotocoreConnectionError, HTTPClientError)
+
+
+def _error_code(exc: BaseException) -> Optional[str]:
+    # langchain re-raises botocore errors as ValueError(f"Error raised by bedrock service: {e}"),
+    # so look at the exception chain first, then at the message
+    while exc is not None:
+        if isinstance(exc, ClientError):
+            return exc.response.get('Error', {}).get('Code')
+        for code in THROTTLE_ERROR_CODES | TRANSIENT_ERROR_CODES:
+            if code in str(exc):
+                return code
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
+def is_connection_error(exc: BaseException) -> bool:
+    """Whether an exception raised by a Bedrock call (boto3 or langchain) is a connection error or timeout."""
+    while exc is not None:
+        if isinstance(exc, CONNECTION_ERRORS):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """Whether an exception raised by a Bedrock call (boto3 or langchain) is a throttle."""
+    return _error_code(exc) in THROTTLE_ERROR_CODES
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most capacity tokens.
+
+    Not thread-safe on its own, RateLimitScheduler serializes access.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount tokens are available (0 if they are). Requests above capacity wait for a full bucket."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def take(self, amount: float) -> None:
+        """Removes amount tokens, the balance may go negative (debt is repaid by the refill)."""
+        self._refill()
+        self.tokens -= amount
+
+    def give(self, amount: float) -> None:
+        """Returns tokens that were reserved but not used."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimitScheduler:
+    """
+    Admits Bedrock calls within requests-per-minute and tokens-per-minute budgets, with adaptive concurrency.
+
+    Every call takes one request token and its estimated tokens (input + reserved output) from two token
+    buckets, and a concurrency slot. The concurrency limit grows additively on success (about +1 per
+    limit successful calls) and is halved on every throttle (AIMD), so calls run close to the quota
+    without piling up retries. Throttled and transient errors are retried with jittered exponential backoff.
+
+    Example:
+        scheduler = get_scheduler('us-west-2', 'anthropic.claude-3-haiku-20240307-v1:0')
+        response = scheduler.call(client.converse, modelId=model_id, messages=messages, estimated_tokens=5000)
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, initial_concurrency: int = 4,
+                 max_concurrency: int = 32, min_concurrency: int = 1, decrease_factor: float = 0.5,
+                 max_retries: int = 8, base_backoff: float = 1.0, max_backoff: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.requests = TokenBucket(requests_per_minute, clock=clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock)
+        self.limit = float(initial_concurrency)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.in_flight = 0
+        self.stats = {'calls': 0, 'throttles': 0, 'retries': 0}
+        self._sleep = sleep
+        self._cond = threading.Condition()
+
+    def acquire(self, estimated_tokens: int = 0) -> None:
+        """Blocks until a concurrency slot and the budgets of one request of estimated_tokens are available."""
+        with self._cond:
+            while True:
+                if self.in_flight < max(self.min_concurrency, int(self.limit)):
+                    wait = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                    if wait == 0:
+                        self.requests.take(1)
+                        self.tokens.take(estimated_tokens)
+                        self.in_flight += 1
+                        return
+                else:
+                    wait = None
+                if wait is not None and wait > 0:
+                    # Budgets refill with time, not with releases: sleep outside the lock
+                    self._cond.release()
+                    try:
+                        self._sleep(min(wait, self.max_backoff))
+                    finally:
+                        self._cond.acquire()
+                else:
+                    self._cond.wait()
+
+    def release(self, throttled: bool = False, estimated_tokens: int = 0, used_tokens: Optional[int] = None,
+                failed: bool = False) -> None:
+        """
+        Frees the slot of a finished call and adapts the concurrency limit.
+
+        Args:
+            throttled: The call was throttled; the limit is multiplied by decrease_factor.
+            failed: The call failed otherwise; the limit is left as is.
+            estimated_tokens: Tokens reserved by acquire.
+            used_tokens: Tokens actually used, unused reserved tokens are returned to the budget.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+            elif not failed:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / max(self.limit, 1.0))
+                if used_tokens is not None and used_tokens < estimated_tokens:
+                    self.tokens.give(estimated_tokens - used_tokens)
+            self._cond.notify_all()
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff of a retry, in seconds."""
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def call(self, fn: Callable[..., Any], *args: Any, estimated_tokens: int = 0,
+             count_tokens: Optional[Callable[[Any], int]] = None, max_retries: Optional[int] = None,
+             **kwargs: Any) -> Any:
+        """
+        Runs fn(*args, **kwargs) within the budgets, retrying throttled, transient and connection errors.
+
+        Args:
+            fn: The Bedrock call.
+            estimated_tokens: Input tokens plus reserved output tokens of the call.
+            count_tokens: Returns the tokens actually used from the result of fn, to refund the rest.
+            max_retries: Overrides the scheduler's max_retries for this call.
+
+        Returns:
+            The result of fn.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            self.acquire(estimated_tokens)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                code = _error_code(e)
+                throttled = code in THROTTLE_ERROR_CODES
+                self.release(throttled=throttled, estimated_tokens=estimated_tokens, failed=not throttled)
+                with self._cond:
+                    self.stats['throttles'] += throttled
+                retried = code in THROTTLE_ERROR_CODES | TRANSIENT_ERROR_CODES or is_connection_error(e)
+                if not retried or attempt == max_retries:
+                    raise
+                with self._cond:
+                    self.stats['retries'] += 1
+                self._sleep(self.backoff(attempt))
+                continue
+            used = count_tokens(result) if count_tokens is not None else None
+            self.release(estimated_tokens=estimated_tokens, used_tokens=used)
+            with self._cond:
+                self.stats['calls'] += 1
+            return result
+
+
+_schedulers: Dict[Tuple[Optional[str], Optional[str]], RateLimitScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(region: Optional[str], model_id: Optional[str]) -> RateLimitScheduler:
+    """Returns the process-wide scheduler of a (region, model_id) pair, with the quotas of config.yaml."""
+    with _schedulers_lock:
+        key = (region, model_id)
+        if key not in _schedulers:
+            limits = get_rate_limits(model_id, region)
+            _schedulers[key] = RateLimitScheduler(limits['requests_per_minute'], limits['tokens_per_minute'])
+        return _schedulers[key]
+#endregion
 
 # https://docs.anthropic.com/en/docs/about-claude/models#model-comparison
 
+def _converse_request(model_id, system_prompt, prompt, max_tokens, temperature, top_p):
+    request = {
+        'modelId': model_id,
+        'messages': [{"role": "user", "content": [{"text": prompt}]}],
+        'inferenceConfig': {"temperature": temperature, "maxTokens": max_tokens, "topP": top_p},
+    }
+    if system_prompt:
+        request['system'] = [{"text": system_prompt}]
+    return request
+
+
+def _scheduled_call(client, operation, request, text, count_tokens=None):
+    # Runtime clients do not retry (see RUNTIME_MAX_ATTEMPTS): the call goes through the scheduler of its region
+    # and model, which retries throttles, transient and connection errors
+    scheduler = get_scheduler(client.meta.region_name, request['modelId'])
+    return scheduler.call(operation, estimated_tokens=estimate_tokens(text) + request['inferenceConfig']['maxTokens'],
+                          count_tokens=count_tokens, **request)
+
+
 def invoke_bedrock_model(
     client: boto3.Session.client,
     model_id: str,
@@ -77,29 +386,11 @@ def invoke_bedrock_model(
 ) -> str:
     """Invoke a Bedrock model."""
     try:
-        response = None
-        if system_prompt:
-            response = client.converse(
-                modelId=model_id,
-                # system = [system_prompt],
-                system = [{"text": system_prompt}],
-                messages=[{"role": "user", "content": [{"text": prompt}]}],
-                inferenceConfig={
-                    "temperature": temperature,
-                    "maxTokens": max_tokens,
-                    "topP": top_p
-                }
-            )
-        else:
-            response = client.converse(
-                modelId=model_id,
-                messages=[{"role": "user", "content": [{"text": prompt}]}],
-                inferenceConfig={
-                    "temperature": temperature,
-                    "maxTokens": max_tokens,
-                    "topP": top_p
-                }
-            )
+        request = _converse_request(model_id, system_prompt, prompt, max_tokens, temperature, top_p)
+        response = _scheduled_call(
+            client, client.converse, request, system_prompt + prompt,
+            count_tokens=lambda response: response['usage']['inputTokens'] + response['usage']['outputTokens'],
+        )
         result = response['output']['message']['content'][0]['text']
         
         if show_details:
@@ -125,30 +416,8 @@ def invoke_bedrock_model_stream(
 ) -> Generator[str, None, None]:
     """Invoke a Bedrock model with streaming response."""
     try:
-        response = None
-        if system_prompt:
-            response = client.converse_stream(
-                modelId=model_id,
-                system = [{"text": system_prompt}],
-                messages=[{"role": "user", "content": [{"text": prompt}]}],
-                inferenceConfig={
-                    "temperature": temperature,
-                    "maxTokens": max_tokens,
-                    "topP": top_p
-                }
-            )
-        else:
-            response = client.converse_stream(
-                modelId=model_id,
-                messages=[{"role": "user", "content": [{"text": prompt}]}],
-                inferenceConfig={
-                    "temperature": temperature,
-                    "maxTokens": max_tokens,
-                    "topP": top_p
-                }
-            )
-            
-        
+        request = _converse_request(model_id, system_prompt, prompt, max_tokens, temperature, top_p)
+        response = _scheduled_call(client, client.converse_stream, request, system_prompt + prompt)
         for event in response['stream']:
             if 'contentBlockDelta' in event:
                 yield event['contentBlockDelta']['delta']['text']
@@ -1,10 +1,220 @@
+import threading
+import time
 from langchain_community.chat_models import BedrockChat
+from utils.bedrock import get_bedrock_client, get_scheduler, is_throttle_error, list_bedrock_model_regions
+
+# A region whose calls are still throttled after its retries is skipped for this long (doubling while it persists)
+REGION_COOLDOWN_SECONDS = 30
+MAX_REGION_COOLDOWN_SECONDS = 300
+# Retries of a throttled call within one region before failing over to another region
+REGION_MAX_RETRIES = 2
+
+DEFAULT_MODEL_KWARGS = {
+    "max_tokens": 4096,
+    "temperature": 0.0
+}
+
+_chats = {}
+_multi_region_chats = {}
+_chats_lock = threading.Lock()
 
 def init_bedrock_chat(model_id='anthropic.claude-3-sonnet-20240229-v1:0', region_name='us-west-2'):
 
-    model_kwargs =  { 
-        "max_tokens": 4096,
-        "temperature": 0.0
-    }
+    model_kwargs = dict(DEFAULT_MODEL_KWARGS)
     bedrock_chat = BedrockChat(model_id=model_id, model_kwargs=model_kwargs, region_name=region_name)
-    return bedrock_chat
\ No newline at end of file
+    return bedrock_chat
+
+
+def get_bedrock_chat(model_id='anthropic.claude-3-sonnet-20240229-v1:0', region_name='us-west-2', model_kwargs=None,
+                     assumed_role=None):
+    """
+    Returns a pooled BedrockChat, created once per (region, model_id, assumed_role, model_kwargs).
+
+    The chat uses the pooled boto3 client of its region (see bedrock.get_bedrock_client), so reruns and
+    analysis buttons reuse its session, credentials and connections. It is rebuilt when the client is,
+    i.e. when assumed-role credentials expire.
+
+    Args:
+        model_id (str, optional): Bedrock model id.
+        region_name (str, optional): AWS region.
+        model_kwargs (dict, optional): Model parameters, DEFAULT_MODEL_KWARGS by default.
+        assumed_role (str, optional): ARN of a role to assume.
+
+    Returns:
+        BedrockChat: The shared chat model.
+    """
+    model_kwargs = dict(DEFAULT_MODEL_KWARGS if model_kwargs is None else model_kwargs)
+    key = (region_name, model_id, assumed_role, tuple(sorted(model_kwargs.items())))
+    client = get_bedrock_client(assumed_role=assumed_role, region=region_name)
+    with _chats_lock:
+        chat = _chats.get(key)
+        if chat is None or chat.client is not client:
+            chat = BedrockChat(client=client, model_id=model_id, model_kwargs=model_kwargs, region_name=region_name)
+            _chats[key] = chat
+        return chat
+
+
+class MultiRegionBedrockChat:
+    """
+    Spreads the calls of one model across several regions, one BedrockChat per region.
+
+    Each call goes to the healthy region with the most free capacity, i.e. the lowest in-flight calls
+    relative to the adaptive concurrency limit of the region's rate-limit scheduler. A region that keeps
+    throttling after REGION_MAX_RETRIES retries is put in cooldown and the call fails over to another
+    region, so a run continues when one region throttles hard. Per-region health and throughput are
+    available from stats().
+
+    Example:
+        bedrock_chat = init_multi_region_bedrock_chat('anthropic.claude-3-haiku-20240307-v1:0')
+        review_analyzer.analyze_data(df, bedrock_chat)
+    """
+
+    def __init__(self, chats, clock=time.monotonic):
+        if not chats:
+            raise ValueError("MultiRegionBedrockChat needs at least one region")
+        self.chats = dict(chats)
+        first = next(iter(self.chats.values()))
+        # Same model and parameters in every region, see review_analyzer._model_params
+        self.model_id = first.model_id
+        self.model_kwargs = first.model_kwargs
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats = {
+            region: {'in_flight': 0, 'calls': 0, 'throttles': 0, 'errors': 0, 'tokens': 0,
+                     'latency': 0.0, 'cooldown_until': 0.0, 'cooldown': 0, 'first_call': None}
+            for region in self.chats
+        }
+
+    def _capacity(self, region):
+        stats = self._stats[region]
+        return stats['in_flight'] / max(1.0, get_scheduler(region, self.model_id).limit)
+
+    def _acquire(self, exclude):
+        with self._lock:
+            now = self._clock()
+            candidates = [region for region in self.chats if region not in exclude] or list(self.chats)
+            healthy = [region for region in candidates if self._stats[region]['cooldown_until'] <= now]
+            if healthy:
+                region = min(healthy, key=lambda r: (self._capacity(r), self._stats[r]['throttles']))
+            else:
+                region = min(candidates, key=lambda r: self._stats[r]['cooldown_until'])
+            stats = self._stats[region]
+            stats['in_flight'] += 1
+            if stats['first_call'] is None:
+                stats['first_call'] = now
+            return region
+
+    def _release(self, region, started, tokens=0, throttled=False, failed=False):
+        with self._lock:
+            stats = self._stats[region]
+            stats['in_flight'] -= 1
+            if throttled:
+                stats['throttles'] += 1
+                stats['cooldown'] = min(MAX_REGION_COOLDOWN_SECONDS, (stats['cooldown'] * 2) or REGION_COOLDOWN_SECONDS)
+                stats['cooldown_until'] = self._clock() + stats['cooldown']
+            elif failed:
+                stats['errors'] += 1
+            else:
+                stats['calls'] += 1
+                stats['tokens'] += tokens
+                stats['cooldown'] = 0
+                # Exponentially weighted moving average of the call latency
+                latency = self._clock() - started
+                stats['latency'] = latency if stats['calls'] == 1 else 0.8 * stats['latency'] + 0.2 * latency
+
+    def call(self, fn, estimated_tokens=0, count_tokens=None):
+        """
+        Runs fn(chat) with the BedrockChat of the best region, failing over to other regions on hard throttling.
+
+        Args:
+            fn (function): Takes a BedrockChat and runs the model call.
+            estimated_tokens (int, optional): Input tokens plus reserved output tokens of the call.
+            count_tokens (function, optional): Returns the tokens actually used from the result of fn.
+
+        Returns:
+            The result of fn.
+        """
+        tried = set()
+        while True:
+            region = self._acquire(tried)
+            started = self._clock()
+            try:
+                result = get_scheduler(region, self.model_id).call(
+                    fn, self.chats[region], estimated_tokens=estimated_tokens, count_tokens=count_tokens,
+                    # The last region left keeps the scheduler's full retries
+                    max_retries=REGION_MAX_RETRIES if len(tried) < len(self.chats) - 1 else None,
+                )
+            except Exception as e:
+                throttled = is_throttle_error(e)
+                self._release(region, started, throttled=throttled, failed=not throttled)
+                tried.add(region)
+                if not throttled or len(tried) == len(self.chats):
+                    raise
+                continue
+            tokens = count_tokens(result) if count_tokens is not None else estimated_tokens
+            self._release(region, started, tokens=tokens)
+            return result
+
+    def stats(self):
+        """
+        Returns the health and throughput of every region.
+
+        Returns:
+            dict: Region -> {'healthy', 'in_flight', 'calls', 'throttles', 'errors', 'tokens',
+                'tokens_per_minute', 'latency', 'concurrency_limit'}.
+        """
+        with self._lock:
+            now = self._clock()
+            result = {}
+            for region, stats in self._stats.items():
+                elapsed = now - stats['first_call'] if stats['first_call'] is not None else 0
+                result[region] = {
+                    'healthy': stats['cooldown_until'] <= now,
+                    'in_flight': stats['in_flight'],
+                    'calls': stats['calls'],
+                    'throttles': stats['throttles'],
+                    'errors': stats['errors'],
+                    'tokens': stats['tokens'],
+                    'tokens_per_minute': round(60 * stats['tokens'] / elapsed) if elapsed > 0 else 0,
+                    'latency': round(stats['latency'], 3),
+                    'concurrency_limit': get_scheduler(region, self.model_id).limit,
+                }
+            return result
+
+
+def init_multi_region_bedrock_chat(model_id='anthropic.claude-3-sonnet-20240229-v1:0', regions=None):
+    """
+    Creates a MultiRegionBedrockChat with one new BedrockChat per region, see get_multi_region_bedrock_chat.
+
+    Args:
+        model_id (str, optional): Bedrock model id.
+        regions (list, optional): Regions to use, all regions of config.yaml by default.
+
+    Returns:
+        MultiRegionBedrockChat: The multi-region chat.
+    """
+    regions = regions or list_bedrock_model_regions()
+    return MultiRegionBedrockChat({region: init_bedrock_chat(model_id=model_id, region_name=region) for region in regions})
+
+
+def get_multi_region_bedrock_chat(model_id='anthropic.claude-3-sonnet-20240229-v1:0', regions=None, model_kwargs=None,
+                                  assumed_role=None):
+    """
+    Returns a pooled MultiRegionBedrockChat built from the pooled chats of every region (see get_bedrock_chat).
+
+    The same instance is returned for the same parameters, so region health and throughput accumulate across runs.
+
+    Returns:
+        MultiRegionBedrockChat: The shared multi-region chat.
+    """
+    regions = tuple(regions or list_bedrock_model_regions())
+    chats = {region: get_bedrock_chat(model_id, region, model_kwargs, assumed_role) for region in regions}
+    key = (regions, model_id, assumed_role, tuple(sorted(next(iter(chats.values())).model_kwargs.items())))
+    with _chats_lock:
+        multi_region_chat = _multi_region_chats.get(key)
+        if multi_region_chat is None:
+            multi_region_chat = _multi_region_chats[key] = MultiRegionBedrockChat(chats)
+        else:
+            # Pick up chats rebuilt with refreshed credentials
+            multi_region_chat.chats.update(chats)
+        return multi_region_chat
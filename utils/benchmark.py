@@ -0,0 +1,333 @@
+import argparse
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+import tracemalloc
+from typing import Any, Iterator, Optional
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from utils import bedrock, issues, progress, review_analyzer
+from utils.batching import estimate_tokens
+
+# Analysis modes benchmarked by default, see run_benchmark
+MODES = {
+    'analyze_data': review_analyzer.analyze_data,
+    'analyze_data_by_lang': review_analyzer.analyze_data_by_lang,
+    'analyze_data_without_version': review_analyzer.analyze_data_without_version,
+    'analyze_data_without_version_by_lang': review_analyzer.analyze_data_without_version_by_lang,
+    'analyze_data_by_lang_without_version': review_analyzer.analyze_data_by_lang_without_version,
+    'analyze_data_clusters': functools.partial(review_analyzer.analyze_data, cluster=True),
+    'analyze_data_sampled': functools.partial(review_analyzer.analyze_data, margin_of_error=0.05),
+}
+
+FAKE_MODEL_ID = 'fake.review-analyzer-benchmark'
+FAKE_REGION = 'fake-region'
+
+# Words of the synthetic reviews per language; CJK languages use characters, so token estimates differ
+VOCABULARY = {
+    'en': 'game crash login slow update lag ads bug freeze battery server error great fun level boss'.split(),
+    'fr': 'jeu plantage connexion lent mise jour pub bug gel batterie serveur erreur super niveau'.split(),
+    'de': 'Spiel Absturz Anmeldung langsam Update Werbung Fehler Akku Server super Level schwer'.split(),
+    'ja': list('ゲームが落ちるログインできない重い広告多いバグ電池サーバー楽しい'),
+    'zh': list('游戏闪退登录失败卡顿广告太多错误耗电服务器好玩关卡'),
+}
+# Issue categories of the fake model's answers, with a near-duplicate pair to exercise model merges
+CATEGORIES = ['Crash on startup', 'Crashes on startup', 'Login failure', 'Too many ads', 'Lag and freezes',
+              'Battery drain', 'Server errors', 'Difficulty too high']
+
+
+def generate_reviews(rows=1000, languages=('en', 'fr', 'ja'), versions=3, text_length=(60, 0.8),
+                     duplicate_rate=0.05, seed=0):
+    """
+    Generates synthetic review data with the columns of review_exports.REVIEW_COLUMNS.
+
+    Args:
+        rows (int, optional): Number of reviews.
+        languages (tuple, optional): Reviewer languages, keys of VOCABULARY.
+        versions (int, optional): Number of app versions.
+        text_length (tuple, optional): (median, sigma) of the log-normal distribution of review lengths, in words.
+        duplicate_rate (float, optional): Fraction of reviews copying the text of an earlier review.
+        seed (int, optional): Random seed, the same arguments always generate the same data.
+
+    Returns:
+        pandas.DataFrame: The reviews.
+    """
+    rng = np.random.default_rng(seed)
+    median, sigma = text_length
+    lengths = np.maximum(1, rng.lognormal(np.log(median), sigma, rows).astype(int))
+    langs = rng.choice(list(languages), rows)
+    texts = []
+    for i in range(rows):
+        if texts and rng.random() < duplicate_rate:
+            texts.append(texts[rng.integers(len(texts))])
+            continue
+        words = rng.choice(VOCABULARY[langs[i]], lengths[i])
+        separator = '' if langs[i] in ('ja', 'zh') else ' '
+        texts.append(separator.join(words))
+    return pd.DataFrame({
+        'App Version Code': pd.Categorical(rng.integers(100, 100 + versions, rows).astype(str)),
+        'Reviewer Language': pd.Categorical(langs),
+        'Device': pd.Categorical(rng.choice(['pixel7', 'galaxyS23', 'redmi12'], rows)),
+        'Review Date': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 90, rows), unit='D'),
+        'Star Rating': rng.integers(1, 3, rows),
+        'Review Title': '',
+        'Review Text': texts,
+    })
+
+
+def _tag_content(text, tag):
+    # The prompts mention their tags in the instructions too ("in <content></content> tag"), the data is the longest
+    return max(re.findall(rf'<{tag}>(.*?)</{tag}>', text, re.S), key=len, default='')
+
+
+class FakeBedrockChat(BaseChatModel):
+    """
+    Deterministic stand-in for BedrockChat: answers the analyzer's prompts with well-formed issue XML.
+
+    It has the model_id, model_kwargs and region_name of a BedrockChat, so calls go through the LLM
+    response cache and the rate-limit scheduler like real ones (see install_scheduler). Each call waits
+    latency seconds before its first chunk, then streams its answer at tokens_per_second. Calls above
+    max_in_flight concurrent calls, and a throttle_rate fraction of calls, raise a ThrottlingException. A
+    drop_rate fraction of the other calls raise a ServiceUnavailableException after their first chunk.
+
+    Example:
+        chat = FakeBedrockChat(latency=0.2, tokens_per_second=500, max_in_flight=8)
+        review_analyzer.analyze_data(df, chat)
+        chat.stats()  # {'calls': 12, 'throttles': 0, 'input_tokens': ..., 'output_tokens': ...}
+    """
+
+    model_id: str = FAKE_MODEL_ID
+    region_name: str = FAKE_REGION
+    model_kwargs: dict = {'max_tokens': 4096, 'temperature': 0.0}
+    latency: float = 0.0
+    tokens_per_second: Optional[float] = None
+    max_in_flight: Optional[int] = None
+    throttle_rate: float = 0.0
+    drop_rate: float = 0.0
+    seed: int = 0
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _random: Any = PrivateAttr(default=None)
+    _stats: dict = PrivateAttr(default_factory=lambda: {'calls': 0, 'throttles': 0, 'drops': 0, 'input_tokens': 0,
+                                                        'output_tokens': 0, 'in_flight': 0})
+
+    @property
+    def _llm_type(self):
+        return 'fake-bedrock'
+
+    def stats(self):
+        """Returns the number of calls, throttles and drops, and the estimated input/output tokens of all calls."""
+        with self._lock:
+            return {name: value for name, value in self._stats.items() if name != 'in_flight'}
+
+    def _answer(self, prompt):
+        if 'name the one issue' in prompt:
+            return self._name(_tag_content(prompt, 'review').strip())
+        if 'identify and categorize' in prompt:
+            return self._analyze(_tag_content(prompt, 'review').strip())
+        if '<diff>' in prompt:
+            rows = [line for line in _tag_content(prompt, 'diff').strip().split('\n') if line.startswith('| ') and '---' not in line]
+            return f"**Summary**\n\n{len(rows) - 1} issues compared with the baseline versions."
+        records = issues.parse_issues(_tag_content(prompt, 'content'))
+        if 'merge the issues' in prompt:
+            return self._merge(records)
+        lines = [f"- **{r['category']}**: {r['count']}" for r in records]
+        return '**Summary**\n\n' + '\n'.join(lines) + '\n\n**Conclusion**\n\n-'
+
+    def _analyze(self, document):
+        header, *rows = document.split('\n')
+        columns = header.split('\t')
+        records = {}
+        for row in rows:
+            values = dict(zip(columns, row.split('\t')))
+            # The same review always gets the same category
+            category = CATEGORIES[sum(map(ord, values.get('Review Text', row))) % len(CATEGORIES)]
+            key = (values.get('App Version Code'), values.get('Reviewer Language'), category)
+            # Collapsed duplicates count as many reviews, as the prompt asks
+            records[key] = records.get(key, 0) + int(values.get('Count', 1))
+        return issues.format_issues([
+            {'version': version, 'lang': lang, 'category': category, 'count': count,
+             'description': f'Players report: {category.lower()}'}
+            for (version, lang, category), count in records.items()
+        ])
+
+    def _name(self, document):
+        # The category most of the cluster's representative reviews would get from _analyze
+        header, *rows = document.split('\n')
+        column = header.split('\t').index('Review Text') if 'Review Text' in header.split('\t') else None
+        votes = [CATEGORIES[sum(map(ord, row.split('\t')[column] if column is not None else row)) % len(CATEGORIES)]
+                 for row in rows]
+        category = max(CATEGORIES, key=votes.count)
+        return f"<issue>\n<category>{category}</category>\n<description>Players report: {category.lower()}</description>\n</issue>"
+
+    def _merge(self, records):
+        # Categories starting with the same stem ('crash' on startup, 'crash'es on startup) are the same issue,
+        # counts are summed as the prompt asks
+        merged = {}
+        for record in records:
+            key = (record['version'], record['lang'], issues.normalize_category(record['category'])[:5])
+            if key in merged:
+                merged[key]['count'] += record['count']
+            else:
+                merged[key] = dict(record)
+        return issues.format_issues(list(merged.values()))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        prompt = '\n'.join(str(message.content) for message in messages)
+        with self._lock:
+            if self._random is None:
+                self._random = random.Random(self.seed)
+            throttled = (self.max_in_flight is not None and self._stats['in_flight'] >= self.max_in_flight) \
+                or self._random.random() < self.throttle_rate
+            dropped = not throttled and self.drop_rate > 0 and self._random.random() < self.drop_rate
+            if throttled:
+                self._stats['throttles'] += 1
+            else:
+                self._stats['in_flight'] += 1
+                self._stats['drops'] += dropped
+        if throttled:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'InvokeModel')
+        try:
+            time.sleep(self.latency)
+            answer = self._answer(prompt)
+            output_tokens = estimate_tokens(answer)
+            with self._lock:
+                self._stats['calls'] += 1
+                self._stats['input_tokens'] += estimate_tokens(prompt)
+                self._stats['output_tokens'] += output_tokens
+            chunks = [answer[i:i + 200] for i in range(0, len(answer), 200)]
+            delay = output_tokens / self.tokens_per_second / len(chunks) if self.tokens_per_second and chunks else 0
+            for chunk in chunks:
+                if delay:
+                    time.sleep(delay)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+                if dropped:
+                    raise ClientError({'Error': {'Code': 'ServiceUnavailableException', 'Message': 'Stream dropped'}},
+                                      'InvokeModelWithResponseStream')
+        finally:
+            with self._lock:
+                self._stats['in_flight'] -= 1
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = ''.join(chunk.text for chunk in self._stream(messages, stop, run_manager, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+def install_scheduler(chat, requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9, **kwargs):
+    """
+    Replaces the rate-limit scheduler of a fake model's (region, model_id) with one of the given quotas.
+
+    The fake model id has no quota in config.yaml, and the default quota would dominate the benchmark.
+    Extra arguments are passed to bedrock.RateLimitScheduler, e.g. base_backoff.
+    """
+    scheduler = bedrock.RateLimitScheduler(requests_per_minute, tokens_per_minute, **kwargs)
+    with bedrock._schedulers_lock:
+        bedrock._schedulers[(chat.region_name, chat.model_id)] = scheduler
+    return scheduler
+
+
+def run_benchmark(data, chat, modes=None, max_concurrency=review_analyzer.DEFAULT_MAX_CONCURRENCY,
+                  token_budget=review_analyzer.DEFAULT_INPUT_TOKEN_BUDGET, trace_memory=True):
+    """
+    Runs every analysis mode on data with a fake model and measures it.
+
+    The LLM response cache should be disabled (REVIEW_ANALYZER_LLM_CACHE=0), otherwise later runs are
+    served from the cache.
+
+    Args:
+        data (pandas.DataFrame): Review data, e.g. from generate_reviews.
+        chat (FakeBedrockChat): The fake model.
+        modes (list, optional): Keys of MODES. All modes if None.
+        max_concurrency (int, optional): Maximum number of LLM calls in flight at once.
+        token_budget (int, optional): Maximum input tokens of review data per batch.
+        trace_memory (bool, optional): Measure peak memory with tracemalloc, which also slows the run down.
+
+    Returns:
+        list: One dict per mode with mode, rows, wall_time (seconds), calls, throttles, input_tokens,
+            output_tokens and peak_memory (bytes allocated by Python during the run, None if not traced).
+    """
+    results = []
+    for mode in modes or MODES:
+        before = chat.stats()
+        peak_memory = None
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            with progress.use_reporter(progress.NullReporter()):
+                MODES[mode](data, chat, max_concurrency=max_concurrency, token_budget=token_budget)
+            wall_time = time.perf_counter() - started
+            if trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        after = chat.stats()
+        results.append({
+            'mode': mode, 'rows': len(data), 'wall_time': round(wall_time, 3),
+            **{name: after[name] - before[name] for name in after}, 'peak_memory': peak_memory,
+        })
+    return results
+
+
+def format_results(results):
+    """Formats benchmark results as a text table."""
+    return pd.DataFrame(results).set_index('mode').to_string()
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m utils.benchmark',
+                                     description='Benchmarks the analysis pipeline with a fake Bedrock model.')
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--languages', default='en,fr,ja', type=lambda value: value.split(','))
+    parser.add_argument('--versions', type=int, default=3)
+    parser.add_argument('--text-length', type=float, default=60, help='Median review length, in words')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), help='Analysis modes (default: all)')
+    parser.add_argument('--latency', type=float, default=0.2, help='Time to first token of a call, in seconds')
+    parser.add_argument('--tokens-per-second', type=float, default=500, help='Output throughput of a call')
+    parser.add_argument('--max-in-flight', type=int, help='Calls above this concurrency are throttled')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of calls throttled at random')
+    parser.add_argument('--max-concurrency', type=int, default=review_analyzer.DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument('--token-budget', type=int, default=review_analyzer.DEFAULT_INPUT_TOKEN_BUDGET)
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help="Don't measure peak memory (tracemalloc slows the pipeline down)")
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+
+    Example:
+        python -m utils.benchmark --rows 5000 --latency 0.5 --max-in-flight 8 --max-concurrency 16
+    """
+    args = _parse_args(argv)
+    os.environ['REVIEW_ANALYZER_LLM_CACHE'] = '0'
+    data = generate_reviews(args.rows, args.languages, args.versions, (args.text_length, 0.8),
+                            args.duplicate_rate, args.seed)
+    chat = FakeBedrockChat(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                           max_in_flight=args.max_in_flight, throttle_rate=args.throttle_rate, seed=args.seed)
+    install_scheduler(chat, initial_concurrency=args.max_concurrency, base_backoff=0.05, max_backoff=1.0)
+    results = run_benchmark(data, chat, args.modes, args.max_concurrency, args.token_budget,
+                            trace_memory=not args.no_trace_memory)
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
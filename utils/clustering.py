@@ -0,0 +1,224 @@
+import numpy as np
+from utils.dedup import COUNT_COLUMN, TEXT_COLUMNS, normalize_text, shingle_hashes
+
+# Character n-grams of the normalized text are the terms: they work for every script without a tokenizer
+NGRAM_SIZE = 3
+# Terms are hashed into this many TF-IDF features
+HASH_FEATURES = 1 << 14
+# Dimensions of the review embeddings (latent semantic analysis of the TF-IDF matrix)
+EMBEDDING_DIMENSIONS = 64
+# Extra random dimensions and power iterations of the randomized SVD, for accuracy
+OVERSAMPLING = 10
+POWER_ITERATIONS = 1
+
+# Clusters per group by default, see default_clusters
+MAX_CLUSTERS = 30
+# Reviews closest to the centroid of a cluster that are sent to the model to name it
+SAMPLES_PER_CLUSTER = 10
+MINI_BATCH_SIZE = 1024
+MAX_ITERATIONS = 100
+_CHUNK_NONZEROS = 1 << 13
+
+
+def _sparse_dot(rows, cols, values, dense, n_rows):
+    # (n_rows x features) sparse matrix in coordinate form, sorted by rows, times a dense (features x k) matrix.
+    # Products are summed per row with reduceat, in small chunks of nonzeros so the gathered rows of dense stay in cache.
+    out = np.zeros((n_rows, dense.shape[1]), dtype=dense.dtype)
+    for start in range(0, len(rows), _CHUNK_NONZEROS):
+        chunk_rows = rows[start:start + _CHUNK_NONZEROS]
+        products = values[start:start + _CHUNK_NONZEROS, None] * dense[cols[start:start + _CHUNK_NONZEROS]]
+        distinct, first = np.unique(chunk_rows, return_index=True)
+        # A row split across chunks adds up
+        out[distinct] += np.add.reduceat(products, first, axis=0)
+    return out
+
+
+def tfidf_matrix(texts, features=HASH_FEATURES, ngram_size=NGRAM_SIZE):
+    """
+    Computes the TF-IDF matrix of the character n-grams of texts, hashed into features columns, vectorized.
+
+    Term frequencies are sublinear (1 + log tf), inverse document frequencies smoothed, rows L2-normalized.
+
+    Args:
+        texts (list): Normalized texts, see dedup.normalize_text.
+        features (int, optional): Number of columns.
+        ngram_size (int, optional): Characters per term.
+
+    Returns:
+        tuple: (rows, cols, values) of the nonzero entries, sorted by row then column. Texts without
+            characters have no entry.
+    """
+    n = len(texts)
+    if not n:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    hashes, offsets = shingle_hashes(texts, ngram_size)
+    counts = np.diff(np.append(offsets, len(hashes)))
+    cells = np.repeat(np.arange(n, dtype=np.int64), counts) * features + (hashes % np.uint64(features)).astype(np.int64)
+    cells, tf = np.unique(cells, return_counts=True)
+    rows, cols = cells // features, cells % features
+    # Empty texts are one zero shingle, which is not a term
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=n)
+    keep = lengths[rows] > 0
+    rows, cols, tf = rows[keep], cols[keep], tf[keep]
+    df = np.bincount(cols, minlength=features)
+    idf = np.log((1 + n) / (1 + df)) + 1
+    values = (1 + np.log(tf)) * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=n))
+    values = values / norms[rows]
+    return rows, cols, values.astype(np.float32)
+
+
+def review_embeddings(texts, dimensions=EMBEDDING_DIMENSIONS, features=HASH_FEATURES, seed=0):
+    """
+    Embeds texts with latent semantic analysis: TF-IDF of character n-grams (see tfidf_matrix) reduced by a
+    randomized truncated SVD, vectorized in NumPy.
+
+    Args:
+        texts (list): Normalized texts, see dedup.normalize_text.
+        dimensions (int, optional): Embedding dimensions, at most the number of texts.
+        features (int, optional): Number of hashed TF-IDF features.
+        seed (int, optional): Seed of the random projection.
+
+    Returns:
+        numpy.ndarray: float32 array of shape (len(texts), dimensions), rows L2-normalized (zero for empty texts).
+    """
+    n = len(texts)
+    dimensions = max(1, min(dimensions, n))
+    rows, cols, values = tfidf_matrix(texts, features)
+    if not len(values):
+        return np.zeros((n, dimensions), dtype=np.float32)
+    # Transposed matrix, sorted by column, for the products with the transpose
+    order = np.argsort(cols, kind='stable')
+    t_rows, t_cols, t_values = cols[order], rows[order], values[order]
+
+    rng = np.random.default_rng(seed)
+    sketch = rng.standard_normal((features, dimensions + OVERSAMPLING)).astype(np.float32)
+    basis = np.linalg.qr(_sparse_dot(rows, cols, values, sketch, n))[0]
+    for _ in range(POWER_ITERATIONS):
+        basis = np.linalg.qr(_sparse_dot(t_rows, t_cols, t_values, basis, features))[0]
+        basis = np.linalg.qr(_sparse_dot(rows, cols, values, basis, n))[0]
+    # The matrix is about basis @ small, the SVD of small gives the leading singular vectors
+    small = _sparse_dot(t_rows, t_cols, t_values, basis, features).T
+    u, s, _ = np.linalg.svd(small, full_matrices=False)
+    embeddings = (basis @ u[:, :dimensions]) * s[:dimensions]
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return np.divide(embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0).astype(np.float32)
+
+
+def _squared_distances(x, centers):
+    return np.maximum(0, (x ** 2).sum(axis=1)[:, None] - 2 * x @ centers.T + (centers ** 2).sum(axis=1)[None, :])
+
+
+def _kmeans_plus_plus(x, weights, n_clusters, rng):
+    # Greedy k-means++: of a few candidates drawn with probability proportional to their weighted squared distance
+    # to the nearest center, the one that reduces the total distance most becomes the next center
+    trials = 2 + int(np.log(n_clusters))
+    centers = [x[rng.choice(len(x), p=weights / weights.sum())]]
+    closest = _squared_distances(x, centers[0][None, :])[:, 0]
+    for _ in range(1, n_clusters):
+        scores = closest * weights
+        if scores.sum() <= 0:
+            break
+        candidates = rng.choice(len(x), trials, p=scores / scores.sum())
+        distances = np.minimum(closest[None, :], _squared_distances(x[candidates], x).reshape(trials, -1))
+        best = (distances * weights).sum(axis=1).argmin()
+        centers.append(x[candidates[best]])
+        closest = distances[best]
+    return np.array(centers)
+
+
+def minibatch_kmeans(x, n_clusters, weights=None, batch_size=MINI_BATCH_SIZE, max_iterations=MAX_ITERATIONS,
+                     tolerance=1e-4, seed=0):
+    """
+    Clusters points with mini-batch k-means (k-means++ initialization), vectorized.
+
+    Each iteration assigns a random batch of points to their nearest center and moves every center towards
+    the weighted mean of its points, with a per-center learning rate decreasing as it absorbs weight.
+
+    Args:
+        x (numpy.ndarray): Points, shape (n, dimensions).
+        n_clusters (int): Number of clusters, fewer if there are fewer distinct points.
+        weights (numpy.ndarray, optional): Weight of each point, e.g. the Count of collapsed reviews.
+        batch_size (int, optional): Points per iteration.
+        max_iterations (int, optional): Maximum number of iterations.
+        tolerance (float, optional): Stops when no center moves more than this (squared distance).
+        seed (int, optional): Random seed, the same arguments always give the same clusters.
+
+    Returns:
+        tuple: (label of each point in 0..k-1, centers of shape (k, dimensions)).
+    """
+    n = len(x)
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+    if not n:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, x.shape[1]), dtype=x.dtype)
+    rng = np.random.default_rng(seed)
+    init = rng.choice(n, min(n, 10 * batch_size), replace=False)
+    centers = _kmeans_plus_plus(x[init], weights[init], max(1, min(n_clusters, n)), rng).astype(np.float64)
+    absorbed = np.zeros(len(centers))
+    for _ in range(max_iterations):
+        batch = rng.choice(n, min(n, batch_size), replace=False)
+        nearest = _squared_distances(x[batch], centers).argmin(axis=1)
+        mass = np.bincount(nearest, weights=weights[batch], minlength=len(centers))
+        sums = np.zeros_like(centers)
+        np.add.at(sums, nearest, x[batch] * weights[batch, None])
+        absorbed += mass
+        moved = mass > 0
+        step = (sums[moved] - mass[moved, None] * centers[moved]) / absorbed[moved, None]
+        centers[moved] += step
+        if (step ** 2).sum(axis=1).max(initial=0) < tolerance:
+            break
+
+    labels = np.concatenate([_squared_distances(x[start:start + batch_size], centers).argmin(axis=1)
+                             for start in range(0, n, batch_size)])
+    # Centers without points are dropped, the others are numbered in order of first appearance
+    used, first = np.unique(labels, return_index=True)
+    used = used[np.argsort(first)]
+    mapping = np.zeros(len(centers), dtype=np.int64)
+    mapping[used] = np.arange(len(used))
+    return mapping[labels], centers[used].astype(x.dtype)
+
+
+def default_clusters(reviews, max_clusters=MAX_CLUSTERS):
+    """Returns the default number of clusters of a group of reviews: sqrt(reviews / 2), at most max_clusters."""
+    return int(max(1, min(max_clusters, round(np.sqrt(reviews / 2)))))
+
+
+def cluster_reviews(df, n_clusters=None, samples=SAMPLES_PER_CLUSTER, text_columns=TEXT_COLUMNS, seed=0):
+    """
+    Clusters reviews by their text locally, without the model: review_embeddings then minibatch_kmeans.
+
+    Only the samples of each cluster need to go to the model, to name its issue; its size is exact.
+
+    Args:
+        df (pandas.DataFrame): Review data, e.g. one version. Rows with a COUNT_COLUMN (see
+            dedup.collapse_duplicates) count as that many reviews.
+        n_clusters (int, optional): Number of clusters, default_clusters of the number of reviews if None.
+        samples (int, optional): Representative reviews kept per cluster.
+        text_columns (tuple, optional): Columns clustered.
+        seed (int, optional): Random seed, the same arguments always give the same clusters.
+
+    Returns:
+        list: (size, samples) of each cluster, largest first. size is the number of reviews of the cluster,
+            samples the rows of df closest to its centroid, closest first.
+
+    Example:
+        for size, samples in cluster_reviews(dedup.collapse_duplicates(df)):
+            print(size, samples['Review Text'].tolist())
+    """
+    columns = [column for column in text_columns if column in df.columns]
+    if df.empty or not columns:
+        return []
+    text = df[columns[0]].astype('string').fillna('')
+    for column in columns[1:]:
+        text = text + ' ' + df[column].astype('string').fillna('')
+    weights = df[COUNT_COLUMN].to_numpy(dtype=float) if COUNT_COLUMN in df.columns else np.ones(len(df))
+
+    embeddings = review_embeddings(list(normalize_text(text)), seed=seed)
+    labels, centers = minibatch_kmeans(embeddings, n_clusters or default_clusters(weights.sum()), weights, seed=seed)
+    distances = ((embeddings - centers[labels]) ** 2).sum(axis=1)
+    sizes = np.bincount(labels, weights=weights).round().astype(np.int64)
+    # Rows by cluster, closest to the centroid first
+    order = np.lexsort((distances, labels))
+    members = np.split(order, np.cumsum(np.bincount(labels, minlength=len(centers)))[:-1])
+    return [(int(sizes[label]), df.iloc[members[label][:samples]])
+            for label in np.argsort(-sizes, kind='stable')]
@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+
+# Columns whose text identifies a review
+TEXT_COLUMNS = ('Review Title', 'Review Text')
+# Column added to collapsed data: number of reviews a row stands for
+COUNT_COLUMN = 'Count'
+
+# Estimated Jaccard similarity (of character shingles) above which two reviews are near-duplicates
+DEFAULT_THRESHOLD = 0.8
+# Normalized texts shorter than this are only collapsed when identical: "bad" and "sad" are 1 edit apart
+MIN_NEAR_DUPLICATE_LENGTH = 20
+SHINGLE_SIZE = 4
+# MinHash permutations, split into LSH bands of NUM_PERM // BANDS rows.
+# With 16 bands of 4 rows, pairs at similarity 0.8 become candidates with probability > 0.999.
+NUM_PERM = 64
+BANDS = 16
+_CHUNK_SHINGLES = 100000
+
+
+def normalize_text(texts):
+    """
+    Normalizes review texts for duplicate detection, vectorized.
+
+    Lowercases, drops punctuation and emoji, shortens repeated characters ("baaaad" -> "baad")
+    and collapses whitespace.
+
+    Args:
+        texts (pandas.Series): Review texts.
+
+    Returns:
+        pandas.Series: Normalized texts, same index as texts.
+
+    Example:
+        normalize_text(pd.Series(['Crashes!!! 😡', 'crashes'])).tolist()  # ['crashes', 'crashes']
+    """
+    # Python strings: the back reference below is not supported by pyarrow's regex engine
+    return (texts.astype('string').fillna('').astype(object)
+            .str.lower()
+            .str.replace(r'[^\w\s]|_', ' ', regex=True)
+            .str.replace(r'(\w)\1{2,}', r'\1\1', regex=True)
+            .str.replace(r'\s+', ' ', regex=True)
+            .str.strip())
+
+
+def shingle_hashes(texts, shingle_size):
+    """
+    Hashes the character shingles of all texts at once, vectorized.
+
+    Returns:
+        tuple: (uint64 array of the 32-bit polynomial hash of every shingle, text after text,
+                index of the first shingle of each text). A text shorter than a shingle is one (zero padded) shingle.
+    """
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    counts = np.maximum(1, lengths - shingle_size + 1)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    text_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    codes = np.concatenate([codes, np.zeros(shingle_size, dtype=np.uint64)])
+    starts = np.repeat(text_starts - offsets, counts) + np.arange(counts.sum())
+    shingle_lengths = np.repeat(lengths, counts)
+    hashes = np.zeros(len(starts), dtype=np.uint64)
+    for k in range(shingle_size):
+        hashes = hashes * np.uint64(1000003) + np.where(k < shingle_lengths, codes[starts + k], 0)
+    return hashes & np.uint64(0xffffffff), offsets
+
+
+def minhash_signatures(texts, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=1):
+    """
+    Computes the MinHash signature of the character shingles of each text, vectorized.
+
+    The fraction of equal values of two signatures estimates the Jaccard similarity of their shingle sets.
+
+    Args:
+        texts (list): Normalized texts.
+        num_perm (int, optional): Number of hash functions (signature length).
+        shingle_size (int, optional): Characters per shingle, shorter texts are one shingle.
+        seed (int, optional): Seed of the hash functions, signatures are only comparable with the same seed.
+
+    Returns:
+        numpy.ndarray: uint32 array of shape (len(texts), num_perm).
+    """
+    rng = np.random.default_rng(seed)
+    # Multiply-shift hash functions: (a * x + b) mod 2**64, top 32 bits
+    a = rng.integers(1, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    if not len(texts):
+        return signatures
+    hashes, offsets = shingle_hashes(texts, shingle_size)
+    # Reviews share most shingles: every hash function is applied once per distinct shingle
+    distinct, inverse = np.unique(hashes, return_inverse=True)
+    permuted = ((distinct[:, None] * a + b) >> np.uint64(32)).astype(np.uint32)
+    bounds = np.append(offsets, len(hashes))
+    # Whole texts per chunk of about _CHUNK_SHINGLES shingles, bounding the gathered (shingles x num_perm) matrix
+    first = 0
+    while first < len(texts):
+        last = int(np.searchsorted(bounds, bounds[first] + _CHUNK_SHINGLES, side='right')) - 1
+        last = min(max(last, first + 1), len(texts))
+        chunk = permuted[inverse[bounds[first]:bounds[last]]]
+        signatures[first:last] = np.minimum.reduceat(chunk, bounds[first:last] - bounds[first], axis=0)
+        first = last
+    return signatures
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def near_duplicate_clusters(signatures, threshold=DEFAULT_THRESHOLD, bands=BANDS):
+    """
+    Clusters texts whose MinHash signatures are similar, using locality-sensitive hashing.
+
+    Texts sharing a band of their signature are candidates; a candidate joins the cluster of the first
+    text of its bucket if their estimated similarity is at least threshold. Clusters are transitive.
+
+    Args:
+        signatures (numpy.ndarray): MinHash signatures, see minhash_signatures.
+        threshold (float, optional): Minimum estimated Jaccard similarity.
+        bands (int, optional): Number of LSH bands, must divide the signature length.
+
+    Returns:
+        numpy.ndarray: Cluster id of each text, the index of a text of its cluster.
+    """
+    n, num_perm = signatures.shape
+    parent = np.arange(n)
+    if n < 2:
+        return parent
+    rows = num_perm // bands
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        _, bucket = np.unique(keys.view(np.dtype((np.void, keys.dtype.itemsize * rows))).ravel(), return_inverse=True)
+        leader = pd.Series(np.arange(n)).groupby(bucket).transform('min').to_numpy()
+        candidates = np.flatnonzero(leader != np.arange(n))
+        if not len(candidates):
+            continue
+        similarity = (signatures[candidates] == signatures[leader[candidates]]).mean(axis=1)
+        for i, j in zip(candidates[similarity >= threshold], leader[candidates[similarity >= threshold]]):
+            root_i, root_j = _find(parent, i), _find(parent, j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+    return np.array([_find(parent, i) for i in range(n)])
+
+
+def collapse_duplicates(df, threshold=DEFAULT_THRESHOLD, text_columns=TEXT_COLUMNS):
+    """
+    Collapses identical and near-identical reviews into one row with a Count column.
+
+    Title and text are normalized (see normalize_text); identical normalized texts are collapsed by
+    hashing, and texts of at least MIN_NEAR_DUPLICATE_LENGTH characters whose shingles are similar
+    (MinHash LSH, see near_duplicate_clusters) are collapsed as well, e.g. copy-paste spam or the same
+    review edited several times. Each cluster is represented by its first row, with the number of reviews
+    it stands for in COUNT_COLUMN, so issue frequencies are kept. Reviews without text are never collapsed.
+
+    Args:
+        df (pandas.DataFrame): Review data, e.g. one version of an export. Rows with a COUNT_COLUMN
+            (already collapsed) count as that many reviews.
+        threshold (float, optional): Minimum estimated Jaccard similarity of near-duplicates, 1.0 collapses
+            identical normalized texts only.
+        text_columns (tuple, optional): Columns compared.
+
+    Returns:
+        pandas.DataFrame: df itself if nothing was collapsed, otherwise the first row of each cluster
+            in order, with COUNT_COLUMN as the last column.
+
+    Example:
+        df = pd.DataFrame({'Review Text': ['Crash!!', 'crash', 'Login fails']})
+        collapse_duplicates(df)
+        #   Review Text  Count
+        # 0     Crash!!      2
+        # 2 Login fails      1
+    """
+    columns = [column for column in text_columns if column in df.columns]
+    if len(df) < 2 or not columns:
+        return df
+    text = df[columns[0]].astype('string').fillna('')
+    for column in columns[1:]:
+        text = text + ' ' + df[column].astype('string').fillna('')
+    normalized = normalize_text(text)
+
+    # Exact duplicates: one cluster per distinct normalized text, rows without text stay alone
+    codes, uniques = pd.factorize(normalized)
+    empty = (normalized == '').to_numpy()
+    codes[empty] = len(uniques) + np.arange(empty.sum())
+
+    # Near duplicates among the distinct texts that are long enough
+    long_texts = np.flatnonzero(uniques.str.len() >= MIN_NEAR_DUPLICATE_LENGTH) if threshold < 1 else []
+    if len(long_texts) > 1:
+        clusters = near_duplicate_clusters(minhash_signatures(list(uniques[long_texts])), threshold)
+        mapping = np.arange(len(uniques) + empty.sum())
+        mapping[long_texts] = long_texts[clusters]
+        codes = mapping[codes]
+
+    if len(np.unique(codes)) == len(df):
+        return df
+    clusters = pd.Series(codes, index=df.index)
+    weights = df[COUNT_COLUMN] if COUNT_COLUMN in df.columns else pd.Series(1, index=df.index)
+    counts = weights.groupby(clusters).sum()
+    first = ~clusters.duplicated()
+    collapsed = df[first.to_numpy()].drop(columns=COUNT_COLUMN, errors='ignore')
+    collapsed[COUNT_COLUMN] = counts.loc[clusters[first]].to_numpy()
+    return collapsed
@@ -0,0 +1,161 @@
+import math
+import numpy as np
+import pandas as pd
+from utils import issues
+
+# Two-sided p-value below which a change of the share of an issue is significant
+ALPHA = 0.05
+# Rows of the diff given to the model, the most notable first, so comparison prompts have a constant size
+MAX_PROMPT_ROWS = 25
+
+# Status of an issue in the target version, in report order
+STATUSES = ('new', 'worse', 'better', 'disappeared', 'unchanged')
+DIFF_COLUMNS = ['category', 'status', 'target_count', 'target_share', 'baseline_count', 'baseline_share',
+                'baseline_min_share', 'baseline_max_share', 'delta', 'z', 'p_value', 'description']
+
+
+def align_categories(categories):
+    """
+    Maps the category names of several versions to one label per issue.
+
+    Each category joins the first label that is similar to it (see issues.similar_categories), or becomes
+    a label, so categories should be given most frequent first.
+
+    Args:
+        categories (list): Category names.
+
+    Returns:
+        dict: Category name -> label.
+
+    Example:
+        align_categories(['Game crashes', 'Login failure', 'Game crash'])
+        # {'Game crashes': 'Game crashes', 'Login failure': 'Login failure', 'Game crash': 'Game crashes'}
+    """
+    labels = []
+    mapping = {}
+    for category in categories:
+        if category in mapping:
+            continue
+        mapping[category] = next((label for label in labels if issues.similar_categories(category, label)), category)
+        if mapping[category] == category:
+            labels.append(category)
+    return mapping
+
+
+def two_proportion_test(count_a, total_a, count_b, total_b):
+    """
+    Pooled two-proportion z-test of count_a / total_a against count_b / total_b, vectorized.
+
+    Returns:
+        tuple: (z, two-sided p-value) arrays, 0 and 1 where a total is 0.
+    """
+    count_a, total_a, count_b, total_b = (np.asarray(x, dtype=float) for x in (count_a, total_a, count_b, total_b))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled = (count_a + count_b) / (total_a + total_b)
+        variance = pooled * (1 - pooled) * (1 / total_a + 1 / total_b)
+        z = np.where(variance > 0, (count_a / total_a - count_b / total_b) / np.sqrt(variance), 0.0)
+    z = np.nan_to_num(z)
+    p_value = np.array([math.erfc(abs(value) / math.sqrt(2)) for value in np.ravel(z)]).reshape(np.shape(z))
+    return z, p_value
+
+
+def diff_versions(records_by_version, target_version, alpha=ALPHA):
+    """
+    Compares the issues of a target version with the issues of the baseline versions.
+
+    Categories are aligned across versions (see align_categories). The share of an issue in a version is its
+    count over the counts of all issues of the version; the share in the target is compared with the share in
+    all baselines together with a two-proportion z-test.
+
+    Records of a sampled version (see sampling.scale_issues) have estimated counts, which are used for the
+    counts and shares, and the counts of the sample in 'sample_count', which are used for the test: the test
+    is on the reviews actually analyzed, so a sampled version is not more significant than its sample.
+
+    Args:
+        records_by_version (dict): Version -> issue records (see issues.parse_issues), target included.
+            Records of several languages of a version are counted together.
+        target_version (str): The target version, the others are baselines.
+        alpha (float, optional): Significance level of worse/better.
+
+    Returns:
+        pandas.DataFrame: One row per issue with the DIFF_COLUMNS, in STATUSES order then by change of share.
+            status: 'new' (in no baseline), 'worse'/'better' (share significantly higher/lower than in the
+            baselines), 'disappeared' (only in baselines) or 'unchanged'.
+            Shares and delta (target_share - baseline_share) are fractions; baseline_min/max_share are the
+            range of the share across baseline versions.
+
+    Example:
+        diff = diff_versions({'1.0': records_1, '1.1': records_2, '2.0': records_3}, '2.0')
+        diff[diff['status'] == 'worse']
+    """
+    rows = [(str(version), record['category'], record['count'], record.get('sample_count', record['count']),
+             record.get('description', ''))
+            for version, records in records_by_version.items() for record in records]
+    df = pd.DataFrame(rows, columns=['version', 'category', 'count', 'tested', 'description'])
+    target = str(target_version)
+    if df.empty:
+        return pd.DataFrame(columns=DIFF_COLUMNS)
+
+    totals = df.groupby('category', sort=False)['count'].sum().sort_values(ascending=False, kind='stable')
+    df['label'] = df['category'].map(align_categories(list(totals.index)))
+    counts = df.pivot_table(index='label', columns='version', values='count', aggfunc='sum', fill_value=0)
+    baselines = [version for version in counts.columns if version != target]
+    target_counts = counts[target] if target in counts.columns else pd.Series(0, index=counts.index)
+    baseline_counts = counts[baselines].sum(axis=1)
+    target_total, baseline_total = target_counts.sum(), baseline_counts.sum()
+    shares = counts[baselines] / counts[baselines].sum().replace(0, np.nan)
+    # Counts of the reviews analyzed, the sample of a sampled version
+    tested = df.pivot_table(index='label', columns='version', values='tested', aggfunc='sum', fill_value=0)
+    tested_target = tested[target] if target in tested.columns else pd.Series(0, index=tested.index)
+    tested_baseline = tested[baselines].sum(axis=1)
+
+    diff = pd.DataFrame({
+        'category': counts.index,
+        'target_count': target_counts.to_numpy(),
+        'target_share': (target_counts / target_total if target_total else target_counts * 0.0).to_numpy(),
+        'baseline_count': baseline_counts.to_numpy(),
+        'baseline_share': (baseline_counts / baseline_total if baseline_total else baseline_counts * 0.0).to_numpy(),
+        'baseline_min_share': shares.min(axis=1).fillna(0.0).to_numpy(),
+        'baseline_max_share': shares.max(axis=1).fillna(0.0).to_numpy(),
+    })
+    diff['delta'] = diff['target_share'] - diff['baseline_share']
+    diff['z'], diff['p_value'] = two_proportion_test(tested_target.to_numpy(), tested_target.sum(),
+                                                     tested_baseline.to_numpy(), tested_baseline.sum())
+    diff['status'] = np.select(
+        [diff['baseline_count'] == 0, diff['target_count'] == 0,
+         (diff['p_value'] < alpha) & (diff['delta'] > 0), (diff['p_value'] < alpha) & (diff['delta'] < 0)],
+        ['new', 'disappeared', 'worse', 'better'], 'unchanged')
+
+    # Description of the largest record of the issue, in the target if it has one
+    df['in_target'] = df['version'] == target
+    best = df.sort_values(['in_target', 'count'], ascending=False, kind='stable').drop_duplicates('label')
+    diff['description'] = diff['category'].map(best.set_index('label')['description']).fillna('')
+
+    order = diff['status'].map({status: i for i, status in enumerate(STATUSES)})
+    diff = diff.assign(_order=order, _change=-diff['delta'].abs()).sort_values(['_order', '_change'], kind='stable')
+    return diff[DIFF_COLUMNS].reset_index(drop=True)
+
+
+def format_diff(diff, limit=MAX_PROMPT_ROWS):
+    """
+    Formats a diff (see diff_versions) as a markdown table, for the comparison prompt and report.
+
+    Args:
+        diff (pandas.DataFrame): The diff.
+        limit (int, optional): Maximum rows, the first ones of the diff (unchanged issues last). None for all.
+
+    Returns:
+        str: Markdown table, with a last line counting the rows left out.
+    """
+    shown = diff if limit is None else diff.head(limit)
+    lines = ['| Issue | Status | Target | Baselines | Δ share | p-value |', '|---|---|---|---|---|---|']
+    for row in shown.itertuples(index=False):
+        category = str(row.category).replace('|', '/')
+        lines.append(
+            f'| {category} | {row.status} | {row.target_count} ({row.target_share:.1%}) '
+            f'| {row.baseline_count} ({row.baseline_share:.1%}, {row.baseline_min_share:.1%}-{row.baseline_max_share:.1%}) '
+            f'| {row.delta * 100:+.1f} pt | {row.p_value:.3f} |'
+        )
+    if len(shown) < len(diff):
+        lines.append(f'\n{len(diff) - len(shown)} more issues, unchanged or less notable.')
+    return '\n'.join(lines)
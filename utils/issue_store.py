@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+from utils.llm_cache import DEFAULT_CACHE_DIR
+
+# Columns identifying a review: cumulative exports contain the same review again every month.
+# An edited review has a new date and text, so it is analyzed again.
+REVIEW_KEY_COLUMNS = ['Review Date', 'Device', 'Review Title', 'Review Text']
+
+
+def review_keys(df, columns=REVIEW_KEY_COLUMNS):
+    """
+    Returns the key of each review, a 64-bit hash of its date, device and text, vectorized.
+
+    Args:
+        df (pandas.DataFrame): Review data.
+        columns (list, optional): Columns hashed, those missing from df are ignored.
+
+    Returns:
+        pandas.Series: int64 keys, same index as df.
+    """
+    columns = [column for column in columns if column in df.columns]
+    # As text, so categoricals, object and pyarrow strings of the same values hash alike
+    values = df[columns].astype('string').fillna('')
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    return pd.Series(hashes.view(np.int64), index=df.index)
+
+
+def reviews_signature(keys):
+    """Returns the signature of a set of reviews (sha256 hex digest of their keys), whatever their order."""
+    return hashlib.sha256(np.unique(np.asarray(keys, dtype=np.int64)).tobytes()).hexdigest()
+
+
+def make_scope(*parts):
+    """
+    Builds the scope of stored results: results and reviews are only shared between runs of the same scope.
+
+    Args:
+        parts: What the results depend on, e.g. the analysis mode, the model parameters, the app and the filters.
+
+    Returns:
+        str: sha256 hex digest.
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _encode_group(group):
+    return json.dumps(list(group) if isinstance(group, tuple) else group, ensure_ascii=False, default=str)
+
+
+class IssueStore:
+    """
+    Persistent analysis results of each group (version, (language, version), ...), and the keys of the reviews
+    they cover, stored in SQLite.
+
+    Incremental runs only analyze the reviews whose key was not seen in their scope yet, and fold the new
+    issue records into the stored result of the group (see review_analyzer.analyze_data).
+    Safe to use from several threads.
+
+    Example:
+        store = IssueStore('/tmp/issues.sqlite')
+        scope = make_scope('version', model_params, {'app': 'com.example', 'ratings': [1, 2]})
+        keys = review_keys(df)
+        new = df[~store.seen(scope, keys.to_numpy())]
+        ...
+        store.save(scope, '1.0', result, keys[new.index].to_numpy())
+        store.load(scope, '1.0')  # {'xmldata': ..., 'issues': [...], 'report': ..., 'skipped': {...}}
+
+    Results of exactly a set of reviews are stored under (group, reviews_signature(keys)) instead, without keys.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'scope TEXT NOT NULL, group_key TEXT NOT NULL, result TEXT NOT NULL, '
+                'reviews INTEGER NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (scope, group_key))'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS reviews ('
+                'scope TEXT NOT NULL, review_key INTEGER NOT NULL, group_key TEXT NOT NULL, '
+                'PRIMARY KEY (scope, review_key)) WITHOUT ROWID'
+            )
+            self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS lookup (review_key INTEGER PRIMARY KEY)')
+            self._conn.commit()
+
+    def seen(self, scope, keys):
+        """
+        Returns which reviews were already analyzed in scope.
+
+        Args:
+            scope (str): See make_scope.
+            keys (numpy.ndarray): Review keys, see review_keys.
+
+        Returns:
+            numpy.ndarray: bool array, True for the keys already seen.
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        with self._lock:
+            self._conn.execute('DELETE FROM lookup')
+            self._conn.executemany('INSERT OR IGNORE INTO lookup VALUES (?)', ((int(key),) for key in np.unique(keys)))
+            seen = self._conn.execute(
+                'SELECT review_key FROM lookup JOIN reviews USING (review_key) WHERE scope = ?', (scope,)
+            ).fetchall()
+            self._conn.execute('DELETE FROM lookup')
+            self._conn.commit()
+        return np.isin(keys, np.array([row[0] for row in seen], dtype=np.int64))
+
+    def load(self, scope, group):
+        """Returns the stored result of a group, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT result FROM results WHERE scope = ? AND group_key = ?',
+                                     (scope, _encode_group(group))).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def save(self, scope, group, result, keys=()):
+        """
+        Replaces the stored result of a group, and records the keys of the reviews it now covers, at once.
+
+        Args:
+            scope (str): See make_scope.
+            group: Group key, e.g. '1.0' or ('en', '1.0').
+            result (dict): JSON serializable result, e.g. {'xmldata', 'issues', 'report', 'skipped'}.
+            keys (numpy.ndarray, optional): Keys of the reviews newly covered by result.
+        """
+        group_key = _encode_group(group)
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO reviews VALUES (?, ?, ?)',
+                                   ((scope, int(key), group_key) for key in keys))
+            reviews = self._conn.execute('SELECT COUNT(*) FROM reviews WHERE scope = ? AND group_key = ?',
+                                         (scope, group_key)).fetchone()[0]
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results (scope, group_key, result, reviews, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (scope, group_key, json.dumps(result, ensure_ascii=False, default=str), reviews, time.time()),
+            )
+
+    def clear(self, scope=None):
+        """Removes the results and reviews of scope, or everything if scope is None."""
+        where, params = ('WHERE scope = ?', (scope,)) if scope is not None else ('', ())
+        with self._lock, self._conn:
+            self._conn.execute(f'DELETE FROM results {where}', params)
+            self._conn.execute(f'DELETE FROM reviews {where}', params)
+
+    def stats(self):
+        """Returns the number of scopes and groups with stored results, and the number of reviews they cover."""
+        with self._lock:
+            scopes, groups, reviews = self._conn.execute(
+                'SELECT COUNT(DISTINCT scope), COUNT(*), COALESCE(SUM(reviews), 0) FROM results'
+            ).fetchone()
+        return {'scopes': scopes, 'groups': groups, 'reviews': reviews}
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store():
+    """
+    Returns the process-wide issue store.
+
+    Returns:
+        IssueStore: Store in REVIEW_ANALYZER_CACHE_DIR (default ~/.cache/playstore-review-analysis).
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            cache_dir = os.environ.get('REVIEW_ANALYZER_CACHE_DIR', DEFAULT_CACHE_DIR)
+            _default_store = IssueStore(os.path.join(cache_dir, 'issues.sqlite'))
+    return _default_store
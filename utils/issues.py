@@ -0,0 +1,263 @@
+import re
+from difflib import SequenceMatcher
+
+# Container and field tags produced by the analyze/merge prompts, e.g.
+#   <version='1.0' lang='en'> <issue> <category>..</category> <count>..</count> <description>..</description> </issue> </version>
+#   <issues lang='en'> ... </issues>
+TAG_PATTERN = re.compile(r'<(/?)(version|issues|issue|category|count|description)\b([^>]*)>', re.I)
+ATTR_PATTERN = re.compile(r'''(\w*)\s*=\s*['"]?([^'"\s>]*)['"]?''')
+
+# Two categories of the same version/language are "similar" above these thresholds
+SIMILARITY_RATIO = 0.75
+TOKEN_JACCARD = 0.5
+
+
+def _parse_attrs(tag_name, attrs):
+    """Parses "='1.0' lang='en'" or ' version="1.0"' into {'version': '1.0', 'lang': 'en'}."""
+    parsed = {}
+    for name, value in ATTR_PATTERN.findall(attrs):
+        parsed[(name or tag_name).lower()] = value or None
+    return parsed
+
+
+class IssueStreamParser:
+    """
+    Incremental, error-tolerant parser of the model's XML-like analysis output.
+
+    Feed it the chunks of a streamed response as they arrive; each issue record is returned as soon as
+    its </issue> tag closes. Tags split across chunks are handled, unknown text is ignored, unclosed
+    issues are dropped and a missing or non-numeric count is 0. The model output is not valid XML
+    (<version='1.0' lang='en'>), so this is a tag scanner rather than an XML parser.
+
+    Example:
+        parser = IssueStreamParser()
+        for chunk in chain.stream(inputs):
+            for record in parser.feed(chunk):
+                ...
+        parser.records  # every record parsed so far
+    """
+
+    def __init__(self):
+        self.records = []
+        self._buffer = ''
+        self._scan_from = 0
+        self._context = {'version': None, 'lang': None}
+        self._issue = None
+        self._field = None
+        self._field_start = 0
+
+    def feed(self, chunk):
+        """
+        Consumes a chunk of model output.
+
+        Args:
+            chunk (str): Next piece of the streamed text.
+
+        Returns:
+            list: Issue records completed by this chunk.
+        """
+        self._buffer += chunk
+        completed = []
+        pos = self._scan_from
+        for match in TAG_PATTERN.finditer(self._buffer, self._scan_from):
+            record = self._handle_tag(match)
+            if record is not None:
+                completed.append(record)
+            pos = match.end()
+
+        # Keep the text of an open field and anything after the last tag (it may be a partial tag)
+        keep = min(pos, self._field_start) if self._field is not None else pos
+        self._buffer = self._buffer[keep:]
+        self._field_start -= keep
+        self._scan_from = pos - keep
+        self.records.extend(completed)
+        return completed
+
+    def _handle_tag(self, match):
+        closing, tag, attrs = match.group(1) == '/', match.group(2).lower(), match.group(3)
+        if tag in ('version', 'issues'):
+            if closing:
+                self._context = {'version': None, 'lang': None}
+            else:
+                attrs = _parse_attrs(tag, attrs)
+                self._context = {'version': attrs.get('version'), 'lang': attrs.get('lang')}
+        elif tag == 'issue':
+            issue, self._issue, self._field = self._issue, (None if closing else {}), None
+            if closing and issue and issue.get('category'):
+                return _make_record(self._context, issue)
+        elif self._issue is not None:
+            if not closing:
+                self._field, self._field_start = tag, match.end()
+            elif self._field == tag:
+                self._issue[tag] = self._buffer[self._field_start:match.start()].strip()
+                self._field = None
+        return None
+
+
+def parse_issues(text):
+    """
+    Parses the model's XML-like analysis output into issue records.
+
+    Args:
+        text (str): Output of an analyze or merge call.
+
+    Returns:
+        list: Issue records, dicts with keys version, lang, category, count and description.
+
+    Example:
+        parse_issues("<version='1.0' lang='en'><issue><category>Crash</category><count>3</count>"
+                     "<description>Crashes on start</description></issue></version>")
+        # [{'version': '1.0', 'lang': 'en', 'category': 'Crash', 'count': 3, 'description': 'Crashes on start'}]
+    """
+    parser = IssueStreamParser()
+    parser.feed(text or '')
+    return parser.records
+
+
+def _make_record(context, issue):
+    count = re.search(r'\d+', issue.get('count', '').replace(',', ''))
+    return {
+        'version': context['version'],
+        'lang': context['lang'],
+        'category': issue['category'],
+        'count': int(count.group()) if count else 0,
+        'description': issue.get('description', ''),
+    }
+
+
+def normalize_category(category):
+    """
+    Normalizes a category name for exact matching: case, punctuation and whitespace are ignored.
+
+    Example:
+        normalize_category(' Game  Crashes!')  # 'game crashes'
+    """
+    category = re.sub(r'[^\w\s]', ' ', category.casefold())
+    return ' '.join(category.split())
+
+
+def merge_issues(records):
+    """
+    Merges records of the same version, language and normalized category, summing their counts.
+
+    The merged record keeps the category name and description of its largest contributor.
+
+    Args:
+        records (list): Issue records, see parse_issues.
+
+    Returns:
+        list: Merged records, sorted by count (descending) within each version/language.
+    """
+    merged = {}
+    best = {}
+    for record in records:
+        key = (record['version'], record['lang'], normalize_category(record['category']))
+        if key not in merged:
+            merged[key] = dict(record)
+            best[key] = record['count']
+            continue
+        merged[key]['count'] += record['count']
+        if record['count'] > best[key]:
+            best[key] = record['count']
+            merged[key]['category'] = record['category']
+            merged[key]['description'] = record['description']
+    return _sort_records(list(merged.values()))
+
+
+def _sort_records(records):
+    order = {}
+    for record in records:
+        order.setdefault((record['version'], record['lang']), len(order))
+    return sorted(records, key=lambda r: (order[(r['version'], r['lang'])], -r['count']))
+
+
+def _similar(a, b):
+    if a in b or b in a:
+        return True
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    if tokens_a and tokens_b and len(tokens_a & tokens_b) / len(tokens_a | tokens_b) >= TOKEN_JACCARD:
+        return True
+    return SequenceMatcher(None, a, b).ratio() >= SIMILARITY_RATIO
+
+
+def similar_categories(a, b):
+    """
+    Returns whether two category names probably name the same issue: equal once normalized, one containing
+    the other, or with similar words or characters (see TOKEN_JACCARD and SIMILARITY_RATIO).
+
+    Example:
+        similar_categories('Game Crashes', 'game crash')  # True
+    """
+    return _similar(normalize_category(a), normalize_category(b))
+
+
+def group_fuzzy_duplicates(records):
+    """
+    Splits merged records into clusters of similar categories and records without any similar category.
+
+    Only categories of the same version and language are compared.
+
+    Args:
+        records (list): Records already merged with merge_issues.
+
+    Returns:
+        tuple: (clusters, distinct) where clusters is a list of record lists (each of 2+ similar records)
+            that still need a semantic merge, and distinct is the list of remaining records.
+    """
+    parent = list(range(len(records)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    names = [normalize_category(r['category']) for r in records]
+    for i in range(len(records)):
+        for j in range(i + 1, len(records)):
+            same_group = (records[i]['version'], records[i]['lang']) == (records[j]['version'], records[j]['lang'])
+            if same_group and find(i) != find(j) and _similar(names[i], names[j]):
+                parent[find(j)] = find(i)
+
+    clusters = {}
+    for i, record in enumerate(records):
+        clusters.setdefault(find(i), []).append(record)
+    fuzzy = [cluster for cluster in clusters.values() if len(cluster) > 1]
+    distinct = [cluster[0] for cluster in clusters.values() if len(cluster) == 1]
+    return fuzzy, distinct
+
+
+def total_count(records):
+    """Returns the sum of the counts of records."""
+    return sum(record['count'] for record in records)
+
+
+def format_issues(records):
+    """
+    Formats issue records back to the XML-like format of the analyze/merge prompts.
+
+    Records with a version are grouped in <version='x' lang='y'> tags, others in <issues lang='y'> tags.
+
+    Args:
+        records (list): Issue records.
+
+    Returns:
+        str: XML-like text.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault((record['version'], record['lang']), []).append(record)
+    parts = []
+    for (version, lang), group in groups.items():
+        lang_attr = f" lang='{lang}'" if lang is not None else ''
+        if version is not None:
+            parts.append(f"<version='{version}'{lang_attr}>")
+        else:
+            parts.append(f"<issues{lang_attr}>")
+        for record in group:
+            parts.append(
+                f"<issue>\n<category>{record['category']}</category>\n<count>{record['count']}</count>\n"
+                f"<description>{record['description']}</description>\n</issue>"
+            )
+        parts.append('</version>' if version is not None else '</issues>')
+    return '\n'.join(parts)
@@ -0,0 +1,220 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils.llm_cache import DEFAULT_CACHE_DIR
+
+# Number of jobs running at once in the process, across all users; more jobs wait in the queue
+DEFAULT_MAX_JOBS = 4
+# Finished jobs and their results are purged from the table after this many seconds
+DEFAULT_RETENTION = 24 * 3600
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+_current_job = threading.local()
+
+
+def _process_alive(pid):
+    if pid is None:
+        return False
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows: only this process is known to be alive
+        return pid == os.getpid()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def report_progress(message):
+    """
+    Records a progress message of the job running on this thread, if any.
+
+    Example:
+        def analyze(df, bedrock_chat):
+            jobs.report_progress('Analyzing reviews...')
+            ...
+    """
+    runner, job_id = getattr(_current_job, 'job', (None, None))
+    if runner is not None:
+        runner.set_progress(job_id, message)
+
+
+class JobRunner:
+    """
+    Runs long analyses in background threads and keeps their state in a SQLite job table.
+
+    Jobs keep running across Streamlit reruns, the page only polls their state (see get/list_jobs) and reads
+    the result once the job is done. Results are pickled into the table. Each job records the pid of the
+    process running it: on startup, jobs left queued or running by a previous run of this process, or by a
+    process that is gone, are marked failed, while the jobs of other live processes sharing the table are
+    left alone. Finished jobs are purged retention seconds after they finished (see purge).
+
+    Example:
+        runner = JobRunner('/tmp/jobs.sqlite')
+        job_id = runner.submit(session_id, 'Analyze versions', review_analyzer.analyze_data, df, bedrock_chat)
+        runner.get(job_id)['status']  # 'queued', 'running', 'done', 'failed' or 'cancelled'
+        runner.result(job_id)
+    """
+
+    def __init__(self, path, max_jobs=DEFAULT_MAX_JOBS, retention=DEFAULT_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_jobs)), thread_name_prefix='job')
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, owner TEXT, label TEXT, status TEXT NOT NULL, progress TEXT, '
+                'created_at REAL NOT NULL, started_at REAL, finished_at REAL, result BLOB, error TEXT, pid INTEGER)'
+            )
+            # Tables created before jobs recorded their process
+            if 'pid' not in [row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')]:
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN pid INTEGER')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, created_at)')
+            # A new runner has no jobs yet: unfinished jobs of this pid are from a previous run of the process
+            unfinished = self._conn.execute('SELECT id, pid FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING))
+            orphans = [job_id for job_id, pid in unfinished.fetchall() if pid == os.getpid() or not _process_alive(pid)]
+            self._conn.executemany(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)',
+                [(FAILED, 'Interrupted: the app was restarted', time.time(), job_id, QUEUED, RUNNING)
+                 for job_id in orphans],
+            )
+            self._conn.commit()
+        self.purge()
+
+    def _update(self, job_id, **fields):
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock:
+            self._conn.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+            self._conn.commit()
+
+    def submit(self, owner, label, fn, *args, **kwargs):
+        """
+        Queues fn(*args, **kwargs) as a background job.
+
+        Args:
+            owner (str): Who submitted the job, e.g. the Streamlit session id; see list_jobs.
+            label (str): Description shown to the user.
+            fn (function): The job. Its return value must be picklable.
+
+        Returns:
+            str: The job id.
+        """
+        self.purge()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, owner, label, status, created_at, pid) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, owner, label, QUEUED, time.time(), os.getpid()),
+            )
+            self._conn.commit()
+            self._futures[job_id] = self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=RUNNING, started_at=time.time())
+        _current_job.job = (self, job_id)
+        try:
+            result = fn(*args, **kwargs)
+            self._update(job_id, status=DONE, finished_at=time.time(), result=pickle.dumps(result))
+        except Exception:
+            self._update(job_id, status=FAILED, finished_at=time.time(), error=traceback.format_exc())
+        finally:
+            _current_job.job = (None, None)
+            with self._lock:
+                self._futures.pop(job_id, None)
+
+    def set_progress(self, job_id, message):
+        """Records the latest progress message of a job."""
+        self._update(job_id, progress=str(message))
+
+    def cancel(self, job_id):
+        """Cancels a job that has not started yet. Returns whether it was cancelled."""
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None or not future.cancel():
+            return False
+        self._update(job_id, status=CANCELLED, finished_at=time.time())
+        with self._lock:
+            self._futures.pop(job_id, None)
+        return True
+
+    def _rows(self, where, params):
+        with self._lock:
+            cursor = self._conn.execute(
+                'SELECT id, owner, label, status, progress, created_at, started_at, finished_at, error '
+                f'FROM jobs WHERE {where} ORDER BY created_at', params,
+            )
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def get(self, job_id):
+        """Returns the state of a job (without its result), or None."""
+        rows = self._rows('id = ?', (job_id,))
+        return rows[0] if rows else None
+
+    def list_jobs(self, owner):
+        """Returns the state of every job of an owner, oldest first."""
+        return self._rows('owner = ?', (owner,))
+
+    def result(self, job_id):
+        """Returns the result of a finished job, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT result FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return pickle.loads(row[0]) if row and row[0] is not None else None
+
+    def delete(self, job_id):
+        """Removes a finished job from the table."""
+        with self._lock:
+            self._conn.execute('DELETE FROM jobs WHERE id = ? AND status IN (?, ?, ?)', (job_id, *FINISHED))
+            self._conn.commit()
+
+    def purge(self, max_age=None):
+        """
+        Removes the jobs that finished more than max_age seconds ago, with their results.
+
+        Args:
+            max_age (float, optional): Age in seconds, the runner's retention if None.
+
+        Returns:
+            int: Number of jobs removed.
+        """
+        max_age = self.retention if max_age is None else max_age
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?',
+                                        (*FINISHED, time.time() - max_age))
+            self._conn.commit()
+        return cursor.rowcount
+
+
+_default_runner = None
+_default_runner_lock = threading.Lock()
+
+
+def get_default_runner():
+    """
+    Returns the process-wide job runner.
+
+    Returns:
+        JobRunner: Runner with its job table in REVIEW_ANALYZER_CACHE_DIR/jobs.sqlite.
+    """
+    global _default_runner
+    with _default_runner_lock:
+        if _default_runner is None:
+            cache_dir = os.environ.get('REVIEW_ANALYZER_CACHE_DIR', DEFAULT_CACHE_DIR)
+            _default_runner = JobRunner(os.path.join(cache_dir, 'jobs.sqlite'))
+    return _default_runner
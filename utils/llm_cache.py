@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Cache location, override with REVIEW_ANALYZER_CACHE_DIR. Set REVIEW_ANALYZER_LLM_CACHE=0 to disable.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'playstore-review-analysis')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 30
+
+# Run eviction every N writes instead of on every write
+EVICT_EVERY = 100
+
+
+def make_key(template, rendered, model_id, temperature=None, top_p=None, max_tokens=None):
+    """
+    Builds the content-addressed cache key of an LLM call.
+
+    Args:
+        template (str): The prompt template.
+        rendered (str): The prompt rendered with its inputs (batch data, versions, ...).
+        model_id (str): Bedrock model id.
+        temperature (float, optional): Sampling temperature.
+        top_p (float, optional): Nucleus sampling parameter.
+        max_tokens (int, optional): Maximum output tokens.
+
+    Returns:
+        str: sha256 hex digest.
+    """
+    payload = json.dumps(
+        [template, rendered, model_id, temperature, top_p, max_tokens],
+        ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent LLM response cache stored in SQLite.
+
+    Entries are evicted when older than max_age_days, then least recently used first
+    while the stored responses exceed max_bytes. Safe to use from the batch executor's threads.
+
+    Example:
+        cache = LLMCache('/tmp/llm_cache.sqlite')
+        key = make_key(template, rendered, 'anthropic.claude-3-haiku-20240307-v1:0', 0.0, None, 4096)
+        if (result := cache.get(key)) is None:
+            result = call_model()
+            cache.set(key, result)
+        cache.stats()  # {'hits': 0, 'misses': 1, 'entries': 1, 'bytes': 1234}
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)')
+            self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """Returns the cached response of key, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_days * 86400:
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        """Stores the response of key."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value.encode('utf-8')), now, now),
+            )
+            self._conn.commit()
+            self._writes += 1
+            evict = self._writes % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Removes expired entries, then least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            self._conn.execute('DELETE FROM responses WHERE created_at < ?',
+                               (time.time() - self.max_age_days * 86400,))
+            total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall()
+                stale = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self._conn.executemany('DELETE FROM responses WHERE key = ?', stale)
+            self._conn.commit()
+
+    def clear(self):
+        """Removes every entry and resets the counters."""
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Returns hit/miss counters of this process and the number and size of stored entries."""
+        with self._lock:
+            entries, size = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+            ).fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    Returns the process-wide LLM response cache, or None if disabled with REVIEW_ANALYZER_LLM_CACHE=0.
+
+    Returns:
+        LLMCache: Cache stored in REVIEW_ANALYZER_CACHE_DIR (default ~/.cache/playstore-review-analysis).
+    """
+    global _default_cache
+    if os.environ.get('REVIEW_ANALYZER_LLM_CACHE', '1') == '0':
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            cache_dir = os.environ.get('REVIEW_ANALYZER_CACHE_DIR', DEFAULT_CACHE_DIR)
+            _default_cache = LLMCache(os.path.join(cache_dir, 'llm_cache.sqlite'))
+    return _default_cache
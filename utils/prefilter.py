@@ -0,0 +1,139 @@
+import pandas as pd
+from utils.batching import CJK_PATTERN
+from utils.dedup import TEXT_COLUMNS, normalize_text
+
+# Reasons a review is skipped before the analysis, in order of precedence
+SKIP_REASONS = ('empty', 'emoji_only', 'too_short', 'language_mismatch')
+SKIP_REASON_LABELS = {
+    'empty': 'empty',
+    'emoji_only': 'emoji or punctuation only',
+    'too_short': 'too short',
+    'language_mismatch': 'not in the reviewer language',
+}
+
+# Reviews with fewer normalized characters are too short to describe an issue ("ok", "no").
+# CJK characters count 3 times, as they carry about as much as a Latin token, see batching.
+MIN_TEXT_LENGTH = 3
+
+# Script expected in the reviews of a reviewer language (by its primary subtag)
+CYRILLIC, ARABIC, DEVANAGARI = '[\u0400-\u04ff]', '[\u0600-\u06ff]', '[\u0900-\u097f]'
+LANGUAGE_SCRIPTS = {
+    'ja': '[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff]',
+    'zh': '[\u3400-\u4dbf\u4e00-\u9fff]',
+    'ko': '[\u1100-\u11ff\uac00-\ud7af]',
+    'ru': CYRILLIC, 'uk': CYRILLIC, 'be': CYRILLIC, 'bg': CYRILLIC, 'kk': CYRILLIC, 'mk': CYRILLIC,
+    'ar': ARABIC, 'fa': ARABIC, 'ur': ARABIC,
+    'he': '[\u0590-\u05ff]', 'iw': '[\u0590-\u05ff]',
+    'el': '[\u0370-\u03ff]',
+    'th': '[\u0e00-\u0e7f]',
+    'hi': DEVANAGARI, 'mr': DEVANAGARI, 'ne': DEVANAGARI,
+}
+LATIN_PATTERN = '[A-Za-z\u00c0-\u024f]'
+LATIN_LANGUAGES = {'en', 'fr', 'de', 'es', 'it', 'pt', 'nl', 'pl', 'tr', 'vi', 'id', 'in', 'ms', 'sv', 'da', 'no',
+                   'nb', 'fi', 'cs', 'sk', 'ro', 'hu', 'hr', 'sl', 'et', 'lv', 'lt', 'ca', 'fil', 'tl'}
+
+
+def _review_text(df):
+    columns = [column for column in TEXT_COLUMNS if column in df.columns]
+    text = df[columns[0]].astype('string').fillna('')
+    for column in columns[1:]:
+        text = text + ' ' + df[column].astype('string').fillna('')
+    return text.str.strip()
+
+
+def _language_mismatch(text, languages):
+    # Texts with letters, but none of the script of the reviewer language. Unknown languages never mismatch.
+    mismatch = pd.Series(False, index=text.index)
+    primary = languages.astype('string').fillna('').str.lower().str.split(r'[-_]', regex=True).str[0]
+    for language in primary.unique():
+        pattern = LANGUAGE_SCRIPTS.get(language, LATIN_PATTERN if language in LATIN_LANGUAGES else None)
+        if pattern is None:
+            continue
+        rows = primary == language
+        mismatch[rows] = ~text[rows].str.contains(pattern, regex=True)
+    return mismatch
+
+
+def classify_reviews(df, min_length=MIN_TEXT_LENGTH):
+    """
+    Returns why each review would be skipped, vectorized.
+
+    Reasons (see SKIP_REASONS), the first that applies:
+        empty: No title and no text, e.g. star-only ratings.
+        emoji_only: No letters or digits, e.g. "😡😡" or "!!!".
+        too_short: Fewer than min_length normalized characters (CJK characters count 3 times).
+        language_mismatch: Letters, but none in the script of the 'Reviewer Language' (when known),
+            e.g. Latin-only text from a 'ja' reviewer.
+
+    Args:
+        df (pandas.DataFrame): Review data with 'Review Title' and/or 'Review Text' columns.
+        min_length (int, optional): Minimum normalized length of a review.
+
+    Returns:
+        pandas.Series: The reason of each skipped review, <NA> for reviews kept, same index as df.
+    """
+    reasons = pd.Series(pd.NA, index=df.index, dtype='string')
+    if df.empty or not any(column in df.columns for column in TEXT_COLUMNS):
+        return reasons
+    text = _review_text(df)
+    normalized = normalize_text(text)
+    length = normalized.str.len() + 2 * normalized.str.count(CJK_PATTERN)
+    checks = [
+        ('empty', text == ''),
+        ('emoji_only', normalized == ''),
+        ('too_short', length < min_length),
+    ]
+    if 'Reviewer Language' in df.columns:
+        checks.append(('language_mismatch', _language_mismatch(normalized, df['Reviewer Language'])))
+    # Later checks only apply to reviews not skipped yet, so each review has one reason
+    for reason, skip in reversed(checks):
+        reasons[skip.to_numpy(dtype=bool)] = reason
+    return reasons
+
+
+def filter_reviews(df, by=None, min_length=MIN_TEXT_LENGTH):
+    """
+    Drops reviews without meaningful content before batching, and counts them per group and reason.
+
+    Args:
+        df (pandas.DataFrame): Review data.
+        by (str or list, optional): Columns the analysis groups by, e.g. 'App Version Code' or
+            ['Reviewer Language', 'App Version Code']. None for one group (key None).
+        min_length (int, optional): Minimum normalized length of a review, see classify_reviews.
+
+    Returns:
+        tuple: (kept reviews, df itself if none was skipped,
+                dict of group key -> {reason: count} with every reason of SKIP_REASONS, for groups with skipped reviews)
+
+    Example:
+        kept, skipped = filter_reviews(df, by='App Version Code')
+        skipped  # {'1.0': {'empty': 12, 'emoji_only': 3, 'too_short': 5, 'language_mismatch': 0}}
+    """
+    reasons = classify_reviews(df, min_length)
+    skip = reasons.notna().to_numpy()
+    if not skip.any():
+        return df, {}
+    skipped = {}
+    if by is None:
+        groups = [(None, reasons[skip])]
+    else:
+        keys = df.loc[skip, by] if isinstance(by, str) else [df.loc[skip, column] for column in by]
+        groups = reasons[skip].groupby(keys, sort=False, observed=True, dropna=False)
+    for key, group_reasons in groups:
+        counts = group_reasons.value_counts()
+        skipped[key] = {reason: int(counts.get(reason, 0)) for reason in SKIP_REASONS}
+    return df[~skip], skipped
+
+
+def describe_skipped(counts):
+    """
+    Describes the skipped reviews of a group for reports.
+
+    Example:
+        describe_skipped({'empty': 12, 'emoji_only': 3, 'too_short': 0, 'language_mismatch': 0})
+        # '15 (empty: 12, emoji or punctuation only: 3)'
+    """
+    counts = counts or {}
+    details = ', '.join(f'{SKIP_REASON_LABELS[reason]}: {counts[reason]}' for reason in SKIP_REASONS if counts.get(reason))
+    total = sum(counts.values())
+    return f'{total} ({details})' if total else '0'
@@ -0,0 +1,180 @@
+import contextvars
+import json
+import logging
+from contextlib import contextmanager
+
+try:
+    import streamlit as st
+except ImportError:  # headless installs (CLI, benchmarks), only StreamlitReporter needs it
+    st = None
+
+_current_reporter = contextvars.ContextVar('progress_reporter', default=None)
+
+
+def format_event(name, fields):
+    """
+    Returns the one-line description of an event shown to users, or None for events that are not shown.
+
+    Example:
+        format_event('batch_finished', {'group': 'dataset version 1.0', 'batch': 2, 'batches': 5, 'rows': 120,
+                                        'latency': 3.2, ...})
+        # '- Batch 2/5 of dataset version 1.0 analyzed: 120 reviews in 3.2s'
+    """
+    if name == 'batch_finished':
+        return (f"- Batch {fields['batch']}/{fields['batches']} of {fields['group']} analyzed: "
+                f"{fields.get('reviews', fields['rows'])} reviews in {fields['latency']:.1f}s")
+    return None
+
+
+class ProgressReporter:
+    """
+    Receives the progress of an analysis (see utils.review_analyzer). This base class ignores it.
+
+    Methods:
+        start(message): A stage of the analysis starts, e.g. 'Start splitting data...'.
+        step(message): Intermediate progress, e.g. a group starts merging.
+        done(message): A stage or group completed.
+        report(title, markdown): A finished report (analysis or comparison).
+        event(name, **fields): A structured event, see below.
+
+    Events:
+        batch_started: group, batch (1-based), batches, rows, reviews (rows and the duplicates collapsed into
+            them, see utils.dedup), tokens (estimated input tokens).
+        batch_finished: the fields of batch_started, output_tokens (estimated) and latency (seconds from
+            submission to result, including rate-limit waits).
+
+    Row and token counts come from the Document metadata computed when the data is split, so reporting
+    never re-scans batch text.
+    """
+
+    def start(self, message):
+        pass
+
+    def step(self, message):
+        pass
+
+    def done(self, message):
+        pass
+
+    def report(self, title, markdown):
+        pass
+
+    def event(self, name, **fields):
+        pass
+
+
+class NullReporter(ProgressReporter):
+    """Discards all progress, e.g. for benchmarks."""
+
+
+class StreamlitReporter(ProgressReporter):
+    """Writes progress to the current Streamlit page, the default reporter."""
+
+    def start(self, message):
+        st.markdown(f'**{message}**')
+
+    def step(self, message):
+        st.caption(message)
+
+    def done(self, message):
+        st.success(message, icon="✅")
+
+    def report(self, title, markdown):
+        st.divider()
+        st.success(title, icon="✅")
+        st.markdown(markdown)
+        st.divider()
+
+    def event(self, name, **fields):
+        message = format_event(name, fields)
+        if message is not None:
+            st.caption(message)
+
+
+class LoggingReporter(ProgressReporter):
+    """
+    Logs progress as one JSON object per message, for headless runs.
+
+    Example:
+        LoggingReporter(logging.getLogger('review_analyzer'), input='reviews_202401.csv')
+        # INFO {"input": "reviews_202401.csv", "event": "done", "message": "Analysis of dataset version 1.0 completed"}
+    """
+
+    def __init__(self, logger=None, **fields):
+        self.logger = logger or logging.getLogger(__name__)
+        self.fields = fields
+
+    def _log(self, event, message, **fields):
+        self.logger.info(json.dumps({**self.fields, 'event': event, 'message': message, **fields}, ensure_ascii=False))
+
+    def start(self, message):
+        self._log('start', message)
+
+    def step(self, message):
+        self._log('step', message)
+
+    def done(self, message):
+        self._log('done', message)
+
+    def report(self, title, markdown):
+        self._log('report', title, length=len(markdown))
+
+    def event(self, name, **fields):
+        self.logger.info(json.dumps({**self.fields, 'event': name, **fields}, ensure_ascii=False, default=str))
+
+
+class CallbackReporter(ProgressReporter):
+    """
+    Passes every progress message to a function, e.g. jobs.report_progress to show it on a background job.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def start(self, message):
+        self.callback(message)
+
+    def step(self, message):
+        self.callback(message)
+
+    def done(self, message):
+        self.callback(message)
+
+    def report(self, title, markdown):
+        self.callback(title)
+
+    def event(self, name, **fields):
+        message = format_event(name, fields)
+        if message is not None:
+            self.callback(message)
+
+
+def get_reporter():
+    """
+    Returns the reporter of the current context (see use_reporter).
+
+    Defaults to a StreamlitReporter, or a NullReporter when Streamlit is not installed.
+    """
+    reporter = _current_reporter.get()
+    if reporter is not None:
+        return reporter
+    return StreamlitReporter() if st is not None else NullReporter()
+
+
+@contextmanager
+def use_reporter(reporter):
+    """
+    Sends the progress of analyses run in this block to reporter.
+
+    The reporter is set for the current thread (context) only, so concurrent runs each keep their own.
+
+    Example:
+        with progress.use_reporter(progress.LoggingReporter(input=path)):
+            review_analyzer.analyze_data(df, bedrock_chat)
+    """
+    token = _current_reporter.set(reporter)
+    try:
+        yield reporter
+    finally:
+        _current_reporter.reset(token)
+
@@ -1,19 +1,50 @@
 from langchain.prompts import PromptTemplate
-from langchain.schema.output_parser import StrOutputParser
-from langchain_text_splitters import CharacterTextSplitter
-import streamlit as st
-
-
-def _split_df_to_docs(df, chunk_size=300000):
+from langchain.schema import Document
+from langchain_core.messages.ai import add_usage
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import argparse
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import time
+import numpy as np
+import pandas as pd
+from utils import (
+    bedrock, bedrock_wrapper, clustering, dedup, issue_diff, issue_store, issues, llm_cache, prefilter, progress,
+    review_exports, sampling, telemetry
+)
+from utils.batching import (
+    DEFAULT_INPUT_TOKEN_BUDGET, DEFAULT_ROW_ENCODER, encode_rows, estimate_tokens, estimate_tokens_series,
+    input_token_budget, pack_rows
+)
+
+# Maximum number of LLM calls in flight at once across all batches of a run
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Output tokens reserved in the tokens-per-minute budget when the model's max_tokens is unknown
+DEFAULT_MAX_OUTPUT_TOKENS = 4096
+
+
+def _split_df_to_docs(df, token_budget=DEFAULT_INPUT_TOKEN_BUDGET, encoder=DEFAULT_ROW_ENCODER):
     """
-    将DataFrame拆分为文本文档列表。
+    将DataFrame按token预算拆分为文本文档列表。
+
+    每行评论编码为紧凑的一行（默认TSV，不做列宽填充），估算token数（按文字体系校准的字符/token比例，
+    中日韩文字与拉丁文字约相差3倍），按顺序贪心装入批次直到填满token预算。
+    单条评论不会被拆分到两个批次，每个批次都包含列名表头。
 
     Args:
         df (pandas.DataFrame): 要拆分的pandas DataFrame
-        chunk_size (int, optional): 每个文档块的最大字符数，默认为300000
+        token_budget (int, optional): 每个文档块的最大输入token数，参见batching.input_token_budget
+        encoder (str, optional): 行编码方式，参见batching.ROW_ENCODERS，默认为'tsv'
 
     Returns:
-        list: 如果DataFrame为空，返回空列表，否则返回包含文本块的文档列表
+        list: 如果DataFrame为空，返回空列表，否则返回包含文本块的文档列表，
+            metadata中包含该批次的行数(rows)、代表的评论数(reviews, 合并重复评论后按Count列计算)和估算token数(tokens)
 
     Example:
         Input:
@@ -21,32 +52,161 @@ def _split_df_to_docs(df, chunk_size=300000):
                 'A': [1, 2, 3],
                 'B': ['a', 'b', 'c']
             })
-            chunk_size = 100
+            token_budget = 100
 
         Output:
-            [Document(page_content="A  B\n1  a\n2  b\n3  c")]
+            [Document(page_content="A\tB\n1\ta\n2\tb\n3\tc", metadata={'rows': 3, 'reviews': 3, 'tokens': 4})]
     """
     # Check if the DataFrame is empty
     if df.empty:
         return []  # Return an empty list if the DataFrame is empty
 
-    # 创建CharacterTextSplitter实例
-    text_splitter = CharacterTextSplitter(
-        separator="\n",  # 使用换行符作为分隔符
-        chunk_size=chunk_size,  # 设置每个块的最大大小
-        chunk_overlap=0,  # 块之间不重叠
-        length_function=len,  # 使用len()函数计算长度
-        is_separator_regex=False,  # 将分隔符视为普通字符串，而非正则表达式
-    )
+    # 将DataFrame编码为表头和每条评论一行
+    header, rows = encode_rows(df, encoder)
+
+    # 估算每行token数，按预算贪心装箱
+    token_counts = estimate_tokens_series(pd.Series(rows)).tolist()
+    header_tokens = estimate_tokens(header)
+    # 合并后的行代表Count条评论，参见dedup.collapse_duplicates
+    review_counts = df[dedup.COUNT_COLUMN].tolist() if dedup.COUNT_COLUMN in df.columns else [1] * len(rows)
+    docs = []
+    for start, end in pack_rows(token_counts, token_budget - header_tokens):
+        docs.append(Document(
+            page_content='\n'.join([header] + rows[start:end]),
+            metadata={'rows': end - start, 'reviews': int(sum(review_counts[start:end])),
+                      'tokens': header_tokens + sum(token_counts[start:end])},
+        ))
 
-    # 将DataFrame转换为字符串，不包含索引
-    df_string = df.to_string(index=False)
-    
-    # 使用text_splitter创建文档列表
-    docs = text_splitter.create_documents([df_string])
-    
     return docs
 
+def _model_params(bedrock_chat):
+    """
+    Returns (model_id, temperature, top_p, max_tokens) of a BedrockChat, or None if unknown.
+    """
+    model_id = getattr(bedrock_chat, 'model_id', None)
+    if not isinstance(model_id, str):
+        return None
+    model_kwargs = getattr(bedrock_chat, 'model_kwargs', None) or {}
+    return model_id, model_kwargs.get('temperature'), model_kwargs.get('top_p'), model_kwargs.get('max_tokens')
+
+def _scheduler(bedrock_chat):
+    """
+    Returns the shared rate-limit scheduler of the model and region of a BedrockChat, or None if unknown.
+    """
+    params = _model_params(bedrock_chat)
+    if params is None:
+        return None
+    region = getattr(bedrock_chat, 'region_name', None)
+    return bedrock.get_scheduler(region if isinstance(region, str) else None, params[0])
+
+def _chunk_text(content):
+    # Text of a streamed chunk: a string, or a list of content blocks of which the text blocks are the response
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get('type') == 'text':
+                parts.append(block.get('text', ''))
+        return ''.join(parts)
+    logging.warning('Unexpected response content type: %s', type(content))
+    return ''
+
+def _stream_chain(prompt, bedrock_chat, inputs, on_record=None):
+    """
+    Runs prompt | bedrock_chat and returns the streamed text.
+
+    Responses are looked up in, and stored to, the persistent LLM response cache (utils/llm_cache.py),
+    keyed on the prompt template, the rendered prompt and the model parameters. Model calls are admitted
+    by the rate-limit scheduler of the model and region (see bedrock.RateLimitScheduler), which also
+    retries throttled calls. A bedrock_wrapper.MultiRegionBedrockChat spreads calls across regions.
+    Every call is recorded in the run's metrics, if collected (see telemetry.collect).
+
+    Args:
+        prompt (PromptTemplate): The prompt template.
+        bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
+        inputs (dict): The prompt inputs.
+        on_record (function, optional): Called with each issue record of the response, parsed while it is
+            streamed (see issues.IssueStreamParser) and passed once the call succeeded, so a retried call
+            never passes a record twice. Runs on the calling (worker) thread.
+
+    Returns:
+        str: The model output.
+    """
+    started = time.monotonic()
+    cache = llm_cache.get_default_cache()
+    params = _model_params(bedrock_chat)
+    rendered = prompt.format(**inputs) if params is not None else None
+    model_id = params[0] if params is not None else None
+    key = None
+    if cache is not None and params is not None:
+        key = llm_cache.make_key(prompt.template, rendered, *params)
+        cached = cache.get(key)
+        if cached is not None:
+            if on_record is not None:
+                for record in issues.IssueStreamParser().feed(cached):
+                    on_record(record)
+            telemetry.record_call(model_id=model_id, input_tokens=estimate_tokens(rendered),
+                                  output_tokens=estimate_tokens(cached), tokens_estimated=True, ttft=0.0,
+                                  latency=time.monotonic() - started, retries=0, cached=True)
+            return cached
+
+    call = {'attempts': 0, 'ttft': None, 'usage': None, 'region': None}
+
+    def stream(chat):
+        # A call can fail after some chunks (transient error, dropped stream) and be retried by the scheduler or
+        # in another region: the records of an attempt are only passed on once it completed
+        call['attempts'] += 1
+        call['region'] = getattr(chat, 'region_name', None)
+        attempt_started = time.monotonic()
+        chain = prompt | chat
+        parser = issues.IssueStreamParser() if on_record is not None else None
+        result_list = []
+        records = []
+        usage = None
+        for chunk in chain.stream(inputs):
+            if call['ttft'] is None:
+                call['ttft'] = time.monotonic() - attempt_started
+            # Usage is only present if the chat model reports it while streaming
+            if getattr(chunk, 'usage_metadata', None):
+                usage = add_usage(usage, chunk.usage_metadata)
+            text = _chunk_text(chunk.content)
+            result_list.append(text)
+            if parser is not None:
+                records.extend(parser.feed(text))
+        call['usage'] = usage
+        for record in records:
+            on_record(record)
+        return ''.join(result_list)
+
+    if params is None:
+        result = stream(bedrock_chat)
+    else:
+        prompt_tokens = estimate_tokens(rendered)
+        budget = {
+            'estimated_tokens': prompt_tokens + (params[3] or DEFAULT_MAX_OUTPUT_TOKENS),
+            'count_tokens': lambda text: prompt_tokens + estimate_tokens(text),
+        }
+        if isinstance(bedrock_chat, bedrock_wrapper.MultiRegionBedrockChat):
+            # Picks a region per call, each region has its own scheduler
+            result = bedrock_chat.call(stream, **budget)
+        else:
+            result = _scheduler(bedrock_chat).call(stream, bedrock_chat, **budget)
+
+    usage = call['usage']
+    telemetry.record_call(
+        model_id=model_id, region=call['region'] if isinstance(call['region'], str) else None,
+        input_tokens=usage['input_tokens'] if usage else estimate_tokens(rendered or prompt.format(**inputs)),
+        output_tokens=usage['output_tokens'] if usage else estimate_tokens(result),
+        tokens_estimated=not usage, ttft=call['ttft'], latency=time.monotonic() - started,
+        retries=call['attempts'] - 1, cached=False,
+    )
+    if key is not None:
+        cache.set(key, result)
+    return result
+
 #region bedrock functions
 # _analyze_review, 分析所有review，按照version group by后分析
 # _merge_review, 将_analyze_review分析结果中同一version的结果，不同的批次合并
@@ -66,13 +226,13 @@ def _split_df_to_docs(df, chunk_size=300000):
 #endregion
 
 # Analyze reviews by language
-def _analyze_review_by_lang(content, bedrock_chat):
+def _analyze_review_by_lang(content, bedrock_chat, on_record=None):
     # Define analysis prompt template
     """
     定义用于分析评论的提示模板。
 
     输入参数:
-    - content (str): 包含评论数据的CSV格式字符串
+    - content (str): 包含评论数据的制表符分隔（TSV）格式字符串，首行为列名
     - bedrock_chat (function): 用于与Bedrock模型交互的函数
 
     返回值:
@@ -80,7 +240,7 @@ def _analyze_review_by_lang(content, bedrock_chat):
 
     示例:
     输入:
-        content = "App Version,Reviewer Language,Device,Review Date,Star Rating,Review Title,Review Text\n1.0,en,phone1,2023-01-01,2,Bad app,Crashes frequently"
+        content = "App Version Code\tReviewer Language\tDevice\tReview Date\tStar Rating\tReview Title\tReview Text\n1.0\ten\tphone1\t2023-01-01\t2\tBad app\tCrashes frequently"
         bedrock_chat = <function to interact with Bedrock model>
 
     输出:
@@ -115,11 +275,12 @@ def _analyze_review_by_lang(content, bedrock_chat):
 
         You are an AI assistant trained to identify and categorize user negative reviews.
         You're specialized in many languages.
-        You'll be provided with a batch of google play reviews in csv, the format is described in the <format> </format> tag.
+        You'll be provided with a batch of google play reviews as tab-separated values, the format is described in the <format> </format> tag.
         Your task is to identify and categorize customer negative reviews in <review></review> tag.
         You need to follow the instructions in <instructions></instructions> tag.
 
         <format>
+        - One review per line, columns separated by tabs. The first line is the header with the column names.
         - Column 1, App Version: version code of the app.
         - Column 2, Code Reviewer Language: Language code for the reviewer.
         - Column 3, Device: Codename for the reviewer's device.
@@ -127,6 +288,7 @@ def _analyze_review_by_lang(content, bedrock_chat):
         - Column 5, Star Rating: The star rating associated with the review, from 1 to 5.
         - Column 6, Review Title: The review title.
         - Column 7, Review Text: The review content.
+        - Count (last column, only present if duplicates were collapsed): The number of identical or near-identical reviews the row stands for.
         </format>
 
         <review> 
@@ -136,6 +298,7 @@ def _analyze_review_by_lang(content, bedrock_chat):
         <instructions>
         - review categories should be grouped by app version code and code reviewer language, using <version='xyz' lang='abc'> </version> tag
         - Identify and category negative reviews in the <category></category> tags, you can make categories on your own
+        - A row with a Count stands for Count reviews, add its Count (not 1) to the <count> of its category
         - Describe the issue in the <description></description> tag, explain why the player is dissatisfied
         - Your output must be a fully formatted xml file that intelligently contains the <version>, <issue>, <category>, <count>, <description> tags and no other tags.
         - You don't need to include the original review text
@@ -170,25 +333,16 @@ def _analyze_review_by_lang(content, bedrock_chat):
         input_variables=["document"]
     )
 
-    # Create analysis chain
-    insight_chain = analyze_prompt | bedrock_chat | StrOutputParser()
-    
-    # Stream process analysis results
-    result_list=[]
-    for chunk in insight_chain.stream({
-        "document": {content},
-    }):
-        result_list.append(chunk)
-        
-    return ''.join(result_list)
+    # Run analysis chain, served from the LLM response cache when possible
+    return _stream_chain(analyze_prompt, bedrock_chat, {"document": content}, on_record)
 
 
-def _analyze_review_by_lang_without_version(content, bedrock_chat):
+def _analyze_review_by_lang_without_version(content, bedrock_chat, on_record=None):
     """
     Analyzes review data without version information using a language model.
 
     Args:
-        content (str): A string containing review data in CSV format.
+        content (str): A string containing review data as tab-separated values, header first (see batching.encode_rows).
         bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
 
     Returns:
@@ -224,17 +378,19 @@ def _analyze_review_by_lang_without_version(content, bedrock_chat):
 
         You are an AI assistant trained to identify and categorize user negative reviews.
         You're specialized in many languages.
-        You'll be provided with a batch of google play reviews in csv, the format is described in the <format> </format> tag.
+        You'll be provided with a batch of google play reviews as tab-separated values, the format is described in the <format> </format> tag.
         Your task is to identify and categorize customer negative reviews in <review></review> tag.
         You need to follow the instructions in <instructions></instructions> tag.
         
         <format>
+        - One review per line, columns separated by tabs. The first line is the header with the column names.
         - Column 1, Code Reviewer Language: Language code for the reviewer.
         - Column 2, Device: Codename for the reviewer's device.
         - Column 3, Review Date: Date when the review was written.
         - Column 4, Star Rating: The star rating associated with the review, from 1 to 5.
         - Column 5, Review Title: The review title.
         - Column 6, Review Text: The review content.
+        - Count (last column, only present if duplicates were collapsed): The number of identical or near-identical reviews the row stands for.
         </format>
 
         <review> 
@@ -243,6 +399,7 @@ def _analyze_review_by_lang_without_version(content, bedrock_chat):
         
         <instructions>
         - Identify and category negative reviews in the <category></category> tags, you can make categories on your own
+        - A row with a Count stands for Count reviews, add its Count (not 1) to the <count> of its category
         - Describe the issue in the <description></description> tag, explain why the player is dissatisfied
         - Your output must be a fully formatted xml file that intelligently contains the <issues>, <issue>, <category>, <count>, <description> tags and no other tags.
         - You don't need to include the original review text
@@ -273,19 +430,10 @@ def _analyze_review_by_lang_without_version(content, bedrock_chat):
         input_variables=["document"]
     )
 
-    # Create analysis chain
-    insight_chain = analyze_prompt | bedrock_chat | StrOutputParser()
-    
-    # Stream process analysis results
-    result_list=[]
-    for chunk in insight_chain.stream({
-        "document": {content},
-    }):
-        result_list.append(chunk)
-        
-    return ''.join(result_list)
+    # Run analysis chain, served from the LLM response cache when possible
+    return _stream_chain(analyze_prompt, bedrock_chat, {"document": content}, on_record)
 
-def _analyze_review(content, bedrock_chat):
+def _analyze_review(content, bedrock_chat, on_record=None):
     # Define analysis prompt template
     analyze_prompt = PromptTemplate(
         template="""
@@ -293,11 +441,12 @@ def _analyze_review(content, bedrock_chat):
 
         You are an AI assistant trained to identify and categorize user negative reviews.
         You're specialized in many languages.
-        You'll be provided with a batch of google play reviews in csv, the format is described in the <format> </format> tag.
+        You'll be provided with a batch of google play reviews as tab-separated values, the format is described in the <format> </format> tag.
         Your task is to identify and categorize customer negative reviews in <review></review> tag.
         You need to follow the instructions in <instructions></instructions> tag.
 
         <format>
+        - One review per line, columns separated by tabs. The first line is the header with the column names.
         - Column 1, App Version: version code of the app.
         - Column 2, Code Reviewer Language: Language code for the reviewer.
         - Column 3, Device: Codename for the reviewer's device.
@@ -305,6 +454,7 @@ def _analyze_review(content, bedrock_chat):
         - Column 5, Star Rating: The star rating associated with the review, from 1 to 5.
         - Column 6, Review Title: The review title.
         - Column 7, Review Text: The review content.
+        - Count (last column, only present if duplicates were collapsed): The number of identical or near-identical reviews the row stands for.
         </format>
 
         <review> 
@@ -314,6 +464,7 @@ def _analyze_review(content, bedrock_chat):
         <instructions>
         - review categories should be grouped by app version code, using <version='xyz'> </version> tag
         - Identify and category negative reviews in the <category></category> tags, you can make categories on your own
+        - A row with a Count stands for Count reviews, add its Count (not 1) to the <count> of its category
         - Describe the issue in the <description></description> tag, explain why the player is dissatisfied
         - Your output must be a fully formatted xml file that intelligently contains the <version>, <issue>, <category>, <count> tags and no other tags.
         - You don't need to include the original review text
@@ -348,25 +499,16 @@ def _analyze_review(content, bedrock_chat):
         input_variables=["document"]
     )
 
-    # Create analysis chain
-    insight_chain = analyze_prompt | bedrock_chat | StrOutputParser()
-    
-    # Stream process analysis results
-    result_list=[]
-    for chunk in insight_chain.stream({
-        "document": {content},
-    }):
-        result_list.append(chunk)
-        
-    return ''.join(result_list)
+    # Run analysis chain, served from the LLM response cache when possible
+    return _stream_chain(analyze_prompt, bedrock_chat, {"document": content}, on_record)
 
-def _analyze_review_without_version(content, bedrock_chat):
+def _analyze_review_without_version(content, bedrock_chat, on_record=None):
     # Define analysis prompt template for reviews without version information
     """
     Analyzes review data without version information using a language model.
 
     Args:
-        content (str): A string containing review data in CSV format.
+        content (str): A string containing review data as tab-separated values, header first (see batching.encode_rows).
         bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
 
     Returns:
@@ -396,17 +538,19 @@ def _analyze_review_without_version(content, bedrock_chat):
 
         You are an AI assistant trained to identify and categorize user negative reviews.
         You're specialized in many languages.
-        You'll be provided with a batch of google play reviews in csv, the format is described in the <format> </format> tag.
+        You'll be provided with a batch of google play reviews as tab-separated values, the format is described in the <format> </format> tag.
         Your task is to identify and categorize customer negative reviews in <review></review> tag.
         You need to follow the instructions in <instructions></instructions> tag.
 
         <format>
+        - One review per line, columns separated by tabs. The first line is the header with the column names.
         - Column 1, Code Reviewer Language: Language code for the reviewer.
         - Column 2, Device: Codename for the reviewer's device.
         - Column 3, Review Date: Date when the review was written.
         - Column 4, Star Rating: The star rating associated with the review, from 1 to 5.
         - Column 5, Review Title: The review title.
         - Column 6, Review Text: The review content.
+        - Count (last column, only present if duplicates were collapsed): The number of identical or near-identical reviews the row stands for.
         </format>
 
         <review> 
@@ -415,6 +559,7 @@ def _analyze_review_without_version(content, bedrock_chat):
 
         <instructions>
         - Identify and category negative reviews in the <category></category> tags, you can make categories on your own
+        - A row with a Count stands for Count reviews, add its Count (not 1) to the <count> of its category
         - Describe the issue in the <description></description> tag, explain why the player is dissatisfied
         - Your output must be a fully formatted xml file that intelligently contains the <issues>, <issue>, <category>, <count> tags and no other tags.
         - You don't need to include the original review text
@@ -437,24 +582,65 @@ def _analyze_review_without_version(content, bedrock_chat):
         input_variables=["document"]
     )
 
-    # Create analysis chain
-    insight_chain = analyze_prompt | bedrock_chat | StrOutputParser()
-    
-    # Stream process analysis results
-    result_list=[]
-    for chunk in insight_chain.stream({
-        "document": {content},
-    }):
-        result_list.append(chunk)
-        
-    return ''.join(result_list)
+    # Run analysis chain, served from the LLM response cache when possible
+    return _stream_chain(analyze_prompt, bedrock_chat, {"document": content}, on_record)
 
-def _analyze_review_without_version_by_lang(content, bedrock_chat):
+def _analyze_review_without_version_by_lang(content, bedrock_chat, on_record=None):
     pass
 
+# Name a cluster of similar reviews found locally, see _init_clusters
+def _name_review_cluster(content, bedrock_chat, on_record=None):
+    # The first line of content is "<cluster version='1.0' lang='en' reviews='120'>": the count of the issue is
+    # the exact size of the cluster, only its representative reviews (the other lines) are sent to the model
+    header, document = content.split('\n', 1)
+    attrs = dict(re.findall(r"(\w+)='([^']*)'", header))
+    name_prompt = PromptTemplate(
+        template="""
+        \n\nHuman: 
+
+        You are an AI assistant trained to identify and categorize user negative reviews.
+        You're specialized in many languages.
+        You'll be provided with the most representative google play reviews of a cluster of similar reviews as tab-separated values in <review></review> tag: one review per line, columns separated by tabs, the first line is the header.
+        The columns are the same as in the analysis of a batch of reviews: app version, reviewer language, device, review date, star rating, review title, review text.
+        Your task is to name the one issue these reviews share.
+        You need to follow the instructions in <instructions></instructions> tag.
+
+        <review>
+        {document}
+        </review>
+
+        <instructions>
+        - Name the issue shared by most of the reviews in the <category></category> tag, in English, in a few words
+        - Describe the issue in the <description></description> tag, explain why the player is dissatisfied
+        - Your output must contain exactly one <issue> tag with the <category> and <description> tags and no other tags.
+        - You don't need to include the original review text
+        </instructions>
+
+        \n\nAssistant:
+        <issue>
+        <category> issue category</category>
+        <description>why player is dissatisfied for this issue category</description>
+        </issue>
+        """,
+        input_variables=["document"]
+    )
+
+    output = _stream_chain(name_prompt, bedrock_chat, {"document": document})
+    named = issues.parse_issues(output)
+    record = {
+        'version': attrs.get('version'),
+        'lang': attrs.get('lang'),
+        'category': named[0]['category'].strip() if named and named[0]['category'].strip() else 'Other',
+        'count': int(attrs['reviews']),
+        'description': named[0]['description'].strip() if named else '',
+    }
+    if on_record is not None:
+        on_record(record)
+    return issues.format_issues([record])
+
 
 # Merge review analysis results classified by language
-def _merge_review_by_lang(content, bedrock_chat):
+def _merge_review_by_lang(content, bedrock_chat, on_record=None):
     # Define merge prompt template
     merge_prompt = PromptTemplate(
     template="""
@@ -499,18 +685,10 @@ def _merge_review_by_lang(content, bedrock_chat):
         input_variables=["reviews"]
     )
 
-    # Create merge chain
-    merge_chain = merge_prompt | bedrock_chat | StrOutputParser()
-    # Stream process merge results
-    result_list=[]
-    for chunk in merge_chain.stream({
-        "reviews": {content},
-    }):
-        result_list.append(chunk)
-        
-    return ''.join(result_list)
+    # Run merge chain, served from the LLM response cache when possible
+    return _stream_chain(merge_prompt, bedrock_chat, {"reviews": content}, on_record)
 
-def _merge_review_without_version_by_lang(content, bedrock_chat):
+def _merge_review_without_version_by_lang(content, bedrock_chat, on_record=None):
     merge_prompt = PromptTemplate(
     template="""
         You are an AI assistant. 
@@ -542,19 +720,11 @@ def _merge_review_without_version_by_lang(content, bedrock_chat):
         input_variables=["reviews"]
     )
 
-    # Create merge chain
-    merge_chain = merge_prompt | bedrock_chat | StrOutputParser()
-    # Stream process merge results
-    result_list=[]
-    for chunk in merge_chain.stream({
-        "reviews": {content},
-    }):
-        result_list.append(chunk)
-        
-    return ''.join(result_list)
+    # Run merge chain, served from the LLM response cache when possible
+    return _stream_chain(merge_prompt, bedrock_chat, {"reviews": content}, on_record)
 
 # Merge review analysis results (not classified by language)
-def _merge_review(content, bedrock_chat):
+def _merge_review(content, bedrock_chat, on_record=None):
     # Define merge prompt template
     merge_prompt = PromptTemplate(
     template="""
@@ -599,19 +769,11 @@ def _merge_review(content, bedrock_chat):
         input_variables=["reviews"]
     )
 
-    # Create merge chain
-    merge_chain = merge_prompt | bedrock_chat | StrOutputParser()
-    # Stream process merge results
-    result_list=[]
-    for chunk in merge_chain.stream({
-        "reviews": {content},
-    }):
-        result_list.append(chunk)
-        
-    return ''.join(result_list)
+    # Run merge chain, served from the LLM response cache when possible
+    return _stream_chain(merge_prompt, bedrock_chat, {"reviews": content}, on_record)
 
 
-def _merge_review_without_version(content, bedrock_chat):
+def _merge_review_without_version(content, bedrock_chat, on_record=None):
     merge_prompt = PromptTemplate(
     template="""
         You are an AI assistant. 
@@ -643,20 +805,13 @@ def _merge_review_without_version(content, bedrock_chat):
         input_variables=["reviews"]
     )
 
-    # Create merge chain
-    merge_chain = merge_prompt | bedrock_chat | StrOutputParser()
-    # Stream process merge results
-    result_list=[]
-    for chunk in merge_chain.stream({
-        "reviews": {content},
-    }):
-        result_list.append(chunk)
-        
-    return ''.join(result_list)
+    # Run merge chain, served from the LLM response cache when possible
+    return _stream_chain(merge_prompt, bedrock_chat, {"reviews": content}, on_record)
 
 # Generate analysis report
-def _write_analysis_report(content, bedrock):
-    # Define report generation prompt template
+def _write_analysis_report(content, bedrock, skipped=None):
+    # Define report generation prompt template.
+    # skipped: counts of the group's reviews dropped before the analysis, see prefilter.filter_reviews
     writing_prompt = PromptTemplate(
     template="""
         You're an AI assistant who's proficient in multiple languages and good at writing.
@@ -665,143 +820,146 @@ def _write_analysis_report(content, bedrock):
 
         <content> {reviews} </content>
 
+        <skipped> {skipped} </skipped>
+
         <instructions>
         - The analysis must be in markdown format, you can use bold, but you must not use heading.
         - The analysis must be in Simplified Chinese, you must not use Traditional Chinese.
         - The analysis must contain three sections: Summary, Key Issues Analysis and Conclusion.
         - You must calculate the total number of counts by adding up the counts of each issue, and you must include this total number of counts in the Summary, outputting as: "Total number of comments with non-empty and meaningful content is xx".
+        - The <skipped></skipped> tag is the number of comments without meaningful content that were removed before the analysis, with the reasons. You must copy it into the Summary as given, outputting as: "Skipped comments without meaningful content: zz". You must not add them to the total or the percentages.
         - For each issue, you must analysis it in bullet format, and you must include what the count of the Issue is, what the percentage of the Issue count is to the total of all Issue counts, outputting as: "Count:xxx, Percentage: yy.yy%".
         - For each issue analysis, you must explain in detail why and what the player is dissatisfied with in a new line.
         </instructions>
 
         \n\nAssistant:
         """,
-        input_variables=["reviews"]
+        input_variables=["reviews", "skipped"]
     )
 
-    # Create report generation chain
-    writing_chain = writing_prompt | bedrock | StrOutputParser()
-    # Stream process report generation results
-    result_list = []
-    for chunk in writing_chain.stream({
-        "reviews": {content},
-    }):
-        if isinstance(chunk, str):
-            result_list.append(chunk)
-        else:
-            # Handle non-string responses, e.g., log a warning or skip
-            logging.warning(f"Unexpected response type: {type(chunk)}")
-
-    return ''.join(result_list)
+    # Run report generation chain, served from the LLM response cache when possible
+    return _stream_chain(writing_prompt, bedrock, {"reviews": content, "skipped": prefilter.describe_skipped(skipped)})
 
 # Compare analysis results classified by language
-def _compare_analysis_result_by_lang(target_data, baseline_data, target_version_no, lang, bedrock):
+def _compare_analysis_result_by_lang(diff, baseline_versions, target_version_no, lang, bedrock):
     # Define comparison prompt template
     compare_prompt = PromptTemplate(
     template="""
         You are an AI assistant who's proficient in multiple languages.
-        You'll be provided with the analysis of a game app review issues of target version in xml format in <target></target> tag,
-        and will be provided with several other version's analysis as baseline in xml format in <baseline></baseline> tag.
-        Your task is to analyze the review issues, compare the target version  review issues with the baseline version's, find out what new problems have arisen in the target version, 
-        find out what problems have become worse in the target version. 
+        You'll be provided with the comparison of the review issues of a game app's target version with baseline versions {baseline_versions},
+        computed from the issue counts of every version, as a markdown table in <diff></diff> tag.
+        Your task is to explain what new problems have arisen in the target version, what problems have become worse,
+        and what problems have improved or disappeared.
         You need to follow the instructions in <instructions></instructions> tags.
-        
-        <target> {target_data} </target>
-        <baseline> {baseline_data} </baseline>
+
+        <diff> {diff} </diff>
 
         <instructions>
+        - Columns of the table: Issue; Status: new (in no baseline version), worse or better (share of the issue significantly higher or lower than in the baselines), disappeared (only in the baselines), unchanged; Target: count of the issue and its share of the target version's issues; Baselines: count and share of the issue in all baselines together, and the range of its share across baseline versions; Δ share: change of the share in percentage points; p-value: two-proportion z-test.
         - You must output a full analysis report in markdown format in Simplified Chinese, you must not use Traditional Chinese.
-        - Your report must be in markdown format, you can use bold, but you must not use heading.
+        - Your report must be in markdown format, you can use bold, but you must not use heading or table.
         - Your report must not include any xml tag.
-        - You must explain your ideas in detail and provide data to support them.
+        - You must explain your ideas in detail and support them with the numbers of the table, you must not compute other numbers.
         - Your report must include a detailed description about the new found problem(s).
         - Your report must include a detailed description about the problem(s) that have become more serious.
-        - <baseline></baseline> tag may contain more than one version of the review issue analysis, you must analyze each version of the review issue analysis
+        - You must not describe unchanged issues one by one.
         - The report header must include target_version_number and lang, in the format of: **Comparative Report for Version {target_version_no}, Language Code {lang}**
         </instructions>
 
         \n\nAssistant:
         """,
-        input_variables=["target_data","baseline_data", "target_version_no", "lang"]
+        input_variables=["diff", "baseline_versions", "target_version_no", "lang"]
     )
 
-    # Create comparison chain
-    compare_chain = compare_prompt | bedrock | StrOutputParser()
-    
-    # Stream process comparison results
-    compare_list=[]
-    for chunk in compare_chain.stream({
-            "target_data": target_data,
-            "baseline_data": baseline_data,
-            "target_version_no": target_version_no,
-            "lang": lang
-        }):
-        compare_list.append(chunk)
-
-    return ''.join(compare_list)
+    # Run comparison chain, served from the LLM response cache when possible
+    return _stream_chain(compare_prompt, bedrock, {
+        "diff": diff,
+        "baseline_versions": baseline_versions,
+        "target_version_no": target_version_no,
+        "lang": lang
+    })
 
 # Compare analysis results (not classified by language)
-def _compare_analysis_result(target_data, baseline_data, target_version_no, bedrock):
+def _compare_analysis_result(diff, baseline_versions, target_version_no, bedrock):
     # Define comparison prompt template
     compare_prompt = PromptTemplate(
     template="""
         You are an AI assistant who's proficient in multiple languages.
-        You'll be provided with the analysis of a game app review issues of target version in xml format in <target></target> tag,
-        and will be provided with several other version's analysis as baseline in xml format in <baseline></baseline> tag.
-        Your task is to analyze the review issues, compare the target version  review issues with the baseline version's, find out what new problems have arisen in the target version, 
-        find out what problems have become worse in the target version. 
+        You'll be provided with the comparison of the review issues of a game app's target version with baseline versions {baseline_versions},
+        computed from the issue counts of every version, as a markdown table in <diff></diff> tag.
+        Your task is to explain what new problems have arisen in the target version, what problems have become worse,
+        and what problems have improved or disappeared.
         You need to follow the instructions in <instructions></instructions> tags.
-        
-        <target> {target_data} </target>
-        <baseline> {baseline_data} </baseline>
+
+        <diff> {diff} </diff>
 
         <instructions>
+        - Columns of the table: Issue; Status: new (in no baseline version), worse or better (share of the issue significantly higher or lower than in the baselines), disappeared (only in the baselines), unchanged; Target: count of the issue and its share of the target version's issues; Baselines: count and share of the issue in all baselines together, and the range of its share across baseline versions; Δ share: change of the share in percentage points; p-value: two-proportion z-test.
         - You must output a full analysis report in markdown format in Simplified Chinese, you must not use Traditional Chinese.
-        - Your report must be in markdown format, you can use bold, but you must not use heading.
+        - Your report must be in markdown format, you can use bold, but you must not use heading or table.
         - Your report must not include any xml tag.
-        - You must explain your ideas in detail and provide data to support them.
+        - You must explain your ideas in detail and support them with the numbers of the table, you must not compute other numbers.
         - Your report must include a detailed description about the new found problem(s).
         - Your report must include a detailed description about the problem(s) that have become more serious.
-        - <baseline></baseline> tag may contain more than one version of the review issue analysis, you must analyze each version of the review issue analysis
-        - The report header must include target_version_number and lang, in the format of: **Comparative Report for Version {target_version_no}**
+        - You must not describe unchanged issues one by one.
+        - The report header must include target_version_number, in the format of: **Comparative Report for Version {target_version_no}**
         </instructions>
 
         \n\nAssistant:
         """,
-        input_variables=["target_data","baseline_data", "target_version_no"]
+        input_variables=["diff", "baseline_versions", "target_version_no"]
     )
 
-    # Create comparison chain
-    compare_chain = compare_prompt | bedrock | StrOutputParser()
-    
-    # Stream process comparison results
-    compare_list=[]
-    for chunk in compare_chain.stream({
-            "target_data": target_data,
-            "baseline_data": baseline_data,
-            "target_version_no": target_version_no
-        }):
-        compare_list.append(chunk)
+    # Run comparison chain, served from the LLM response cache when possible
+    return _stream_chain(compare_prompt, bedrock, {
+        "diff": diff,
+        "baseline_versions": baseline_versions,
+        "target_version_no": target_version_no
+    })
+
+def _result_issues(result):
+    # Issue records of an analysis result; results without them (e.g. stored by older runs) are parsed
+    return result['issues'] if 'issues' in result else issues.parse_issues(result['xmldata'])
 
-    return ''.join(compare_list)
+def _compare_versions(versions, target_version_no, compare_fn, bedrock_chat, *args):
+    """
+    Compares the issues of the target version with the baseline versions locally (see issue_diff.diff_versions),
+    and has the model narrate the diff, whose size does not depend on the number of versions or issues.
+
+    Args:
+        versions (dict): Version -> analysis result, target included.
+        target_version_no (str): The target version.
+        compare_fn (function): _compare_analysis_result or _compare_analysis_result_by_lang.
+        bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
+        args: Further arguments of compare_fn (the language).
+
+    Returns:
+        str: The narration followed by the diff table, in markdown format.
+    """
+    diff = issue_diff.diff_versions({version: _result_issues(result) for version, result in versions.items()},
+                                    target_version_no)
+    table = issue_diff.format_diff(diff)
+    baseline_versions = ', '.join(str(version) for version in versions if str(version) != str(target_version_no))
+    narration = compare_fn(table, baseline_versions, target_version_no, *args, bedrock_chat)
+    return f'{narration}\n\n{table}'
 
 # Initialize data classified by language
-def _init_data_by_lang(data):
+def _init_data_by_lang(data, token_budget=DEFAULT_INPUT_TOKEN_BUDGET):
     """
     Initializes and preprocesses the review data for analysis, classified by language and app version.
 
     Args:
         data (pandas.DataFrame): A DataFrame containing review information.
             Expected columns: 'Reviewer Language', 'App Version Code', and other review-related columns.
+        token_budget (int, optional): Maximum input tokens of review data per batch.
 
-    Returns:
-        dict: A nested dictionary where the first level keys are language codes, 
-              the second level keys are app version codes, 
-              and values are lists of document chunks.
+    Yields:
+        tuple: ((language code, app version code), list of document chunks), lazily, one per
+            non-empty (language, version) group in order of first appearance.
             Each chunk is a manageable subset of the review data for that language and version.
 
     Note:
-        This function uses Streamlit (st) to display progress messages during execution.
+        Progress messages go to the current progress reporter (see utils.progress.use_reporter).
 
     Example:
         Input:
@@ -811,40 +969,34 @@ def _init_data_by_lang(data):
                 'Review Text': ['Good app', 'Pas mal', 'Great update', 'Très bien']
             })
 
-        Output:
+        Output (as a dict):
             {
-                'en': {
-                    '1.0': [Document(page_content="Reviewer Language App Version Code Review Text\nen 1.0 Good app")],
-                    '2.0': [Document(page_content="Reviewer Language App Version Code Review Text\nen 2.0 Great update")]
-                },
-                'fr': {
-                    '1.0': [Document(page_content="Reviewer Language App Version Code Review Text\nfr 1.0 Pas mal")],
-                    '2.0': [Document(page_content="Reviewer Language App Version Code Review Text\nfr 2.0 Très bien")]
-                }
+                ('en', '1.0'): [Document(page_content="Reviewer Language\tApp Version Code\tReview Text\nen\t1.0\tGood app")],
+                ('fr', '1.0'): [Document(page_content="Reviewer Language\tApp Version Code\tReview Text\nfr\t1.0\tPas mal")],
+                ('en', '2.0'): [Document(page_content="Reviewer Language\tApp Version Code\tReview Text\nen\t2.0\tGreat update")],
+                ('fr', '2.0'): [Document(page_content="Reviewer Language\tApp Version Code\tReview Text\nfr\t2.0\tTrès bien")]
             }
     """
-    st.markdown('''**Start splitting data...**''')
-    raw = {}
-    for lang in data['Reviewer Language'].unique():
-        raw[lang] = {}
-        for version in data['App Version Code'].unique():
-            target_data = data[(data['Reviewer Language'] == lang) & (data['App Version Code'] == version)]
-            docs = _split_df_to_docs(target_data)
-            raw[lang][version] = docs
-            st.success(f"Data split: language {lang}, version:{version}, total {len(docs)} batches", icon="✅")
-    return raw
+    progress.get_reporter().start('Start splitting data...')
+    if data.empty:
+        return
+    for (lang, version), target_data in data.groupby(['Reviewer Language', 'App Version Code'], sort=False, observed=True, dropna=False):
+        docs = _split_df_to_docs(dedup.collapse_duplicates(target_data), token_budget)
+        progress.get_reporter().done(f"Data split: language {lang}, version:{version}, total {len(docs)} batches")
+        yield (lang, version), docs
 
 
-def _init_data_by_lang_without_version(data):
+def _init_data_by_lang_without_version(data, token_budget=DEFAULT_INPUT_TOKEN_BUDGET):
     """
     Initializes and preprocesses the review data for analysis, classified by language.
 
     Args:
         data (pandas.DataFrame): A DataFrame containing review information.
             Expected columns: 'Reviewer Language', and other review-related columns.
+        token_budget (int, optional): Maximum input tokens of review data per batch.
 
-    Returns:
-        dict: A dictionary where keys are language codes and values are lists of document chunks.
+    Yields:
+        tuple: (language code, list of document chunks), lazily, one per language in order of first appearance.
             Each chunk is a manageable subset of the review data for that language.
 
     Example:
@@ -854,38 +1006,37 @@ def _init_data_by_lang_without_version(data):
                 'Review Text': ['Good app', 'Pas mal', 'Great update', 'Très bien']
             })
 
-        Output:
+        Output (as a dict):
             {
-                'en': [Document(page_content="Reviewer Language Review Text\nen Good app\nen Great update")],
-                'fr': [Document(page_content="Reviewer Language Review Text\nfr Pas mal\nfr Très bien")]
+                'en': [Document(page_content="Reviewer Language\tReview Text\nen\tGood app\nen\tGreat update")],
+                'fr': [Document(page_content="Reviewer Language\tReview Text\nfr\tPas mal\nfr\tTrès bien")]
             }
     """
-    st.markdown('''**Start splitting data...**''')
-    raw = {}
-    for lang in data['Reviewer Language'].unique():
-        raw[lang] = {}
-        target_data = data[data['Reviewer Language'] == lang]
-        docs = _split_df_to_docs(target_data)
-        raw[lang] = docs
-        st.success(f"Data split: language {lang}, total {len(docs)} batches", icon="✅")
-    return raw
+    progress.get_reporter().start('Start splitting data...')
+    if data.empty:
+        return
+    for lang, target_data in data.groupby('Reviewer Language', sort=False, observed=True, dropna=False):
+        docs = _split_df_to_docs(dedup.collapse_duplicates(target_data), token_budget)
+        progress.get_reporter().done(f"Data split: language {lang}, total {len(docs)} batches")
+        yield lang, docs
 
 
 
-def _init_data(data):
+def _init_data(data, token_budget=DEFAULT_INPUT_TOKEN_BUDGET):
     """
     Initializes and preprocesses the review data for analysis.
 
     Args:
         data (pandas.DataFrame): A DataFrame containing review information.
             Expected columns: 'App Version Code', and other review-related columns.
+        token_budget (int, optional): Maximum input tokens of review data per batch.
 
-    Returns:
-        dict: A dictionary where keys are app version codes and values are lists of document chunks.
+    Yields:
+        tuple: (app version code, list of document chunks), lazily, one per version in order of first appearance.
             Each chunk is a manageable subset of the review data for that version.
 
     Note:
-        This function uses Streamlit (st) to display progress messages during execution.
+        Progress messages go to the current progress reporter (see utils.progress.use_reporter).
 
     Example input data:
     data = pd.DataFrame({
@@ -898,49 +1049,42 @@ def _init_data(data):
         'Review Text': ['Works well', 'Pas mal mais peut mieux faire', 'Love the new features', 'Trop de bugs']
     })
 
-    Example output of raw:
-    raw = {
+    Example output, as a dict:
+    dict(_init_data(data)) = {
         '1.0': [Document(page_content="App Version Code Reviewer Language Device Review Date Star Rating Review Title Review Text\n1.0 en phone1 2023-01-01 4 Good app Works well\n1.0 fr phone2 2023-01-02 3 Moyenne Pas mal mais peut mieux faire")],
         '2.0': [Document(page_content="App Version Code Reviewer Language Device Review Date Star Rating Review Title Review Text\n2.0 en tablet1 2023-01-03 5 Great update Love the new features\n2.0 fr tablet2 2023-01-04 2 Besoin d'amélioration Trop de bugs")]
     }
     """
 
     # Display a message indicating the start of data splitting process
-    st.markdown('''**Start splitting data...**''')
-    
-    # Initialize an empty dictionary to store processed data
-    raw = {}
-    
-    # Iterate through unique app version codes in the data
-    if not data.empty:
-        for version in data['App Version Code'].unique():
-            # Filter data for the current version
-            target_data = data[data['App Version Code'] == version]
-            
-            # Split the filtered data into manageable chunks
-            docs = _split_df_to_docs(target_data)
-            
-            # Store the split data in the raw dictionary, keyed by version
-            raw[version] = docs
-            
-            # Display a success message with details about the split data
-            st.success(f"Data split completed: version:{version} total {len(target_data)} items, split into {len(docs)} batches for processing", icon="✅")
-        
-    # Return the processed data dictionary
-    return raw
+    progress.get_reporter().start('Start splitting data...')
+    if data.empty:
+        return
+
+    # Partition in a single pass, only non-empty versions are produced
+    for version, target_data in data.groupby('App Version Code', sort=False, observed=True, dropna=False):
+        # Identical and near-identical reviews are sent once with their Count, then split into manageable chunks
+        docs = _split_df_to_docs(dedup.collapse_duplicates(target_data), token_budget)
 
-def _init_data_without_version(data):
+        # Display a success message with details about the split data
+        progress.get_reporter().done(f"Data split completed: version:{version} total {len(target_data)} items, split into {len(docs)} batches for processing")
+
+        # Hand the group to the caller right away so its LLM calls can start while the next group is split
+        yield version, docs
+
+def _init_data_without_version(data, token_budget=DEFAULT_INPUT_TOKEN_BUDGET):
     """
     Initializes and preprocesses the review data for analysis without version information.
 
     Args:
         data (pandas.DataFrame): A DataFrame containing review information.
+        token_budget (int, optional): Maximum input tokens of review data per batch.
     
     Returns:
         list: A list of document chunks, where each chunk is a manageable subset of the review data.
 
     Note:
-        This function uses Streamlit (st) to display progress messages during execution.
+        Progress messages go to the current progress reporter (see utils.progress.use_reporter).
 
     Example input:
         data = pd.DataFrame({
@@ -954,16 +1098,506 @@ def _init_data_without_version(data):
             Document(page_content="en Love it 4\nde Bug in latest version 3")
         ]
     """
-    st.markdown('''**Start splitting data...**''')
+    progress.get_reporter().start('Start splitting data...')
     raw=[]
     if not data.empty:
-        raw = _split_df_to_docs(data)
-    st.success(f"Data split: total {len(raw)} batches",icon="✅")   
+        raw = _split_df_to_docs(dedup.collapse_duplicates(data), token_budget)
+    progress.get_reporter().done(f"Data split: total {len(raw)} batches")   
     return raw
     
+def _init_clusters(data, by, n_clusters=None):
+    """
+    Clusters the review data of each group locally instead of splitting it into batches, see clustering.cluster_reviews.
+
+    Args:
+        data (pandas.DataFrame): A DataFrame containing review information.
+        by (str or list): Grouping columns, 'App Version Code' or ['Reviewer Language', 'App Version Code'].
+        n_clusters (int, optional): Clusters per group, clustering.default_clusters of its reviews if None.
+
+    Yields:
+        tuple: (group key, list of documents), lazily, one per non-empty group in order of first appearance.
+            One document per cluster, for _name_review_cluster: a "<cluster version='1.0' lang='en' reviews='120'>"
+            line with the exact size of the cluster, then its representative reviews.
+
+    Note:
+        Progress messages go to the current progress reporter (see utils.progress.use_reporter).
+    """
+    progress.get_reporter().start('Start clustering data...')
+    if data.empty:
+        return
+    for key, target_data in data.groupby(by, sort=False, observed=True, dropna=False):
+        attrs = dict(zip(['lang', 'version'], key)) if isinstance(by, list) else {'version': key}
+        docs = []
+        # Duplicates are clustered once, with their Count as weight
+        for size, samples in clustering.cluster_reviews(dedup.collapse_duplicates(target_data), n_clusters):
+            header = ' '.join(f"{name}='{value}'" for name, value in attrs.items())
+            doc = _split_df_to_docs(samples.drop(columns=dedup.COUNT_COLUMN, errors='ignore'))[0]
+            doc.page_content = f"<cluster {header} reviews='{size}'>\n{doc.page_content}"
+            doc.metadata['reviews'] = size
+            docs.append(doc)
+        progress.get_reporter().done(f"Data clustered: {', '.join(f'{name} {value}' for name, value in attrs.items())}, "
+                                     f"total {len(target_data)} items, {len(docs)} clusters")
+        yield key, docs
+
+
+class _BatchRunner:
+    """
+    Runs LLM tasks on a bounded thread pool and yields results as they complete.
+
+    Tasks are taken lazily from an iterable, only when a worker is free, so a generator that is still
+    splitting data keeps feeding the pool while the first calls are in flight. Follow-up tasks submitted
+    while results are being consumed (merges, reports) run before tasks not yet taken from the iterable,
+    so later stages of a group start as soon as its data is ready. Results, follow-up submissions and the
+    task generator itself run on the calling thread, so progress reported there goes to the caller's
+    reporter (worker threads have no Streamlit script context). Tasks run in a copy of the caller's
+    context, so their calls are recorded in the caller's run metrics.
+
+    Example:
+        runner = _BatchRunner(max_concurrency=8)
+        for key, result in runner.run(tasks):
+            runner.submit(('merge', key), _merge_review, result, bedrock_chat)
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        self._running = {}
+        self._followups = deque()
+
+    def submit(self, key, fn, *args):
+        """Queues fn(*args); its (key, result) is yielded by the running run() loop."""
+        self._followups.append((key, fn, args))
+
+    def _next_task(self, tasks):
+        if self._followups:
+            return self._followups.popleft()
+        return next(tasks, None)
+
+    def run(self, tasks=()):
+        """
+        Runs tasks and every follow-up task submitted meanwhile.
+
+        Args:
+            tasks (iterable): (key, fn, args) tuples. fn(*args) is run on a worker thread.
+
+        Yields:
+            tuple: (key, result) for each task, in completion order.
+        """
+        tasks = iter(tasks)
+        try:
+            while True:
+                while len(self._running) < self.max_concurrency:
+                    task = self._next_task(tasks)
+                    if task is None:
+                        break
+                    key, fn, args = task
+                    # In a copy of this context, so calls are recorded in the run's metrics (see telemetry.collect)
+                    self._running[self._executor.submit(contextvars.copy_context().run, fn, *args)] = key
+                if not self._running:
+                    return
+                done, _ = wait(list(self._running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._running.pop(future), future.result()
+        finally:
+            # Drop queued calls if a task failed or the consumer stopped early
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+def _run_batches(tasks, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Runs LLM tasks on a bounded thread pool and yields results as they complete, see _BatchRunner.
+
+    Args:
+        tasks (iterable): (key, fn, args) tuples. fn(*args) is run on a worker thread.
+        max_concurrency (int, optional): Maximum number of tasks in flight at once.
+
+    Yields:
+        tuple: (key, result) for each task, in completion order.
+
+    Example:
+        tasks = [(('1.0', 0), _analyze_review, (content, bedrock_chat))]
+        for key, result in _run_batches(tasks, max_concurrency=8):
+            ...
+    """
+    yield from _BatchRunner(max_concurrency).run(tasks)
+
+def _merge_fan_in(partials, token_budget):
+    """
+    Groups consecutive partial results for one level of the merge tree.
+
+    The fan-in k of each merge call is chosen from the token budget: partials are packed greedily until
+    the budget is full. If no two partials fit together, they are merged pairwise so the tree still shrinks.
+
+    Returns:
+        list: (start, end) index ranges into partials, one per merge call (ranges of length 1 are carried over).
+    """
+    token_counts = estimate_tokens_series(pd.Series(partials)).tolist()
+    ranges = pack_rows(token_counts, token_budget)
+    if len(partials) > 1 and len(ranges) == len(partials):
+        ranges = [(i, min(i + 2, len(partials))) for i in range(0, len(partials), 2)]
+    return ranges
+
+def _combine_merged(merged_text, distinct, fuzzy):
+    """
+    Combines the model's merge of similar categories with the records that were merged locally.
+
+    The model's output is only trusted if its counts add up to the counts it was given; otherwise the
+    similar categories are kept unmerged so totals stay exact.
+
+    Returns:
+        list: Merged issue records.
+    """
+    merged = issues.parse_issues(merged_text)
+    if not merged or issues.total_count(merged) != issues.total_count(fuzzy):
+        logging.warning("Merge output dropped: counts don't add up to the merged categories")
+        merged = fuzzy
+    groups = {(record['version'], record['lang']) for record in fuzzy}
+    if len(groups) == 1:
+        version, lang = groups.pop()
+        for record in merged:
+            record['version'] = record['version'] or version
+            record['lang'] = record['lang'] or lang
+    return issues.merge_issues(distinct + merged)
+
+class _GroupPipeline:
+    """
+    Analyze -> merge -> report pipeline of every group of a run, driven by the results of a _BatchRunner.
+
+    Each group moves to its next stage as soon as its own calls finish, while other groups are still being
+    analyzed: issue records are parsed from the stream as each </issue> closes, merged locally (exact
+    category matches get their counts summed), and only clusters of similar categories go through a k-ary
+    merge tree of model calls. Unparseable output falls back to merging the raw partial results.
+
+    Results are kept per group as {'xmldata': merged XML, 'issues': merged records, 'report': markdown}.
+    Groups with a previous result (incremental runs) fold their new records into it. Counts of sampled groups
+    are scaled back to all their reviews before the report, which ends with their confidence intervals.
+    """
+
+    def __init__(self, runner, merge_fn, bedrock_chat, describe, merge_single=False,
+                 token_budget=DEFAULT_INPUT_TOKEN_BUDGET, report_fn=None, skipped=None, previous=None, designs=None):
+        self.runner = runner
+        self.merge_fn = merge_fn
+        self.bedrock_chat = bedrock_chat
+        self.describe = describe
+        self.merge_single = merge_single
+        self.token_budget = token_budget
+        self.report_fn = report_fn
+        self.skipped = skipped
+        self.previous = previous or {}
+        self.designs = designs or {}
+        self.reporter = progress.get_reporter()
+        self.results = {}
+        self._partials = {}  # key -> batch results (analysis) or slots of the current merge level
+        self._records = {}   # key -> issue records streamed from each batch
+        self._pending = {}   # key -> calls of the current stage still in flight
+        self._level = {}     # key -> current merge tree level
+        self._local = {}     # key -> (records that need no model merge, similar records sent to the model)
+        self._batches = {}   # (key, batch) -> progress fields of batches in flight
+
+    def _labelled(self, fn, stage, key):
+        # Labels the task's calls in the run metrics, see telemetry.RunMetrics
+        return telemetry.with_labels(fn, stage=stage, group=self.describe(key))
+
+    def analysis_tasks(self, key, docs, analyze_fn):
+        """Registers a group and yields its batch analysis tasks."""
+        self.results[key] = {}
+        if self.skipped is not None:
+            self.results[key]['skipped'] = self.skipped.get(key, dict.fromkeys(prefilter.SKIP_REASONS, 0))
+            if key in self.previous:
+                previous = self.previous[key].get('skipped') or {}
+                self.results[key]['skipped'] = {reason: count + previous.get(reason, 0)
+                                                for reason, count in self.results[key]['skipped'].items()}
+        self._partials[key] = [None] * len(docs)
+        self._records[key] = [[] for _ in docs]
+        self._pending[key] = len(docs)
+        self.reporter.step(f'''Start analyzing {self.describe(key)}, total {len(docs)} batches''')
+        if not docs:
+            self._analyzed(key, [], [])
+        for i, doc in enumerate(docs):
+            # Pulled by the runner only when a worker is free, so the batch starts now
+            fields = {'group': self.describe(key), 'batch': i + 1, 'batches': len(docs),
+                      'rows': doc.metadata.get('rows'), 'reviews': doc.metadata.get('reviews', doc.metadata.get('rows')),
+                      'tokens': doc.metadata.get('tokens')}
+            self.reporter.event('batch_started', **fields)
+            self._batches[(key, i)] = (fields, time.monotonic())
+            yield (key, 'analyze', i), self._labelled(analyze_fn, 'analyze', key), \
+                (doc.page_content, self.bedrock_chat, self._records[key][i].append)
+
+    def _analyzed(self, key, partials, records):
+        # New records of an incremental run are merged with the group's previous result, see issue_store
+        previous = self.previous.get(key)
+        if previous is not None:
+            partials, records = partials + [previous['xmldata']], records + previous['issues']
+        self.start_merge(key, partials, records)
+
+    def start_merge(self, key, partials, records=None):
+        """Merges the batch results of a group locally, and submits model merges if still needed."""
+        self.results.setdefault(key, {})
+        if records is None:
+            records = issues.parse_issues(''.join(partials))
+        records = issues.merge_issues(records)
+        if records:
+            clusters, distinct = issues.group_fuzzy_duplicates(records)
+            if not clusters:
+                self.reporter.done(f"Merging {self.describe(key)} completed locally, {len(records)} categories")
+                self._finish(key, records)
+                return
+            self._local[key] = (distinct, [record for cluster in clusters for record in cluster])
+            self.reporter.step(f'''Start merging {self.describe(key)}, {len(clusters)} groups of similar categories''')
+            self._merge_level(key, [issues.format_issues(cluster) for cluster in clusters])
+        elif partials and (self.merge_single or len(partials) > 1):
+            self.reporter.step(f'''Start merging {self.describe(key)}, {len(partials)} partial results''')
+            self._merge_level(key, partials)
+        else:
+            self._finish(key, [], partials[0] if partials else '')
+
+    def _merge_level(self, key, partials):
+        self._level[key] = self._level.get(key, 0) + 1
+        ranges = _merge_fan_in(partials, self.token_budget)
+        self._partials[key] = [None] * len(ranges)
+        self._pending[key] = 0
+        for j, (start, end) in enumerate(ranges):
+            if end - start == 1 and len(partials) > 1:
+                self._partials[key][j] = partials[start]
+            else:
+                self._pending[key] += 1
+                self.runner.submit((key, 'merge', j), self._labelled(self.merge_fn, 'merge', key),
+                                   ''.join(partials[start:end]), self.bedrock_chat)
+
+    def _finish(self, key, records, xmldata=None):
+        design = self.designs.get(key)
+        if design is not None and records and design['sample'] < design['population']:
+            records, intervals = sampling.scale_issues(records, design)
+            self.results[key]['sampling'] = {**design, 'intervals': intervals}
+            xmldata = None
+        self.results[key]['issues'] = records
+        self.results[key]['xmldata'] = issues.format_issues(records) if xmldata is None else xmldata
+        if self.report_fn is not None:
+            self.reporter.step(f'''Start translating and writing report: {self.describe(key)}''')
+            # The skipped counts are given to the report, so the model does not have to infer them
+            skipped = (self.results[key]['skipped'],) if 'skipped' in self.results[key] else ()
+            self.runner.submit((key, 'report', 0), self._labelled(self.report_fn, 'report', key),
+                               self.results[key]['xmldata'], self.bedrock_chat, *skipped)
+
+    def handle(self, task, result):
+        """Stores the result of a finished task and starts the group's next stage when it is complete."""
+        key, stage, i = task
+        if stage == 'report':
+            if 'sampling' in self.results[key]:
+                result = f"{result}\n\n{sampling.format_estimates(self.results[key]['issues'], self.results[key]['sampling'])}"
+            self.results[key]['report'] = result
+            return
+        self._partials[key][i] = result
+        self._pending[key] -= 1
+        if stage == 'analyze':
+            fields, started = self._batches.pop((key, i))
+            self.reporter.event('batch_finished', **fields, output_tokens=estimate_tokens(result or ''),
+                                latency=time.monotonic() - started)
+        if self._pending[key] > 0:
+            return
+        partials = self._partials[key]
+        if stage == 'analyze':
+            self.reporter.done(f"Analysis of {self.describe(key)} completed")
+            self._analyzed(key, partials, [record for batch in self._records.pop(key) for record in batch])
+        elif len(partials) > 1:
+            self.reporter.step(f'''- Merge level {self._level[key]} of {self.describe(key)} completed, {len(partials)} partial results left''')
+            self._merge_level(key, partials)
+        else:
+            self.reporter.done(f"Merging {self.describe(key)} completed")
+            if key in self._local:
+                self._finish(key, _combine_merged(partials[0], *self._local.pop(key)))
+            else:
+                self._finish(key, issues.parse_issues(partials[0]), partials[0])
+
+def _prefilter(data, by=None):
+    """
+    Drops reviews without meaningful content before batching, see prefilter.filter_reviews.
+
+    Returns:
+        tuple: (kept reviews, group key -> {reason: count} of the skipped reviews)
+    """
+    data, skipped = prefilter.filter_reviews(data, by)
+    if skipped:
+        totals = {reason: sum(counts[reason] for counts in skipped.values()) for reason in prefilter.SKIP_REASONS}
+        progress.get_reporter().done(f"Skipped reviews without meaningful content: {prefilter.describe_skipped(totals)}")
+    return data, skipped
+
+def _sample(data, by, margin_of_error):
+    """
+    Draws a stratified sample of each group sized for margin_of_error, see sampling.stratified_sample.
+
+    Returns:
+        tuple: (sampled reviews, group key -> sample design), data itself and no design if margin_of_error is None
+    """
+    if margin_of_error is None:
+        return data, None
+    data, designs = sampling.stratified_sample(data, by, margin_of_error)
+    population = sum(design['population'] for design in designs.values())
+    progress.get_reporter().done(f"Sampled {len(data)} of {population} reviews, margin of error "
+                                 f"±{margin_of_error * 100:g}% at {sampling.DEFAULT_CONFIDENCE * 100:g}% confidence")
+    return data, designs
+
+def _store_scope(grouping, bedrock_chat, scope, cluster=False, margin_of_error=None):
+    # Results of another grouping, model, clustering or sample size are not shared
+    mode = ','.join([grouping] + (['clusters'] if cluster else []) +
+                    ([f'sample {margin_of_error}'] if margin_of_error is not None else []))
+    return issue_store.make_scope(mode, _model_params(bedrock_chat), scope)
+
+class _StoredGroups:
+    """
+    Results of the groups of a run stored across runs, see issue_store.IssueStore.
+
+    Incremental runs only analyze the reviews not analyzed in scope yet, and fold their issue records into the
+    stored result of their group (previous). Otherwise a group is only analyzed when no result of exactly its
+    reviews is stored (cached), e.g. only the new target version when another target is compared with the
+    same baseline versions.
+    """
+
+    def __init__(self, store, scope, by, incremental=True):
+        self.store = store
+        self.scope = scope
+        self.by = by
+        self.incremental = incremental
+        self.previous = {}  # group key -> stored result its new records are folded into (incremental)
+        self.cached = {}    # group key -> stored result of exactly its reviews (not incremental)
+        self._keys = {}     # group key -> keys of its new reviews (incremental) or signature of its reviews
+
+    def split(self, data):
+        """
+        Returns the reviews of data to analyze: the new reviews (incremental), or the reviews of the groups
+        without a cached result. data itself if every review is analyzed.
+        """
+        keys = issue_store.review_keys(data).to_numpy()
+        seen = self.store.seen(self.scope, keys) if self.incremental else np.zeros(len(keys), dtype=bool)
+        grouper = data[self.by].to_numpy() if isinstance(self.by, str) else [data[column].to_numpy() for column in self.by]
+        for key, group in pd.DataFrame({'key': keys, 'seen': seen}).groupby(grouper, sort=False, dropna=False):
+            if self.incremental:
+                self._keys[key] = group.loc[~group['seen'], 'key'].to_numpy()
+                stored = self.store.load(self.scope, key)
+                if stored is not None:
+                    self.previous[key] = stored
+            else:
+                self._keys[key] = issue_store.reviews_signature(group['key'].to_numpy())
+                stored = self.store.load(self.scope, (key, self._keys[key]))
+                if stored is not None:
+                    self.cached[key] = stored
+                    seen[group.index] = True
+        if self.incremental:
+            progress.get_reporter().done(f"Incremental analysis: {len(keys) - int(seen.sum())} new reviews, "
+                                         f"{int(seen.sum())} analyzed by previous runs")
+        elif self.cached:
+            progress.get_reporter().done(f"Reusing stored results: {', '.join(map(str, self.cached))}")
+        return data[~seen] if seen.any() else data
+
+    def save(self, results, skipped):
+        """
+        Stores the results of the run.
+
+        Args:
+            results (dict): Group key -> result of the groups analyzed, see _analyze_groups.
+            skipped (dict): Group key -> counts of reviews skipped before the analysis, see _prefilter.
+
+        Returns:
+            dict: Group key -> result of every group of the data, in order of first appearance. Groups with
+                only reviews without meaningful content (and no stored result) have none.
+        """
+        final = {}
+        for key, keys in self._keys.items():
+            if key in self.cached:
+                final[key] = self.cached[key]
+                continue
+            if key in results:
+                result = results[key]
+            elif key in self.previous:
+                # Every new review of the group was skipped, or it has none
+                result = dict(self.previous[key])
+                if key in skipped:
+                    result['skipped'] = {reason: count + (result.get('skipped') or {}).get(reason, 0)
+                                         for reason, count in skipped[key].items()}
+            else:
+                # Only reviews without meaningful content: not stored, so they are filtered again next time
+                continue
+            if not self.incremental:
+                self.store.save(self.scope, (key, keys), result)
+            elif len(keys):
+                self.store.save(self.scope, key, result, keys)
+            final[key] = result
+        return final
+
+def _analyze_groups(groups, analyze_fn, merge_fn, bedrock_chat, describe, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                    merge_single=False, token_budget=DEFAULT_INPUT_TOKEN_BUDGET, report_fn=None, skipped=None,
+                    previous=None, designs=None):
+    """
+    Analyzes every batch of every group concurrently, merges each group's batch results and writes its report.
+
+    Every group is pipelined independently (see _GroupPipeline): its merge starts as soon as its last batch
+    is analyzed and its report as soon as it is merged, while other groups are still being analyzed.
+
+    Args:
+        groups (iterable): (group key, list of document chunks) pairs, e.g. the lazy output of _init_data.
+            Group keys are versions, languages, (language, version) tuples, ...
+        analyze_fn (function): Batch analysis function, e.g. _analyze_review.
+        merge_fn (function): Merge function for the group, e.g. _merge_review.
+        bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
+        describe (function): Returns the progress label of a group key, e.g. 'dataset version 1.0'.
+        max_concurrency (int, optional): Maximum number of LLM calls in flight at once.
+        merge_single (bool, optional): Also merge groups that have a single batch.
+        token_budget (int, optional): Maximum input tokens per merge call.
+        report_fn (function, optional): Report function, e.g. _write_analysis_report. No report if None.
+        skipped (dict, optional): Group key -> counts of reviews skipped before the analysis, see _prefilter.
+            Passed to report_fn as its third argument.
+        previous (dict, optional): Group key -> stored result of the group (incremental runs). The new issue
+            records of a group are merged with its previous records, and its skipped counts are added.
+        designs (dict, optional): Group key -> sample design of the group, see _sample. Issue counts of
+            sampled groups are estimates for all their reviews.
+
+    Returns:
+        dict: Group key -> {'xmldata': merged XML result, 'issues': merged issue records,
+            'report': report in markdown format (only with report_fn),
+            'skipped': {reason: count} (only with skipped),
+            'sampling': sample design with the confidence 'intervals' of the issue counts (only sampled groups)},
+            in the order of groups.
+    """
+    runner = _BatchRunner(max_concurrency)
+    pipeline = _GroupPipeline(runner, merge_fn, bedrock_chat, describe, merge_single, token_budget, report_fn, skipped,
+                              previous, designs)
+
+    def tasks():
+        # Consumed by the runner on this thread: each group is submitted as soon as it is split
+        for key, docs in groups:
+            yield from pipeline.analysis_tasks(key, docs, analyze_fn)
+
+    for task, result in runner.run(tasks()):
+        pipeline.handle(task, result)
+    return pipeline.results
+
+def _merge_partials(partials, merge_fn, bedrock_chat, describe, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                    merge_single=False, token_budget=DEFAULT_INPUT_TOKEN_BUDGET):
+    """
+    Reduces the partial XML results of every group to one, see _GroupPipeline.
+
+    Args:
+        partials (dict): Group key -> list of partial XML results, in batch order.
+        merge_fn (function): Merge function for the group, e.g. _merge_review.
+        bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
+        describe (function): Returns the progress label of a group key.
+        max_concurrency (int, optional): Maximum number of LLM calls in flight at once.
+        merge_single (bool, optional): Also merge groups that have a single partial result.
+        token_budget (int, optional): Maximum input tokens per merge call.
+
+    Returns:
+        dict: Group key -> merged XML result, in the order of partials.
+    """
+    runner = _BatchRunner(max_concurrency)
+    pipeline = _GroupPipeline(runner, merge_fn, bedrock_chat, describe, merge_single, token_budget)
+    for key, results in partials.items():
+        pipeline.start_merge(key, results)
+    for task, result in runner.run():
+        pipeline.handle(task, result)
+    return {key: pipeline.results[key]['xmldata'] for key in partials}
+
 # Analyze data (main function)
-@st.cache_data
-def analyze_data(data, _bedrock_chat):
+def analyze_data(data, _bedrock_chat, max_concurrency=DEFAULT_MAX_CONCURRENCY, token_budget=DEFAULT_INPUT_TOKEN_BUDGET,
+                 store=None, scope=None, incremental=True, cluster=False, margin_of_error=None):
     """
     Analyzes review data using a language model provided by Amazon Bedrock.
 
@@ -971,15 +1605,36 @@ def analyze_data(data, _bedrock_chat):
         data (pandas.DataFrame): A DataFrame containing review information.
             Expected columns: 'App Version Code', 'Review Text', and other review-related columns.
         _bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
+        max_concurrency (int, optional): Maximum number of LLM calls in flight at once, across all versions.
+        token_budget (int, optional): Maximum input tokens of review data per batch.
+        store (issue_store.IssueStore, optional): Stores the result of each version across runs.
+            Incremental mode: only the reviews not analyzed by a previous run of the same scope are analyzed,
+            and their issues are folded into the stored result of their version. Versions without new reviews
+            are returned from the store, without any LLM call.
+        scope (optional): What else the stored results depend on (besides the model and the grouping),
+            e.g. {'app': package name, 'ratings': [1, 2]}.
+        incremental (bool, optional): With a store, False only reuses the stored result of a version whose
+            reviews are exactly those of data, and analyzes every other version in full.
+        cluster (bool, optional): Cluster the reviews of each version locally (see clustering.cluster_reviews)
+            instead of categorizing every review with the model: only representative reviews of each cluster
+            are sent, to name its issue, so there is about one call per cluster and counts are exact.
+        margin_of_error (float, optional): Only analyze a stratified sample of the reviews of each version
+            (by version, language, rating and day) sized so the share of an issue is within this margin at 95%
+            confidence, e.g. 0.05 for about 385 reviews per version however many it has. Counts are scaled back
+            to all reviews and the reports end with their confidence intervals. Not with incremental runs.
 
     Returns:
         dict: A dictionary where keys are app version codes and values are dictionaries containing:
             - "xmldata": The merged XML data from the analysis.
+            - "issues": The merged issue records (dicts with version, lang, category, count and description).
             - "report": The generated report in markdown format.
+            - "skipped": Reviews without meaningful content dropped before the analysis, by reason (see utils.prefilter).
+            - "sampling": With margin_of_error, the sample design of a sampled version and the confidence
+              intervals of its issue counts (see utils.sampling).
 
     Note:
-        This function uses Streamlit (st) to display progress messages and reports during execution.
-        It also uses st.cache_data for caching the results.
+        Progress messages and reports go to the current progress reporter (see utils.progress.use_reporter).
+        Repeated LLM calls are served from the LLM response cache (see utils.llm_cache).
 
     Example input:
         data = pd.DataFrame({
@@ -1003,52 +1658,47 @@ def analyze_data(data, _bedrock_chat):
         }
     """
     # Initialize data
-    raw = _init_data(data)
-    st.markdown('''**Start analyzing data...**''')
-    analyze_result = {}
-    
-    # Iterate through each version of data for analysis
-    for version in raw:
-        docs = raw[version]
-        analyze_result[version]={}
-        st.caption(f'''Start analyzing dataset version {version}, total {len(docs)} batches''')
-        
-        # Analyze data in batches
-        chunk_result= []
-        for i, doc in enumerate(docs, start=1):
-            st.caption(f'''- Analyzing batch {i}, {len(doc.page_content.split('\n'))} items...''')
-            chunk_result.append(_analyze_review(doc.page_content, _bedrock_chat))
-        st.success(f"Analysis of dataset version {version} completed", icon="✅")
-
-        # Merge analysis results
-        if len(docs) > 1:
-            st.caption(f'''Start merging dataset version {version}''')
-            analyze_result[version]["xmldata"]=_merge_review(''.join(chunk_result), _bedrock_chat)
-            st.success(f"Merging dataset version {version} completed",icon="✅")
-        else:
-            analyze_result[version]["xmldata"] = chunk_result[0]
-        
-        # Generate report
-        st.caption(f'''Start translating and writing report: version {version}''')
-        st.divider()
-        analyze_result[version]["report"] = _write_analysis_report(analyze_result[version]["xmldata"], _bedrock_chat)
-        st.success(f'''Report completed: version {version}''',icon="✅")
-        st.markdown(analyze_result[version]["report"])
-        st.divider()
+    if margin_of_error is not None and store is not None and incremental:
+        raise ValueError('Sampled analyses cannot be folded into stored results, use incremental=False')
+    stored = None
+    if store is not None:
+        scope = _store_scope('version', _bedrock_chat, scope, cluster, margin_of_error)
+        stored = _StoredGroups(store, scope, 'App Version Code', incremental)
+        data = stored.split(data)
+    data, skipped = _prefilter(data, 'App Version Code')
+    data, designs = _sample(data, 'App Version Code', margin_of_error)
+    if cluster:
+        raw, analyze_fn = _init_clusters(data, 'App Version Code'), _name_review_cluster
+    else:
+        raw, analyze_fn = _init_data(data, token_budget), _analyze_review
+    progress.get_reporter().start('Start analyzing data...')
+    describe = lambda version: f'dataset version {version}'
+
+    # Analyze all batches of all versions concurrently, each version is merged and reported as soon as it is analyzed
+    analyze_result = _analyze_groups(raw, analyze_fn, _merge_review, _bedrock_chat, describe, max_concurrency,
+                                     token_budget=token_budget, report_fn=_write_analysis_report, skipped=skipped,
+                                     previous=stored.previous if stored else None, designs=designs)
+    if stored is not None:
+        analyze_result = stored.save(analyze_result, skipped)
+
+    for version in analyze_result:
+        progress.get_reporter().report(f'Report completed: version {version}', analyze_result[version]["report"])
     return analyze_result
 
-@st.cache_data
-def analyze_data_without_version(data, _bedrock_chat):
+def analyze_data_without_version(data, _bedrock_chat, max_concurrency=DEFAULT_MAX_CONCURRENCY, token_budget=DEFAULT_INPUT_TOKEN_BUDGET):
     """
     Analyzes review data without version information using a language model provided by Amazon Bedrock.
 
     Args:
         data (pandas.DataFrame): A DataFrame containing review information.
             Expected columns: 'Review Text', and other review-related columns.
+        max_concurrency (int, optional): Maximum number of LLM calls in flight at once.
+        token_budget (int, optional): Maximum input tokens of review data per batch.
 
     Returns:
         dict: A dictionary containing:
             - "xmldata": The merged XML data from the analysis.
+            - "issues": The merged issue records.
             - "report": The generated report in markdown format.
 
         Example:
@@ -1067,66 +1717,36 @@ def analyze_data_without_version(data, _bedrock_chat):
             - "report": The generated report in markdown format.
 
     Note:
-        This function uses Streamlit (st) to display progress messages and reports during execution.
-        It also uses st.cache_data for caching the results.
+        Progress messages and reports go to the current progress reporter (see utils.progress.use_reporter).
+        Repeated LLM calls are served from the LLM response cache (see utils.llm_cache).
     """
     
-    data_removed_version = data.drop(columns=['App Version Code'])
-    raw = _init_data_without_version(data_removed_version) # raw is a list of docs
-    analyze_result = {}
-    st.markdown('''**Start analyzing data...**''')
-    chunk_result= []
-    for i, doc in enumerate(raw, start=1):
-        st.caption(f'''- Analyzing batch {i}, {len(doc.page_content.split('\n'))} items...''')
-        chunk_result.append(_analyze_review_without_version(doc.page_content, _bedrock_chat))
-    st.success(f"Analysis completed", icon="✅")
-    
-    if len(chunk_result) > 1:
-        st.caption(f'''Start merging dataset''')
-        analyze_result["xmldata"] = _merge_review_without_version(''.join(chunk_result), _bedrock_chat)
-        st.success(f"Merging dataset completed",icon="✅")
-    else:
-        analyze_result["xmldata"] = chunk_result[0]
-    
-    st.caption(f'''Start translating and writing report''')
-    analyze_result["report"] = _write_analysis_report(analyze_result["xmldata"], _bedrock_chat)
-    st.success(f"Report completed",icon="✅")
-    st.markdown(analyze_result["report"])
+    data_removed_version, skipped = _prefilter(data.drop(columns=['App Version Code']))
+    raw = _init_data_without_version(data_removed_version, token_budget) # raw is a list of docs
+    progress.get_reporter().start('Start analyzing data...')
+    analyze_result = _analyze_groups([(None, raw)], _analyze_review_without_version, _merge_review_without_version,
+                                     _bedrock_chat, lambda _: 'dataset', max_concurrency, token_budget=token_budget,
+                                     report_fn=_write_analysis_report, skipped=skipped)[None]
+    progress.get_reporter().report('Report completed', analyze_result["report"])
     return analyze_result
     
 
-@st.cache_data
-def analyze_data_without_version_by_lang(data, _bedrock_chat):
-    data_removed_version = data.drop(columns=['App Version Code'])
-    raw = _init_data_by_lang_without_version(data_removed_version)
-    st.markdown('''**Start analyzing data...**''')
-    analyze_result = {}
-    for lang in raw:
-        st.caption(f'''Start analyzing dataset language {lang}, total {len(raw[lang])} batches''')
-        analyze_result[lang]={}
-        chunk_result= []
-        docs = raw[lang]
-        for i, doc in enumerate(docs, start=1):
-            st.caption(f'''- Analyzing batch {i}, {len(doc.page_content.split('\n'))} items...''')
-            chunk_result.append(_analyze_review_by_lang_without_version(doc.page_content, _bedrock_chat))
-        st.success(f"Analysis of dataset language {lang} completed",icon="✅")
-
-        if len(chunk_result) > 1:
-            st.caption(f'''Start merging dataset language {lang}''')
-            analyze_result[lang]["xmldata"] = _merge_review_without_version_by_lang(''.join(chunk_result), _bedrock_chat)
-            st.success(f"Merging dataset language {lang} completed",icon="✅")
-        else:
-            analyze_result[lang]["xmldata"] = chunk_result[0]
-
-        st.caption(f'''Start translating and writing report: language {lang}''')
-        analyze_result[lang]["report"] = _write_analysis_report(analyze_result[lang]["xmldata"], _bedrock_chat)
-        st.success(f"Report completed: language {lang}",icon="✅")
-        st.markdown(analyze_result[lang]["report"])
+def analyze_data_without_version_by_lang(data, _bedrock_chat, max_concurrency=DEFAULT_MAX_CONCURRENCY, token_budget=DEFAULT_INPUT_TOKEN_BUDGET):
+    data_removed_version, skipped = _prefilter(data.drop(columns=['App Version Code']), 'Reviewer Language')
+    raw = _init_data_by_lang_without_version(data_removed_version, token_budget)
+    progress.get_reporter().start('Start analyzing data...')
+    describe = lambda lang: f'dataset language {lang}'
+    analyze_result = _analyze_groups(raw, _analyze_review_by_lang_without_version, _merge_review_without_version_by_lang,
+                                     _bedrock_chat, describe, max_concurrency, token_budget=token_budget,
+                                     report_fn=_write_analysis_report, skipped=skipped)
+
+    for lang in analyze_result:
+        progress.get_reporter().report(f'Report completed: language {lang}', analyze_result[lang]["report"])
     return analyze_result
 
 # Analyze data by language (main function)
-@st.cache_data
-def analyze_data_by_lang(data, _bedrock_chat):
+def analyze_data_by_lang(data, _bedrock_chat, max_concurrency=DEFAULT_MAX_CONCURRENCY, token_budget=DEFAULT_INPUT_TOKEN_BUDGET,
+                         store=None, scope=None, incremental=True, cluster=False, margin_of_error=None):
     """
     Analyzes review data by language and version using a language model provided by Amazon Bedrock.
 
@@ -1134,10 +1754,20 @@ def analyze_data_by_lang(data, _bedrock_chat):
         data (pandas.DataFrame): A DataFrame containing review information.
             Expected columns: 'App Version Code', 'Reviewer Language', 'Review Text', and other review-related columns.
         _bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
+        max_concurrency (int, optional): Maximum number of LLM calls in flight at once, across all languages and versions.
+        token_budget (int, optional): Maximum input tokens of review data per batch.
+        store (issue_store.IssueStore, optional): Stores the result of each (language, version), see analyze_data.
+        scope (optional): What else the stored results depend on, see analyze_data.
+        incremental (bool, optional): Fold new reviews into the stored results, or only reuse stored results
+            of exactly the same reviews, see analyze_data.
+        cluster (bool, optional): Cluster the reviews of each (language, version) locally and only send
+            representative reviews of each cluster to the model, see analyze_data.
+        margin_of_error (float, optional): Only analyze a stratified sample of each (language, version) and
+            scale the counts back, see analyze_data.
 
     Returns:
         dict: A nested dictionary containing analysis results for each language and version.
-            Structure: {language: {version: {'xmldata': str, 'report': str}}}
+            Structure: {language: {version: {'xmldata': str, 'issues': list, 'report': str}}}
 
     Example:
         Input:
@@ -1163,48 +1793,44 @@ def analyze_data_by_lang(data, _bedrock_chat):
             }
 
     Note:
-        This function uses Streamlit (st) to display progress messages and reports during execution.
-        It also uses st.cache_data for caching the results.
+        Progress messages and reports go to the current progress reporter (see utils.progress.use_reporter).
+        Repeated LLM calls are served from the LLM response cache (see utils.llm_cache).
     """
     # Initialize data
-    raw = _init_data_by_lang(data)
-    st.markdown('''**Start analyzing data...**''')
+    by = ['Reviewer Language', 'App Version Code']
+    if margin_of_error is not None and store is not None and incremental:
+        raise ValueError('Sampled analyses cannot be folded into stored results, use incremental=False')
+    stored = None
+    if store is not None:
+        scope = _store_scope('lang,version', _bedrock_chat, scope, cluster, margin_of_error)
+        stored = _StoredGroups(store, scope, by, incremental)
+        data = stored.split(data)
+    data, skipped = _prefilter(data, by)
+    data, designs = _sample(data, by, margin_of_error)
+    if cluster:
+        raw, analyze_fn = _init_clusters(data, by), _name_review_cluster
+    else:
+        raw, analyze_fn = _init_data_by_lang(data, token_budget), _analyze_review_by_lang
+    progress.get_reporter().start('Start analyzing data...')
+
+    # Every batch of every (lang, version) group is fanned out as soon as the group is split
+    describe = lambda key: f'dataset language {key[0]}, version {key[1]}'
+    results = _analyze_groups(raw, analyze_fn, _merge_review_by_lang, _bedrock_chat, describe,
+                              max_concurrency, merge_single=True, token_budget=token_budget,
+                              report_fn=_write_analysis_report, skipped=skipped, previous=stored.previous if stored else None,
+                              designs=designs)
+    if stored is not None:
+        results = stored.save(results, skipped)
+
     analyze_result = {}
-    
-    # Iterate through each language and each version of data for analysis
-    for lang in raw:
-        analyze_result[lang]={}
-        for version in raw[lang]:
-            docs = raw[lang][version]
-            analyze_result[lang][version]={}
-            st.caption(f'''Start analyzing dataset language {lang}, version {version}, total {len(docs)} batches''')
-            
-            # Analyze data in batches
-            chunk_result= []
-            for i, doc in enumerate(docs, start=1):
-                st.caption(f'''- Analyzing batch {i}, {len(doc.page_content.split('\n'))} items...''')
-                chunk_result.append(_analyze_review_by_lang(doc.page_content, _bedrock_chat))
-            st.success(f"Analysis of dataset language {lang}, version {version} completed",icon="✅")
-            
-            # Merge analysis results
-            st.caption(f'''Start merging dataset language {lang}, version {version}''')
-            
-            analyze_result[lang][version]["xmldata"]=_merge_review_by_lang(''.join(chunk_result), _bedrock_chat)
-            st.success(f"Merging dataset language {lang}, version {version} completed",icon="✅")
-            
-            # Generate report
-            st.caption(f'''Start translating and writing report: language {lang}, version {version}''')
-            
-            st.divider()
-            analyze_result[lang][version]["report"] = _write_analysis_report(analyze_result[lang][version]["xmldata"], _bedrock_chat)
-            st.success(f'''Report completed: language {lang}, version {version}''',icon="✅")
-            st.markdown(analyze_result[lang][version]["report"])
-            st.divider()
+    for (lang, version), result in results.items():
+        analyze_result.setdefault(lang, {})[version] = result
+        progress.get_reporter().report(f'Report completed: language {lang}, version {version}', analyze_result[lang][version]["report"])
     return analyze_result
 # Compare target version with baseline versions (classified by language)
 
 
-def analyze_data_by_lang_without_version(data, _bedrock_chat):
+def analyze_data_by_lang_without_version(data, _bedrock_chat, max_concurrency=DEFAULT_MAX_CONCURRENCY, token_budget=DEFAULT_INPUT_TOKEN_BUDGET):
     """
     Analyzes review data by language without version information using a language model provided by Amazon Bedrock.
 
@@ -1233,37 +1859,29 @@ def analyze_data_by_lang_without_version(data, _bedrock_chat):
             }
         
     """
-    data_removed_version = data.drop(columns=['App Version Code'])
-    raw = _init_data_by_lang_without_version(data_removed_version)
-    st.markdown('''**Start analyzing data...**''')
-    analyze_result = {}
-    
-    for lang in raw:
-        docs = raw[lang]
-        analyze_result[lang] = {}
-        st.caption(f'''Start analyzing dataset language {lang}, total {len(docs)} batches''')
-
-        chunk_result = []
-        for i, doc in enumerate(docs, start=1):
-            st.caption(f'''- Analyzing batch {i}, {len(doc.page_content.split('\n'))} items...''')
-            chunk_result.append(_analyze_review_by_lang_without_version(doc.page_content, _bedrock_chat))
-        st.success(f"Analysis of dataset language {lang} completed", icon="✅")
-
-        analyze_result[lang]["xmldata"] = _merge_review_without_version_by_lang(''.join(chunk_result), _bedrock_chat)
-        st.success(f"Merging dataset language {lang} completed", icon="✅")
+    data_removed_version, skipped = _prefilter(data.drop(columns=['App Version Code']), 'Reviewer Language')
+    raw = _init_data_by_lang_without_version(data_removed_version, token_budget)
+    progress.get_reporter().start('Start analyzing data...')
+    return _analyze_groups(raw, _analyze_review_by_lang_without_version, _merge_review_without_version_by_lang,
+                           _bedrock_chat, lambda lang: f'dataset language {lang}', max_concurrency, merge_single=True,
+                           token_budget=token_budget, skipped=skipped)
 
 def compare_target_data_by_lang(target_version_no, analyze_result, bedrock_chat):
     """
     Compares the target version's review data with baseline versions for each language.
 
+    The issue records of the versions are compared locally (see issue_diff.diff_versions): new, worse, better
+    and disappeared issues are found with significance tests, and the model only narrates the diff table.
+
     Args:
         target_version_no (str): The version number of the target data to compare.
         analyze_result (dict): A nested dictionary containing analysis results for each language and version.
-            Structure: {language: {version: {'xmldata': str, 'report': str}}}
+            Structure: {language: {version: {'xmldata': str, 'issues': list, 'report': str}}}
         bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
 
     Returns:
-        dict: A dictionary where keys are language codes and values are comparison reports in markdown format.
+        dict: A dictionary where keys are language codes and values are comparison reports in markdown format,
+            followed by the diff table.
 
     Example input:
         target_version_no = '2.0'
@@ -1287,17 +1905,11 @@ def compare_target_data_by_lang(target_version_no, analyze_result, bedrock_chat)
     """
     compare_result = {}
     for lang, versions in analyze_result.items():
-        target_data = ''
-        baseline_list = []
-        for version, data in versions.items():
-            if version == target_version_no:
-                target_data = data['xmldata']
-            else:
-                baseline_list.append(data['xmldata'])
-        st.caption(f'''Start comparing: language {lang}, target version {target_version_no}''')
-        compare_result[lang] = _compare_analysis_result_by_lang(target_data, ''.join(baseline_list), target_version_no, lang, bedrock_chat)
-        st.success(f'''Comparison completed: language {lang}, target version {target_version_no}''', icon="✅")
-        st.markdown(compare_result[lang])
+        progress.get_reporter().step(f'''Start comparing: language {lang}, target version {target_version_no}''')
+        with telemetry.labels(stage='compare', group=f'language {lang}'):
+            compare_result[lang] = _compare_versions(versions, target_version_no, _compare_analysis_result_by_lang,
+                                                     bedrock_chat, lang)
+        progress.get_reporter().report(f'''Comparison completed: language {lang}, target version {target_version_no}''', compare_result[lang])
     
     return compare_result
 
@@ -1306,14 +1918,18 @@ def compare_target_data(target_version_no, analyze_result, bedrock_chat):
     """
     Compares the target version's review data with baseline versions.
 
+    The issue records of the versions are compared locally (see issue_diff.diff_versions): new, worse, better
+    and disappeared issues are found with significance tests, and the model only narrates the diff table,
+    so the prompt does not grow with the number of baseline versions.
+
     Args:
         target_version_no (str): The version number of the target data to compare.
         analyze_result (dict): A dictionary containing analysis results for each version.
-            Structure: {version: {'xmldata': str, 'report': str}}
+            Structure: {version: {'xmldata': str, 'issues': list, 'report': str}}
         bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
 
     Returns:
-        str: A comparison report in markdown format.
+        str: A comparison report in markdown format, followed by the diff table.
 
     Example input:
         target_version_no = '2.0'
@@ -1324,18 +1940,219 @@ def compare_target_data(target_version_no, analyze_result, bedrock_chat):
         bedrock_chat = some_bedrock_chat_function
 
     Example output:
-        '**Comparative Report for Version 2.0**\n\nNew problems...'
+        '**Comparative Report for Version 2.0**\n\nNew problems...\n\n| Issue | Status | Target | Baselines | Δ share | p-value |...'
     """
-    compare_result = {}
-    target_data = ''
-    baseline_list = []
-    for version, data in analyze_result.items():
-        if version == target_version_no:
-            target_data = data['xmldata']
-        else:
-            baseline_list.append(data['xmldata'])
-    st.caption(f'''Start comparing: target version {target_version_no}''')
-    compare_result = _compare_analysis_result(target_data, ''.join(baseline_list), target_version_no, bedrock_chat)
-    st.success(f'''Comparison completed: target version {target_version_no}''', icon="✅")
-    st.markdown(compare_result)
-    return compare_result
\ No newline at end of file
+    progress.get_reporter().step(f'''Start comparing: target version {target_version_no}''')
+    with telemetry.labels(stage='compare', group=f'target version {target_version_no}'):
+        compare_result = _compare_versions(analyze_result, target_version_no, _compare_analysis_result, bedrock_chat)
+    progress.get_reporter().report(f'''Comparison completed: target version {target_version_no}''', compare_result)
+    return compare_result
+# Analysis and comparison functions of the command line --group-by option
+GROUP_BY = {
+    'version': (analyze_data, compare_target_data),
+    'lang,version': (analyze_data_by_lang, compare_target_data_by_lang),
+    'lang': (analyze_data_without_version_by_lang, None),
+    'none': (analyze_data_without_version, None),
+}
+
+def load_exports(paths, ratings=None):
+    """
+    Loads Play Console review exports from disk as review data, through the review store.
+
+    Args:
+        paths (list): Paths of exported CSV files.
+        ratings (list, optional): Star ratings to keep. All reviews if None.
+
+    Returns:
+        pandas.DataFrame: The REVIEW_COLUMNS of the concatenated exports, without duplicate reviews.
+    """
+    store = review_exports.get_default_store()
+    digests = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            digests.append(store.ingest(f.read()))
+    data = review_exports.to_review_data(store.read(digests))
+    if ratings is not None:
+        data = data[data['Star Rating'].isin(ratings)]
+    return data
+
+# Grouping modes of the command line that support incremental runs (store and scope arguments), local clustering
+# and sampling
+INCREMENTAL_GROUP_BY = ('version', 'lang,version')
+CLUSTER_GROUP_BY = INCREMENTAL_GROUP_BY
+SAMPLING_GROUP_BY = INCREMENTAL_GROUP_BY
+
+def run_analysis(data, bedrock_chat, group_by='version', target_version=None,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, token_budget=DEFAULT_INPUT_TOKEN_BUDGET, store=None, scope=None,
+                 cluster=False, margin_of_error=None):
+    """
+    Analyzes review data as the home page does, and compares the target version when given.
+
+    Args:
+        data (pandas.DataFrame): Review data, see load_exports.
+        bedrock_chat (function): A function that interfaces with the Amazon Bedrock language model.
+        group_by (str, optional): Key of GROUP_BY: 'version', 'lang,version', 'lang' or 'none'.
+        target_version (str, optional): Version compared with the other versions (grouping by version only).
+        max_concurrency (int, optional): Maximum number of LLM calls in flight at once.
+        token_budget (int, optional): Maximum input tokens of review data per batch.
+        store (issue_store.IssueStore, optional): Incremental run (INCREMENTAL_GROUP_BY only), see analyze_data.
+        scope (optional): What else the stored results depend on, see analyze_data.
+        cluster (bool, optional): Cluster reviews locally and only name the clusters with the model
+            (CLUSTER_GROUP_BY only), see analyze_data.
+        margin_of_error (float, optional): Only analyze a stratified sample of each group and scale the counts
+            back (SAMPLING_GROUP_BY only, without store), see analyze_data.
+
+    Returns:
+        dict: {'analysis': result of the analyze function, 'comparison': comparison report(s), if any}
+    """
+    analyze_fn, compare_fn = GROUP_BY[group_by]
+    options = {'store': store, 'scope': scope} if store is not None else {}
+    if cluster:
+        options['cluster'] = True
+    if margin_of_error is not None:
+        options['margin_of_error'] = margin_of_error
+    result = {'analysis': analyze_fn(data, bedrock_chat, max_concurrency=max_concurrency, token_budget=token_budget,
+                                     **options)}
+    if target_version is not None and compare_fn is not None:
+        result['comparison'] = compare_fn(target_version, result['analysis'], bedrock_chat)
+    return result
+
+def _markdown_reports(result, title='Report'):
+    # Analysis results are nested dicts (by language and/or version) ending with {'xmldata', 'issues', 'report'}
+    if 'report' in result:
+        return [f"## {title}\n\n{result['report']}"]
+    sections = []
+    for key, value in result.items():
+        if isinstance(value, dict):
+            sections += _markdown_reports(value, f'{title} {key}')
+    return sections
+
+def write_outputs(result, output_dir, name, metadata=None, metrics=None):
+    """
+    Writes the result of run_analysis to <output_dir>/<name>.json and <output_dir>/<name>.md, and the
+    per-call metrics (telemetry.RunMetrics) of the run to <output_dir>/<name>.calls.csv if given.
+
+    Returns:
+        tuple: Paths of the files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    json_path = os.path.join(output_dir, f'{name}.json')
+    md_path = os.path.join(output_dir, f'{name}.md')
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({**(metadata or {}), **result}, f, ensure_ascii=False, indent=2, default=str)
+
+    sections = _markdown_reports(result['analysis'])
+    comparison = result.get('comparison')
+    if isinstance(comparison, dict):
+        sections += [f'## Comparison {lang}\n\n{report}' for lang, report in comparison.items()]
+    elif comparison:
+        sections.append(f'## Comparison\n\n{comparison}')
+    with open(md_path, 'w', encoding='utf-8') as f:
+        f.write(f'# Review analysis: {name}\n\n' + '\n\n'.join(sections) + '\n')
+    if metrics is None:
+        return json_path, md_path
+    calls_path = os.path.join(output_dir, f'{name}.calls.csv')
+    metrics.to_csv(calls_path)
+    return json_path, md_path, calls_path
+
+def _input_name(path):
+    # Name of the outputs of an input analyzed separately: its file name without extension
+    return os.path.splitext(os.path.basename(path))[0]
+
+def _run_input(name, paths, bedrock_chat, args, token_budget):
+    logger = logging.getLogger('review_analyzer')
+    with progress.use_reporter(progress.LoggingReporter(logger, input=name)), telemetry.collect() as metrics:
+        data = load_exports(paths, args.ratings)
+        logger.info(json.dumps({'input': name, 'event': 'loaded', 'rows': len(data)}, ensure_ascii=False))
+        store = issue_store.get_default_store() if args.incremental else None
+        result = run_analysis(data, bedrock_chat, args.group_by, args.target, args.max_concurrency, token_budget,
+                              store, {'app': args.app or name, 'ratings': args.ratings}, args.cluster, args.margin_of_error)
+        metadata = {'input': paths, 'group_by': args.group_by, 'target_version': args.target, 'rows': len(data),
+                    'incremental': args.incremental, 'cluster': args.cluster, 'margin_of_error': args.margin_of_error,
+                    'metrics': metrics.totals()}
+        outputs = write_outputs(result, args.output_dir, name, metadata, metrics)
+        logger.info(json.dumps({'input': name, 'event': 'written', 'outputs': outputs, **metadata['metrics']},
+                               ensure_ascii=False))
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m utils.review_analyzer',
+                                     description='Analyzes Play Console review exports without the Streamlit app.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='Analyze exports and write JSON and Markdown reports')
+    run.add_argument('--input', nargs='+', required=True, help='Exported CSV files, each analyzed separately')
+    run.add_argument('--combine', action='store_true', help='Analyze all inputs together as one dataset')
+    run.add_argument('--group-by', default='version', choices=list(GROUP_BY))
+    run.add_argument('--target', help='Target version compared with the other versions')
+    run.add_argument('--ratings', default='1,2', type=lambda value: [int(x) for x in value.split(',')],
+                     help='Star ratings to analyze, comma separated (default: 1,2)')
+    run.add_argument('--output-dir', default='reports')
+    run.add_argument('--model-id', default=bedrock.list_translate_models()[0])
+    run.add_argument('--region', default=bedrock.list_bedrock_model_regions()[0])
+    run.add_argument('--all-regions', action='store_true', help='Spread calls across all configured regions')
+    run.add_argument('--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY,
+                     help='Maximum number of Bedrock calls in flight at once, per input')
+    run.add_argument('--jobs', type=int, default=4, help='Number of inputs analyzed in parallel')
+    run.add_argument('--incremental', action='store_true',
+                     help='Only analyze reviews not analyzed by previous runs, merging their issues into the stored '
+                          f'results (--group-by {" or ".join(INCREMENTAL_GROUP_BY)})')
+    run.add_argument('--app', help='App of the stored results of incremental runs (default: the input name)')
+    run.add_argument('--cluster', action='store_true',
+                     help='Cluster reviews locally and only send representative reviews of each cluster to the model, '
+                          f'to name its issue (--group-by {" or ".join(CLUSTER_GROUP_BY)})')
+    run.add_argument('--margin-of-error', type=float,
+                     help='Only analyze a stratified sample of each group sized for this margin of error, e.g. 0.05, '
+                          f'and scale the counts back (--group-by {" or ".join(SAMPLING_GROUP_BY)})')
+    args = parser.parse_args(argv)
+    if args.command == 'run' and args.incremental and args.group_by not in INCREMENTAL_GROUP_BY:
+        parser.error(f'--incremental requires --group-by {" or ".join(INCREMENTAL_GROUP_BY)}')
+    if args.command == 'run' and args.cluster and args.group_by not in CLUSTER_GROUP_BY:
+        parser.error(f'--cluster requires --group-by {" or ".join(CLUSTER_GROUP_BY)}')
+    if args.command == 'run' and args.margin_of_error is not None:
+        if args.group_by not in SAMPLING_GROUP_BY:
+            parser.error(f'--margin-of-error requires --group-by {" or ".join(SAMPLING_GROUP_BY)}')
+        if args.incremental:
+            parser.error('--margin-of-error cannot be combined with --incremental')
+        if not 0 < args.margin_of_error < 1:
+            parser.error('--margin-of-error must be between 0 and 1')
+    if not args.combine:
+        names = [_input_name(path) for path in args.input]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            parser.error(f'inputs analyzed separately must have different file names, '
+                         f'rename them or use --combine: {", ".join(duplicates)}')
+    return args
+
+def main(argv=None):
+    """
+    Command line entry point for scheduled report runs.
+
+    Example:
+        python -m utils.review_analyzer run --input exports/*.csv --group-by lang,version --target 2.3.1
+    """
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.all_regions:
+        bedrock_chat = bedrock_wrapper.get_multi_region_bedrock_chat(model_id=args.model_id)
+    else:
+        bedrock_chat = bedrock_wrapper.get_bedrock_chat(model_id=args.model_id, region_name=args.region)
+    token_budget = input_token_budget(args.model_id, DEFAULT_MAX_OUTPUT_TOKENS)
+
+    if args.combine:
+        inputs = {'combined': args.input}
+    else:
+        inputs = {_input_name(path): [path] for path in args.input}
+    failed = []
+    # Inputs share the chat, so their calls go through the same rate-limit scheduler
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {executor.submit(_run_input, name, paths, bedrock_chat, args, token_budget): name
+                   for name, paths in inputs.items()}
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                logging.exception('Analysis of %s failed', futures[future])
+                failed.append(futures[future])
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
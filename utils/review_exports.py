@@ -0,0 +1,163 @@
+import hashlib
+import io
+import os
+import threading
+import uuid
+import pandas as pd
+from utils.llm_cache import DEFAULT_CACHE_DIR
+
+# Ingested exports are stored under REVIEW_ANALYZER_CACHE_DIR/reviews, one Parquet file per export
+STORE_SUBDIR = 'reviews'
+
+# Play Console review exports are UTF-16 CSV files
+EXPORT_ENCODING = 'utf-16'
+
+# Low-cardinality columns stored as categoricals (dictionary encoded in Parquet)
+CATEGORICAL_COLUMNS = ['App Version Code', 'Reviewer Language', 'Device']
+DATETIME_COLUMNS = ['Review Last Update Date and Time']
+
+# Columns of the review data used by the pages and the analyzer
+REVIEW_COLUMNS = ['App Version Code', 'Reviewer Language', 'Device', 'Review Date',
+                  'Star Rating', 'Review Title', 'Review Text']
+
+
+def content_digest(data):
+    """Returns the sha256 hex digest of the bytes of an uploaded file."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_export(data):
+    """
+    Parses and normalizes one Play Console review export.
+
+    The version code is read as text ('N/A' when missing) instead of float, timestamps are parsed once
+    (as UTC) and low-cardinality columns are converted to categoricals.
+
+    Args:
+        data (bytes): Content of the exported CSV file.
+
+    Returns:
+        pandas.DataFrame: The normalized reviews.
+    """
+    df = pd.read_csv(io.BytesIO(data), encoding=EXPORT_ENCODING, dtype={'App Version Code': str})
+    if 'App Version Code' in df:
+        df['App Version Code'] = df['App Version Code'].fillna('N/A')
+    for column in DATETIME_COLUMNS:
+        if column in df:
+            # In UTC, so exports with different offsets still concatenate to one datetime column
+            df[column] = pd.to_datetime(df[column], format='mixed', utc=True)
+    return _to_categorical(df)
+
+
+def _to_categorical(df):
+    for column in CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    return df
+
+
+class ReviewStore:
+    """
+    Columnar on-disk store of ingested review exports.
+
+    Each export is parsed once (see parse_export) and saved as a Parquet file named after the sha256 of
+    its content, so the same file uploaded again, in a later rerun or session, is memory-mapped from
+    disk instead of re-parsed.
+
+    Example:
+        store = ReviewStore('/tmp/reviews')
+        digests = [store.ingest(f.getvalue()) for f in uploaded_file_list]
+        df = store.read(digests)
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest):
+        """Returns the Parquet file of an export."""
+        return os.path.join(self.root, f'{digest}.parquet')
+
+    def ingest(self, data):
+        """
+        Parses and stores an export unless it is already stored.
+
+        Args:
+            data (bytes): Content of the exported CSV file.
+
+        Returns:
+            str: Content digest of the export, see read.
+        """
+        digest = content_digest(data)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            # Write to a private file first so concurrent sessions never read a partial file
+            tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            try:
+                parse_export(data).to_parquet(tmp_path, index=False)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return digest
+
+    def read(self, digests):
+        """
+        Reads stored exports, concatenated in order and without duplicate reviews.
+
+        Args:
+            digests (list): Content digests returned by ingest.
+
+        Returns:
+            pandas.DataFrame: The reviews, with categorical version, language and device columns.
+        """
+        dfs = [pd.read_parquet(self.path(digest), memory_map=True) for digest in digests]
+        if not dfs:
+            return pd.DataFrame()
+        df = dfs[0] if len(dfs) == 1 else _to_categorical(pd.concat(dfs, ignore_index=True))
+        return df.drop_duplicates(keep='first', ignore_index=True)
+
+    def clear(self):
+        """Removes every stored export."""
+        for name in os.listdir(self.root):
+            if name.endswith('.parquet'):
+                os.remove(os.path.join(self.root, name))
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store():
+    """
+    Returns the process-wide review store.
+
+    Returns:
+        ReviewStore: Store in REVIEW_ANALYZER_CACHE_DIR/reviews (default ~/.cache/playstore-review-analysis/reviews).
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            cache_dir = os.environ.get('REVIEW_ANALYZER_CACHE_DIR', DEFAULT_CACHE_DIR)
+            _default_store = ReviewStore(os.path.join(cache_dir, STORE_SUBDIR))
+    return _default_store
+
+
+def to_review_data(raw):
+    """
+    Derives the review data used by the pages from the raw exports, without modifying raw.
+
+    'Review Date' is the day of the last update (midnight, timezone-naive), computed with vectorized
+    datetime operations.
+
+    Args:
+        raw (pandas.DataFrame): Exports as returned by ReviewStore.read.
+
+    Returns:
+        pandas.DataFrame: The REVIEW_COLUMNS of the reviews.
+    """
+    timestamps = raw['Review Last Update Date and Time']
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_localize(None)
+    # Column selection shares the raw data (copy-on-write), only 'Review Date' is new
+    return raw.assign(**{'Review Date': timestamps.dt.normalize()})[REVIEW_COLUMNS]
@@ -0,0 +1,54 @@
+import streamlit as st
+from utils import review_exports
+
+# Streamlit layer of the review exports: parsing and storage are in review_exports, which does not depend on
+# Streamlit, the results are cached per session here
+
+
+@st.cache_data(show_spinner=False)
+def _read_raw(digests):
+    return review_exports.get_default_store().read(list(digests))
+
+
+@st.cache_data(show_spinner=False)
+def _read_reviews(digests):
+    return review_exports.to_review_data(_read_raw(digests))
+
+
+def _ingest_files(files):
+    store = review_exports.get_default_store()
+    return tuple(store.ingest(file.getvalue()) for file in files)
+
+
+def load_raw_reviews(files):
+    """
+    Loads uploaded review exports as they were exported (normalized dtypes), see load_reviews.
+
+    Args:
+        files (list): Uploaded files (st.file_uploader) or any objects with getvalue() returning bytes.
+
+    Returns:
+        pandas.DataFrame: The concatenated exports without duplicate reviews.
+    """
+    return _read_raw(_ingest_files(files))
+
+
+def load_reviews(files):
+    """
+    Loads uploaded review exports as the review data shared by all pages.
+
+    Exports are ingested once into the review store (see review_exports.ReviewStore); the result is cached
+    with st.cache_data keyed on the content digests of the files, so widget interactions do not pay the parse cost again.
+
+    Args:
+        files (list): Uploaded files (st.file_uploader) or any objects with getvalue() returning bytes.
+
+    Returns:
+        pandas.DataFrame: The review_exports.REVIEW_COLUMNS of the concatenated exports, without duplicate reviews.
+
+    Example:
+        uploaded_file_list = st.file_uploader("上传一个或多个文件", accept_multiple_files=True)
+        if uploaded_file_list:
+            st.session_state.reviewdata = load_reviews(uploaded_file_list)
+    """
+    return _read_reviews(_ingest_files(files))
@@ -0,0 +1,138 @@
+import math
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+
+# Strata of the sample: 'Review Date' is a day (see review_exports.to_review_data)
+STRATA_COLUMNS = ('App Version Code', 'Reviewer Language', 'Star Rating', 'Review Date')
+# Margin of error of the share of an issue, and the confidence of the margin and of the intervals
+DEFAULT_MARGIN_OF_ERROR = 0.05
+DEFAULT_CONFIDENCE = 0.95
+
+
+def _z(confidence):
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+def sample_size(population, margin_of_error=DEFAULT_MARGIN_OF_ERROR, confidence=DEFAULT_CONFIDENCE):
+    """
+    Returns the number of reviews to sample so the share of any issue is within margin_of_error.
+
+    Cochran's sample size for a proportion in the worst case (50%), with the finite population correction,
+    so it stops growing with the population: about 385 reviews at ±5% and 95% confidence.
+
+    Example:
+        sample_size(100000, 0.05)  # 383
+        sample_size(200, 0.05)     # 132
+    """
+    if population <= 0:
+        return 0
+    z = _z(confidence)
+    n0 = z * z * 0.25 / margin_of_error ** 2
+    return min(population, math.ceil(n0 / (1 + (n0 - 1) / population)))
+
+
+def _allocate(sizes, n):
+    # Proportional allocation of n over strata, rounded with the largest remainders so it adds up to n
+    quotas = sizes * n / sizes.sum()
+    allocation = np.floor(quotas).astype(np.int64)
+    remainders = np.argsort(-(quotas - allocation), kind='stable')[:n - allocation.sum()]
+    allocation[remainders] += 1
+    return allocation
+
+
+def stratified_sample(df, by, margin_of_error=DEFAULT_MARGIN_OF_ERROR, confidence=DEFAULT_CONFIDENCE,
+                      strata=STRATA_COLUMNS, seed=0):
+    """
+    Draws a stratified random sample of each analysis group, sized for a target margin of error.
+
+    Each group (e.g. a version) gets sample_size(reviews of the group) reviews, allocated to its strata
+    (version, language, star rating and day) in proportion to their sizes, so every sampled review of a group
+    stands for about the same number of reviews and sample counts scale back with one factor (see scale_issues).
+
+    Args:
+        df (pandas.DataFrame): Review data.
+        by (str or list): Columns the analysis groups by, e.g. 'App Version Code'.
+        margin_of_error (float, optional): Target margin of error of the share of an issue in a group.
+        confidence (float, optional): Confidence level of the margin.
+        strata (tuple, optional): Stratification columns, those missing from df are ignored.
+        seed (int, optional): Random seed, the same data always gives the same sample.
+
+    Returns:
+        tuple: (sampled reviews in their order in df, df itself if no group is sampled,
+                dict of group key -> {'population', 'sample', 'margin_of_error', 'confidence'} of every group)
+
+    Example:
+        sample, designs = stratified_sample(df, 'App Version Code', 0.03)
+        designs  # {'1.0': {'population': 25000, 'sample': 1023, 'margin_of_error': 0.03, 'confidence': 0.95}}
+    """
+    columns = list(dict.fromkeys(([by] if isinstance(by, str) else list(by)) +
+                                 [column for column in strata if column in df.columns]))
+    keep = np.ones(len(df), dtype=bool)
+    designs = {}
+    if df.empty:
+        return df, designs
+    # Random order within each stratum: the first rows of a stratum are its sample
+    rank = pd.Series(np.random.default_rng(seed).random(len(df))).groupby(
+        [df[column].to_numpy() for column in columns], dropna=False).rank(method='first').to_numpy()
+    positions = pd.Series(np.arange(len(df)))
+    grouper = df[by].to_numpy() if isinstance(by, str) else [df[column].to_numpy() for column in by]
+    for key, group in positions.groupby(grouper, sort=False, dropna=False):
+        n = sample_size(len(group), margin_of_error, confidence)
+        designs[key] = {'population': len(group), 'sample': n, 'margin_of_error': margin_of_error,
+                        'confidence': confidence}
+        if n >= len(group):
+            continue
+        stratum = pd.Series(group.to_numpy()).groupby([df[column].to_numpy()[group.to_numpy()] for column in columns],
+                                                      sort=False, dropna=False).ngroup().to_numpy()
+        allocation = _allocate(np.bincount(stratum), n)
+        keep[group.to_numpy()] = rank[group.to_numpy()] <= allocation[stratum]
+    return (df[keep], designs) if not keep.all() else (df, designs)
+
+
+def scale_issues(records, design):
+    """
+    Scales the issue counts of a sampled group back to all its reviews, with confidence intervals.
+
+    The share of an issue is its count over the sample size; its interval is the normal approximation with the
+    finite population correction, so it is the count itself when the whole group was analyzed. The count of the
+    sample is kept as 'sample_count', for significance tests (see issue_diff.diff_versions).
+
+    Args:
+        records (list): Issue records of the sample, see issues.parse_issues.
+        design (dict): The group's design, see stratified_sample.
+
+    Returns:
+        tuple: (records with the estimated counts and their 'sample_count', [low, high] estimated count of each record)
+    """
+    population, sample = design['population'], design['sample']
+    counts = np.array([record['count'] for record in records], dtype=float)
+    share = np.clip(counts / max(sample, 1), 0, 1)
+    fpc = 1 - sample / population if population else 0.0
+    error = _z(design['confidence']) * np.sqrt(fpc * share * (1 - share) / max(sample - 1, 1))
+    low = np.floor(np.clip(share - error, 0, 1) * population).astype(np.int64)
+    high = np.ceil(np.clip(share + error, 0, 1) * population).astype(np.int64)
+    estimates = np.round(share * population).astype(np.int64)
+    scaled = [{**record, 'count': int(estimate), 'sample_count': record['count']}
+              for record, estimate in zip(records, estimates)]
+    return scaled, [[int(a), int(b)] for a, b in zip(low, high)]
+
+
+def format_estimates(records, estimate):
+    """
+    Formats the estimated counts of a sampled group and their confidence intervals as a markdown section.
+
+    Args:
+        records (list): Issue records with the estimated counts, see scale_issues.
+        estimate (dict): The group's design (see stratified_sample) with the 'intervals' of the records.
+    """
+    confidence = f"{estimate['confidence'] * 100:g}%"
+    lines = [
+        f"**Sampling**\n\nCounts are estimated from a stratified sample of {estimate['sample']} of "
+        f"{estimate['population']} reviews (by version, language, rating and day), margin of error "
+        f"±{estimate['margin_of_error'] * 100:g}% at {confidence} confidence.\n",
+        f"| Issue | Estimated count | {confidence} confidence interval |", '|---|---|---|',
+    ]
+    for record, (low, high) in zip(records, estimate['intervals']):
+        lines.append(f"| {str(record['category']).replace('|', '/')} | {record['count']} | {low}-{high} |")
+    return '\n'.join(lines)
@@ -0,0 +1,164 @@
+import contextvars
+import functools
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from utils.bedrock import get_model_pricing
+
+# Columns of the per-call metrics table
+CALL_COLUMNS = ['model_id', 'region', 'stage', 'group', 'input_tokens', 'output_tokens', 'tokens_estimated',
+                'ttft', 'latency', 'retries', 'cached', 'cost']
+
+_current_metrics = contextvars.ContextVar('run_metrics', default=None)
+_current_labels = contextvars.ContextVar('call_labels', default={})
+
+
+class RunMetrics:
+    """
+    Per-call metrics of one analysis run: one row per analyze/merge/report/compare call.
+
+    Rows have the CALL_COLUMNS:
+        model_id, region: The model called.
+        stage, group: 'analyze', 'merge', 'report' or 'compare', and the group label (see labels).
+        input_tokens, output_tokens: Usage reported by the model, or estimated when the model does not
+            report it while streaming (tokens_estimated is then True).
+        ttft, latency: Seconds to the first streamed chunk of the successful attempt, and seconds from
+            the start of the call (rate-limit waits and retries included) to its end.
+        retries: Attempts that were throttled or failed before the successful one.
+        cached: Served from the LLM response cache (no model call, no cost).
+        cost: USD, from the prices in config.yaml (None when unknown).
+
+    Example:
+        with telemetry.collect() as metrics:
+            review_analyzer.analyze_data(df, bedrock_chat)
+        metrics.summary('stage')
+        metrics.to_csv('calls.csv')
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Picklable (e.g. as a background job result), without the lock
+        with self._lock:
+            return {'calls': list(self.calls)}
+
+    def __setstate__(self, state):
+        self.calls = state['calls']
+        self._lock = threading.Lock()
+
+    def record(self, **fields):
+        """Adds a call; the cost is computed from model_id and the token counts."""
+        pricing = get_model_pricing(fields.get('model_id'))
+        if 'cost' not in fields:
+            if fields.get('cached'):
+                fields['cost'] = 0.0
+            elif pricing:
+                fields['cost'] = (fields.get('input_tokens', 0) * pricing.get('input', 0)
+                                  + fields.get('output_tokens', 0) * pricing.get('output', 0)) / 1000
+        with self._lock:
+            self.calls.append({column: fields.get(column) for column in CALL_COLUMNS})
+
+    def to_frame(self):
+        """Returns the calls as a DataFrame with the CALL_COLUMNS."""
+        with self._lock:
+            return pd.DataFrame(self.calls, columns=CALL_COLUMNS)
+
+    def summary(self, by='stage'):
+        """
+        Aggregates the calls by one or more columns.
+
+        Args:
+            by (str or list, optional): Columns to group by, e.g. 'stage', 'group' or ['stage', 'group'].
+
+        Returns:
+            pandas.DataFrame: calls, cached, retries, input/output tokens, cost and total/mean/max latency
+                and mean ttft per group, sorted by total latency (descending).
+        """
+        df = self.to_frame()
+        summary = df.groupby(by, dropna=False).agg(
+            calls=('latency', 'size'),
+            cached=('cached', 'sum'),
+            retries=('retries', 'sum'),
+            input_tokens=('input_tokens', 'sum'),
+            output_tokens=('output_tokens', 'sum'),
+            cost=('cost', 'sum'),
+            latency=('latency', 'sum'),
+            mean_latency=('latency', 'mean'),
+            max_latency=('latency', 'max'),
+            mean_ttft=('ttft', 'mean'),
+        )
+        return summary.sort_values('latency', ascending=False)
+
+    def totals(self):
+        """Returns the totals of the run: calls, cached calls, retries, tokens, cost and call latency."""
+        df = self.to_frame()
+        return {
+            'calls': len(df), 'cached': int(df['cached'].sum()), 'retries': int(df['retries'].sum()),
+            'input_tokens': int(df['input_tokens'].sum()), 'output_tokens': int(df['output_tokens'].sum()),
+            'cost': float(df['cost'].sum()), 'latency': float(df['latency'].sum()),
+        }
+
+    def to_csv(self, path=None):
+        """Writes the calls as CSV to path, or returns the CSV text if path is None."""
+        return self.to_frame().to_csv(path, index=False)
+
+    def to_json(self, path=None):
+        """Writes the calls as a JSON list of records to path, or returns the JSON text if path is None."""
+        return self.to_frame().to_json(path, orient='records', force_ascii=False, indent=2)
+
+
+def get_metrics():
+    """Returns the metrics collected in the current context (see collect), or None."""
+    return _current_metrics.get()
+
+
+@contextmanager
+def collect(metrics=None):
+    """
+    Records the metrics of every LLM call made in this block, including calls made by worker threads
+    that run in a copy of this context (see review_analyzer._BatchRunner).
+
+    Yields:
+        RunMetrics: The metrics of the run (metrics if given).
+    """
+    metrics = metrics if metrics is not None else RunMetrics()
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def get_labels():
+    """Returns the stage and group labels of calls made in the current context."""
+    return _current_labels.get()
+
+
+@contextmanager
+def labels(**values):
+    """
+    Labels the calls made in this block, e.g. labels(stage='compare', group='en').
+    """
+    token = _current_labels.set({**_current_labels.get(), **values})
+    try:
+        yield
+    finally:
+        _current_labels.reset(token)
+
+
+def with_labels(fn, **values):
+    """Returns fn wrapped to run with the given call labels, for tasks run on other threads."""
+    @functools.wraps(fn)
+    def labelled(*args, **kwargs):
+        with labels(**values):
+            return fn(*args, **kwargs)
+    return labelled
+
+
+def record_call(**fields):
+    """Adds a call to the metrics of the current context, with its labels. Does nothing outside collect."""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.record(**{**_current_labels.get(), **fields})